@@ -3,4 +3,13 @@ from flask import Flask
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'  # Change this to a secure random key in production
 
-from app import routes
\ No newline at end of file
+
+def create_app():
+    """Get the web app with its routes and their services set up
+
+    Routes and services are only brought up here and not on import, so
+    scripts and worker processes using app.models or app.services don't
+    start the web app's data service.
+    """
+    from app import routes
+    return app
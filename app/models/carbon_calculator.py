@@ -3,28 +3,75 @@ Carbon Footprint Monitor - Carbon Calculator
 Calculates carbon footprint based on user input data
 """
 
-from app.models.emission_factors import (
-    TRANSPORTATION_FACTORS,
-    ENERGY_FACTORS,
-    WASTE_FACTORS,
-    FOOD_FACTORS,
-    PRODUCT_FACTORS
-)
+import numpy as np
+
+from app.models.factor_plan import FACTOR_PLAN
+
+
+# Built-in categories in the order they are calculated
+CATEGORIES = ['transportation', 'energy', 'waste', 'food', 'products']
+
+# Category name -> handler(calculator, category_data), in calculation order
+CATEGORY_HANDLERS = {}
+
+# Profile fields flattened into columns for batch mode besides the categories
+PROFILE_FIELDS = ['user_type', 'employees', 'household_size']
+
+# Columns holding text values instead of numbers
+TEXT_COLUMNS = ['user_type', 'transportation.car.fuel_type', 'food.diet_type']
+
+
+def register_category(name, handler):
+    """Register the handler calculating the footprint of a category"""
+    CATEGORY_HANDLERS[name] = handler
 
 
 class CarbonCalculator:
     """Calculates carbon footprint based on user data"""
 
+    def __init__(self, plan=None, registry=None):
+        """Initializing the calculator with a factor plan
+
+        With a factor registry the plan is picked from the country and date
+        of each profile, falling back to the registry's default factors.
+        """
+        self.plan = plan or FACTOR_PLAN
+        self.registry = registry
+
+        # Calculators of the registry plans, keyed by plan version
+        self.plan_calculators = {}
+
+    def plan_for(self, data):
+        """Get the factor plan used for a profile"""
+        if self.registry is None:
+            return self.plan
+        return self.registry.plan_for(data)
+
+    def calculator_for(self, data):
+        """Get the calculator using the factor plan of a profile"""
+        plan = self.plan_for(data)
+        if plan is self.plan:
+            return self
+
+        calculator = self.plan_calculators.get(plan.version)
+        if calculator is None:
+            calculator = CarbonCalculator(plan)
+            self.plan_calculators[plan.version] = calculator
+        return calculator
+
     def calculate_footprint(self, data):
         """Calculate total carbon footprint from all categories"""
-         try:
+        if self.registry is not None:
+            return self.calculator_for(data).calculate_footprint(data)
+
+        try:
             results = {
                 'total': 0,
                 'categories': {}
             }
 
-            # Calculate footprint for each category
-            for category in ['transportation', 'energy', 'waste', 'food', 'products']:
+            # Calculate footprint for each registered category
+            for category in CATEGORY_HANDLERS:
                 if category in data:
                     category_footprint = self.calculate_category_footprint(category, data[category])
                     results['categories'][category] = category_footprint
@@ -32,11 +79,14 @@ class CarbonCalculator:
                     if isinstance(category_footprint, dict) and 'total' in category_footprint:
                         results['total'] += category_footprint['total']
 
-            # Adding capita results if it's an organization
-            if 'user_type' in data and data['user_type'] == 'Organization' and 'employees' in data and data['employees'] > 0:
-                results['per_capita'] = results['total'] / data['employees']
-            elif 'user_type' in data and data['user_type'] == 'Individual' and 'household_size' in data and data['household_size'] > 0:
-                results['per_capita'] = results['total'] / data['household_size']
+            # Adding capita results if it's an organization or a household
+            per_capita = self.calculate_per_capita(data, results['total'])
+            if per_capita is not None:
+                results['per_capita'] = per_capita
+
+            # Recording the factor set so the result can be reproduced
+            if self.plan.factor_set is not None:
+                results['factor_set'] = dict(self.plan.factor_set)
 
             return results
 
@@ -57,19 +107,20 @@ class CarbonCalculator:
             }
             return results
 
+    def calculate_per_capita(self, data, total):
+        """Calculate the per capita footprint, None if it does not apply"""
+        if 'user_type' in data and data['user_type'] == 'Organization' and 'employees' in data and data['employees'] > 0:
+            return total / data['employees']
+        elif 'user_type' in data and data['user_type'] == 'Individual' and 'household_size' in data and data['household_size'] > 0:
+            return total / data['household_size']
+        return None
+
     def calculate_category_footprint(self, category, data):
         """Calculate footprint for a specific category"""
         try:
-            if category == 'transportation':
-                return self.calculate_transport_footprint(data)
-            elif category == 'energy':
-                return self.calculate_energy_footprint(data)
-            elif category == 'waste':
-                return self.calculate_waste_footprint(data)
-            elif category == 'food':
-                return self.calculate_food_footprint(data)
-            elif category == 'products':
-                return self.calculate_products_footprint(data)
+            handler = CATEGORY_HANDLERS.get(category)
+            if handler is not None:
+                return handler(self, data)
             return {'total': 0, 'breakdown': {}}
         except Exception as e:
             # Handle category calculation errors
@@ -87,9 +138,8 @@ class CarbonCalculator:
                 fuel_type = car_data.get('fuel_type', 'petrol')
 
                 # Calculate annual car emissions
-                annual_km = weekly_km * 52
-                emission_factor = TRANSPORTATION_FACTORS['car'].get(fuel_type, TRANSPORTATION_FACTORS['car']['petrol'])
-                car_emissions = annual_km * emission_factor
+                annual_km = weekly_km * self.plan.weeks
+                car_emissions = annual_km * self.plan.car[fuel_type]
 
                 result['breakdown']['car'] = car_emissions
                 result['total'] += car_emissions
@@ -97,9 +147,8 @@ class CarbonCalculator:
             # Public transport emissions
             if 'public_transport' in data:
                 weekly_km = data['public_transport'].get('weekly_km', 0)
-                annual_km = weekly_km * 52
-                emission_factor = TRANSPORTATION_FACTORS['public_transport']['average']
-                public_transport_emissions = annual_km * emission_factor
+                annual_km = weekly_km * self.plan.weeks
+                public_transport_emissions = annual_km * self.plan.public_transport
 
                 result['breakdown']['public_transport'] = public_transport_emissions
                 result['total'] += public_transport_emissions
@@ -109,8 +158,8 @@ class CarbonCalculator:
                 short_flights = data['air_travel'].get('short_flights', 0)
                 long_flights = data['air_travel'].get('long_flights', 0)
 
-                short_flight_emission = short_flights * TRANSPORTATION_FACTORS['air_travel']['average_short']
-                long_flight_emission = long_flights * TRANSPORTATION_FACTORS['air_travel']['average_long']
+                short_flight_emission = short_flights * self.plan.short_flight
+                long_flight_emission = long_flights * self.plan.long_flight
                 flight_emissions = short_flight_emission + long_flight_emission
 
                 result['breakdown']['air_travel'] = flight_emissions
@@ -135,12 +184,12 @@ class CarbonCalculator:
                 monthly_kwh = data['electricity'].get('monthly_kwh', 0)
                 renewable_percentage = data['electricity'].get('renewable_percentage', 0) / 100
 
-                annual_kwh = monthly_kwh * 12
+                annual_kwh = monthly_kwh * self.plan.months
                 grid_kwh = annual_kwh * (1 - renewable_percentage)
                 renewable_kwh = annual_kwh * renewable_percentage
 
-                grid_emissions = grid_kwh * ENERGY_FACTORS['electricity']['grid']
-                renewable_emissions = renewable_kwh * ENERGY_FACTORS['electricity']['renewable']
+                grid_emissions = grid_kwh * self.plan.grid_electricity
+                renewable_emissions = renewable_kwh * self.plan.renewable_electricity
                 electricity_emissions = grid_emissions + renewable_emissions
 
                 result['breakdown']['electricity'] = electricity_emissions
@@ -149,12 +198,21 @@ class CarbonCalculator:
             # Natural gas emissions
             if 'gas' in data:
                 monthly_usage = data['gas'].get('monthly_usage', 0)
-                annual_usage = monthly_usage * 12
-                gas_emissions = annual_usage * ENERGY_FACTORS['natural_gas']
+                annual_usage = monthly_usage * self.plan.months
+                gas_emissions = annual_usage * self.plan.natural_gas
 
                 result['breakdown']['gas'] = gas_emissions
                 result['total'] += gas_emissions
 
+            # Heating oil emissions
+            if 'heating_oil' in data:
+                monthly_litres = data['heating_oil'].get('monthly_litres', 0)
+                annual_litres = monthly_litres * self.plan.months
+                heating_oil_emissions = annual_litres * self.plan.heating_oil
+
+                result['breakdown']['heating_oil'] = heating_oil_emissions
+                result['total'] += heating_oil_emissions
+
             return result
 
         except (ValueError, TypeError, ZeroDivisionError):
@@ -172,8 +230,8 @@ class CarbonCalculator:
             # General waste emissions
             if 'general_waste' in data:
                 weekly_kg = data['general_waste'].get('weekly_kg', 0)
-                annual_kg = weekly_kg * 52
-                waste_emissions = annual_kg * WASTE_FACTORS['general_waste']
+                annual_kg = weekly_kg * self.plan.weeks
+                waste_emissions = annual_kg * self.plan.general_waste
 
                 result['breakdown']['general_waste'] = waste_emissions
                 result['total'] += waste_emissions
@@ -187,9 +245,9 @@ class CarbonCalculator:
                 result['breakdown']['recycling'] = {}
 
                 for material, weekly_kg in recycling_data.items():
-                    if material in WASTE_FACTORS['recycling']:
-                        annual_kg = weekly_kg * 52
-                        material_emissions = annual_kg * WASTE_FACTORS['recycling'][material]
+                    if material in self.plan.recycling:
+                        annual_kg = weekly_kg * self.plan.weeks
+                        material_emissions = annual_kg * self.plan.recycling[material]
                         result['breakdown']['recycling'][material] = material_emissions
                         recycling_total += material_emissions
 
@@ -199,8 +257,8 @@ class CarbonCalculator:
             # Composting (emission saved)
             if 'composting' in data and data['composting'] and 'general_waste' in data:
                 # Assume 30% of waste could be composted if not already
-                potential_compost_kg = data['general_waste'].get('weekly_kg', 0) * 0.3 * 52
-                composting_savings = potential_compost_kg * WASTE_FACTORS['composting_reduction']
+                potential_compost_kg = data['general_waste'].get('weekly_kg', 0) * 0.3 * self.plan.weeks
+                composting_savings = potential_compost_kg * self.plan.composting_reduction
 
                 # If composting, subtract the savings from total
                 result['breakdown']['composting_benefits'] = -composting_savings
@@ -222,8 +280,8 @@ class CarbonCalculator:
 
             # Base diet emissions
             diet_type = data.get('diet_type', 'omnivore')
-            daily_emissions = FOOD_FACTORS['diet_type'].get(diet_type, FOOD_FACTORS['diet_type']['omnivore'])  # Fixed: was accessing incorrectly
-            annual_diet_emissions = daily_emissions * 365
+            daily_emissions = self.plan.diet[diet_type]
+            annual_diet_emissions = daily_emissions * self.plan.days
 
             result['breakdown']['base_diet'] = annual_diet_emissions
             result['total'] += annual_diet_emissions
@@ -236,10 +294,8 @@ class CarbonCalculator:
                 # Calculate specific meat emissions and subtract from base diet
                 # (since base diet already includes average meat consumption)
                 for meat_type, weekly_kg in meat_data.items():
-                    if meat_type in FOOD_FACTORS.get('meat_and_fish', {}):
-                        annual_kg = weekly_kg * 52
-                        type_emissions = annual_kg * FOOD_FACTORS['meat_and_fish'][meat_type]
-                        meat_emissions += type_emissions
+                    annual_kg = weekly_kg * self.plan.weeks
+                    meat_emissions += annual_kg * self.plan.meat[meat_type]
 
                 # Adjust if specific meat consumption is tracked
                 if meat_emissions > 0:
@@ -254,7 +310,7 @@ class CarbonCalculator:
             # Local food benefit
             local_percentage = data.get('local_food_percentage', 0) / 100
             if local_percentage > 0:
-                local_food_benefit = result['total'] * local_percentage * FOOD_FACTORS['local_food_reduction']
+                local_food_benefit = result['total'] * local_percentage * self.plan.local_food_reduction
                 result['breakdown']['local_food_benefit'] = -local_food_benefit
                 result['total'] -= local_food_benefit
 
@@ -277,13 +333,10 @@ class CarbonCalculator:
                 product_emissions = 0
 
                 # Calculate emissions for each product factory
+                # Unknown categories use the average factor of the plan
                 for category, monthly_amount in spending_data.items():
-                    annual_amount = monthly_amount * 12
-                    if category in PRODUCT_FACTORS:
-                        category_emissions = annual_amount * PRODUCT_FACTORS[category]
-                    else:
-                        # Use an average factor if specific category not found
-                        category_emissions = annual_amount * 0.5
+                    annual_amount = monthly_amount * self.plan.months
+                    category_emissions = annual_amount * self.plan.products[category]
 
                     result['breakdown'][category] = category_emissions
                     product_emissions += category_emissions
@@ -291,7 +344,7 @@ class CarbonCalculator:
                 # Secondhand benefit
                 secondhand_percentage = data.get('secondhand_percentage', 0) / 100
                 if secondhand_percentage > 0:
-                    secondhand_benefit = product_emissions * secondhand_percentage * PRODUCT_FACTORS['secondhand_reduction']
+                    secondhand_benefit = product_emissions * secondhand_percentage * self.plan.secondhand_reduction
                     result['breakdown']['secondhand_benefit'] = -secondhand_benefit
                     product_emissions -= secondhand_benefit
 
@@ -304,4 +357,264 @@ class CarbonCalculator:
             return {'total': 0, 'breakdown': {}, 'error': 'Invalid numeric values in products data'}
         except Exception as e:
             # Handle other products calculation errors
-            return {'total': 0, 'breakdown': {}, 'error': 'Error calculating products footprint'}
\ No newline at end of file
+            return {'total': 0, 'breakdown': {}, 'error': 'Error calculating products footprint'}
+
+    @staticmethod
+    def profiles_to_columns(profiles):
+        """Convert a list of user_data dicts into column arrays for calculate_batch"""
+        flat_profiles = []
+        names = []
+
+        for profile in profiles:
+            flat = {}
+            for field in PROFILE_FIELDS:
+                if field in profile:
+                    flat[field] = profile[field]
+
+            for category in CATEGORIES:
+                if category in profile and isinstance(profile[category], dict):
+                    _flatten_into(flat, category, profile[category])
+
+            # A food section without a diet type is calculated as omnivore
+            if 'food' in profile and 'food.diet_type' not in flat:
+                flat['food.diet_type'] = 'omnivore'
+
+            for name in flat:
+                if name not in names:
+                    names.append(name)
+            flat_profiles.append(flat)
+
+        # Text columns default to None (absent), numeric columns to zero
+        columns = {}
+        for name in names:
+            if name in TEXT_COLUMNS:
+                columns[name] = np.array([flat.get(name) for flat in flat_profiles], dtype=object)
+            else:
+                columns[name] = np.array([flat.get(name, 0) for flat in flat_profiles], dtype=float)
+
+        return columns
+
+    def calculate_batch(self, columns):
+        """Calculate footprints for many profiles at once from column arrays
+
+        Columns are keyed by the dotted path of the field in user_data, for
+        example 'transportation.car.weekly_km' or 'waste.recycling.paper'.
+        Missing columns count as zero and a profile without a 'food.diet_type'
+        has no food category, matching calculate_footprint. Every breakdown
+        entry is returned as an array, zero where calculate_footprint would
+        leave it out. 'per_capita' is NaN where it does not apply. All
+        profiles use the calculator's own factor plan.
+        """
+        size = _batch_size(columns)
+
+        def number(name):
+            if name in columns:
+                return np.asarray(columns[name], dtype=float)
+            return np.zeros(size)
+
+        def text(name):
+            if name in columns:
+                return np.asarray(columns[name], dtype=object)
+            return np.full(size, None, dtype=object)
+
+        results = {
+            'total': np.zeros(size),
+            'categories': {
+                'transportation': self.batch_transport_footprint(number, text),
+                'energy': self.batch_energy_footprint(number),
+                'waste': self.batch_waste_footprint(columns, number),
+                'food': self.batch_food_footprint(columns, number, text),
+                'products': self.batch_products_footprint(columns, number),
+            }
+        }
+
+        for category in CATEGORIES:
+            results['total'] = results['total'] + results['categories'][category]['total']
+
+        # Per capita for organizations by employees, for individuals by household
+        user_type = text('user_type')
+        employees = number('employees')
+        household_size = number('household_size')
+
+        divisor = np.where((user_type == 'Organization') & (employees > 0), employees,
+                           np.where((user_type == 'Individual') & (household_size > 0), household_size, np.nan))
+        results['per_capita'] = results['total'] / divisor
+
+        return results
+
+    def calculate_uncertainty(self, data, samples=10000, seed=None, uncertainty=None):
+        """Calculate p5, p50 and p95 bands of a footprint by Monte Carlo sampling
+
+        The emission factors are sampled once as a matrix and the profile is
+        evaluated for every sample in a single batch pass.
+        """
+        rng = np.random.default_rng(seed)
+        sampled_plan = self.plan_for(data).sample(samples, rng, uncertainty)
+
+        columns = self.profiles_to_columns([data])
+        batch = CarbonCalculator(sampled_plan).calculate_batch(columns)
+
+        def bands(values):
+            p5, p50, p95 = np.percentile(np.broadcast_to(values, (samples,)), [5, 50, 95])
+            return {'p5': float(p5), 'p50': float(p50), 'p95': float(p95)}
+
+        results = {
+            'samples': samples,
+            'total': bands(batch['total']),
+            'categories': {category: bands(batch['categories'][category]['total'])
+                           for category in CATEGORIES if category in data}
+        }
+
+        if self.calculate_per_capita(data, 1.0) is not None:
+            results['per_capita'] = bands(batch['per_capita'])
+
+        return results
+
+    def batch_transport_footprint(self, number, text):
+        """Calculate transportation footprint columns"""
+        # Car emissions, unknown fuel types fall back to petrol
+        fuel_type = text('transportation.car.fuel_type')
+        car_factor = self.plan.car.default
+        for fuel, factor in self.plan.car.items():
+            car_factor = np.where(fuel_type == fuel, factor, car_factor)
+        car = number('transportation.car.weekly_km') * self.plan.weeks * car_factor
+
+        # Public transport emissions
+        public_transport = number('transportation.public_transport.weekly_km') * self.plan.weeks * self.plan.public_transport
+
+        # Air travel emissions
+        air_travel = (number('transportation.air_travel.short_flights') * self.plan.short_flight
+                      + number('transportation.air_travel.long_flights') * self.plan.long_flight)
+
+        return {
+            'total': car + public_transport + air_travel,
+            'breakdown': {'car': car, 'public_transport': public_transport, 'air_travel': air_travel}
+        }
+
+    def batch_energy_footprint(self, number):
+        """Calculate energy footprint columns"""
+        # Electricity split between grid and renewable supply
+        annual_kwh = number('energy.electricity.monthly_kwh') * self.plan.months
+        renewable_percentage = number('energy.electricity.renewable_percentage') / 100
+        electricity = (annual_kwh * (1 - renewable_percentage) * self.plan.grid_electricity
+                       + annual_kwh * renewable_percentage * self.plan.renewable_electricity)
+
+        # Natural gas and heating oil emissions
+        gas = number('energy.gas.monthly_usage') * self.plan.months * self.plan.natural_gas
+        heating_oil = number('energy.heating_oil.monthly_litres') * self.plan.months * self.plan.heating_oil
+
+        return {
+            'total': electricity + gas + heating_oil,
+            'breakdown': {'electricity': electricity, 'gas': gas, 'heating_oil': heating_oil}
+        }
+
+    def batch_waste_footprint(self, columns, number):
+        """Calculate waste footprint columns"""
+        weekly_kg = number('waste.general_waste.weekly_kg')
+        general_waste = weekly_kg * self.plan.weeks * self.plan.general_waste
+        total = general_waste
+
+        # Recycling, only for materials with a known factor
+        recycling = {}
+        for material, factor in self.plan.recycling.items():
+            name = f'waste.recycling.{material}'
+            if name in columns:
+                recycling[material] = number(name) * self.plan.weeks * factor
+                total = total + recycling[material]
+
+        # Composting saves on 30% of the general waste
+        composting = number('waste.composting') != 0
+        composting_benefits = np.where(composting, -(weekly_kg * 0.3 * self.plan.weeks * self.plan.composting_reduction), 0.0)
+        total = total + composting_benefits
+
+        return {
+            'total': total,
+            'breakdown': {'general_waste': general_waste, 'recycling': recycling, 'composting_benefits': composting_benefits}
+        }
+
+    def batch_food_footprint(self, columns, number, text):
+        """Calculate food footprint columns"""
+        diet_type = text('food.diet_type')
+        has_food = diet_type != None
+
+        # Base diet emissions, unknown diets fall back to omnivore
+        daily_emissions = self.plan.diet.default
+        for diet, factor in self.plan.diet.items():
+            daily_emissions = np.where(diet_type == diet, factor, daily_emissions)
+        annual_diet_emissions = daily_emissions * self.plan.days
+
+        # Specific meat consumption replaces the estimated meat portion of the diet
+        specific_meat = np.zeros(len(diet_type))
+        for meat_type, factor in self.plan.meat.items():
+            name = f'food.meat_consumption.{meat_type}'
+            if name in columns:
+                specific_meat = specific_meat + number(name) * self.plan.weeks * factor
+
+        tracks_meat = specific_meat > 0
+        meat_portion = np.where(diet_type == 'omnivore', 0.5, 0.3)
+        base_diet = np.where(tracks_meat, annual_diet_emissions * (1 - meat_portion), annual_diet_emissions)
+        total = np.where(tracks_meat, annual_diet_emissions - annual_diet_emissions * meat_portion + specific_meat, annual_diet_emissions)
+
+        # Local food benefit
+        local_percentage = number('food.local_food_percentage') / 100
+        local_food_benefit = np.where(local_percentage > 0, -(total * local_percentage * self.plan.local_food_reduction), 0.0)
+        total = total + local_food_benefit
+
+        return {
+            'total': np.where(has_food, total, 0.0),
+            'breakdown': {
+                'base_diet': np.where(has_food, base_diet, 0.0),
+                'specific_meat': np.where(has_food, specific_meat, 0.0),
+                'local_food_benefit': np.where(has_food, local_food_benefit, 0.0),
+            }
+        }
+
+    def batch_products_footprint(self, columns, number):
+        """Calculate products footprint columns"""
+        prefix = 'products.monthly_spending.'
+        breakdown = {}
+        product_emissions = 0
+
+        # Unknown spending categories use the average factor
+        for name in columns:
+            if name.startswith(prefix):
+                category = name[len(prefix):]
+                breakdown[category] = number(name) * self.plan.months * self.plan.products[category]
+                product_emissions = product_emissions + breakdown[category]
+
+        # Secondhand benefit
+        secondhand_percentage = number('products.secondhand_percentage') / 100
+        secondhand_benefit = np.where(secondhand_percentage > 0,
+                                      -(product_emissions * secondhand_percentage * self.plan.secondhand_reduction), 0.0)
+        breakdown['secondhand_benefit'] = secondhand_benefit
+
+        return {
+            'total': product_emissions + secondhand_benefit,
+            'breakdown': breakdown
+        }
+
+
+# Built-in categories, more can be added with register_category
+register_category('transportation', CarbonCalculator.calculate_transport_footprint)
+register_category('energy', CarbonCalculator.calculate_energy_footprint)
+register_category('waste', CarbonCalculator.calculate_waste_footprint)
+register_category('food', CarbonCalculator.calculate_food_footprint)
+register_category('products', CarbonCalculator.calculate_products_footprint)
+
+
+def _flatten_into(flat, prefix, data):
+    """Flatten nested user_data values into dotted column names"""
+    for key, value in data.items():
+        name = f'{prefix}.{key}'
+        if isinstance(value, dict):
+            _flatten_into(flat, name, value)
+        elif name in TEXT_COLUMNS or isinstance(value, (int, float)):
+            flat[name] = value
+
+
+def _batch_size(columns):
+    """Get the number of profiles in a set of columns"""
+    sizes = {len(values) for values in columns.values()}
+    if len(sizes) > 1:
+        raise ValueError('All batch columns must have the same length')
+    return sizes.pop() if sizes else 0
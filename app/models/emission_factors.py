@@ -101,4 +101,54 @@ REDUCTION_POTENTIAL = {
         'buy_secondhand': 0.8,       # 80% reduction by buying secondhand
         'extend_product_life': 0.3,  # 30% reduction by extending product lifespan
     }
-}
\ No newline at end of file
+}
+
+
+# Effort to adopt each reduction action (1 = easy, 5 = hard)
+REDUCTION_EFFORT = {
+    'transportation': {
+        'car_to_public': 3,
+        'car_to_bike': 4,
+        'petrol_to_electric': 5,
+        'reduce_flights': 2,
+    },
+    'energy': {
+        'renewable_electricity': 1,
+        'energy_efficient_appliances': 3,
+        'improved_insulation': 4,
+        'smart_thermostat': 1,
+    },
+    'waste': {
+        'zero_waste': 3,
+        'start_composting': 2,
+    },
+    'food': {
+        'reduce_red_meat': 2,
+        'vegetarian_diet': 3,
+        'vegan_diet': 4,
+        'local_food': 2,
+    },
+    'products': {
+        'reduce_consumption': 2,
+        'buy_secondhand': 2,
+        'extend_product_life': 1,
+    }
+}
+
+
+# Relative uncertainty of the emission factors by factor group, used as the
+# standard deviation of a log-normal distribution around each point estimate
+FACTOR_UNCERTAINTY = {
+    'car': 0.15,
+    'public_transport': 0.20,
+    'air_travel': 0.30,
+    'electricity': 0.20,
+    'energy': 0.05,           # natural gas and heating oil combustion
+    'waste': 0.30,
+    'recycling': 0.50,
+    'diet': 0.25,
+    'meat': 0.30,
+    'products': 0.40,
+    'average': 0.50,          # average factor for unknown spending categories
+    'reduction': 0.25,        # local food and secondhand reductions
+}
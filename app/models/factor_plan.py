@@ -0,0 +1,179 @@
+"""
+Carbon Footprint Monitor - Factor Plan
+Flattens the emission factors into pre-resolved coefficients for the calculator
+"""
+
+import hashlib
+import json
+
+import numpy as np
+
+from app.models.emission_factors import (
+    TRANSPORTATION_FACTORS,
+    ENERGY_FACTORS,
+    WASTE_FACTORS,
+    FOOD_FACTORS,
+    PRODUCT_FACTORS,
+    FACTOR_UNCERTAINTY
+)
+
+
+# Average factor for spending categories without a specific factor
+AVERAGE_PRODUCT_FACTOR = 0.5
+
+# Coefficients that are shares between 0 and 1 rather than emission factors
+SHARE_COEFFICIENTS = ('reduction.local_food', 'reduction.secondhand', 'waste.composting_reduction')
+
+
+class FactorTable(dict):
+    """Factor lookup table whose fallback is resolved when the plan is built"""
+
+    def __init__(self, factors, default):
+        """Initializing the table with its fallback factor"""
+        super().__init__(factors)
+        self.default = default
+
+    def __missing__(self, key):
+        """Unknown keys resolve to the fallback factor"""
+        return self.default
+
+
+class FactorPlan:
+    """Pre-resolved emission factors used by the carbon calculator"""
+
+    def __init__(self, coefficients, weeks=52, months=12, days=365, factor_set=None):
+        """Initializing the plan from flat 'group.name' coefficients"""
+        self.coefficients = dict(coefficients)
+
+        # Periods used to annualize weekly, monthly and daily values
+        self.weeks = weeks
+        self.months = months
+        self.days = days
+
+        c = self.coefficients
+
+        # Version stamp, computed on first use
+        self._version = None
+
+        # Factor set version, country and year when built by the factor registry
+        self.factor_set = factor_set
+
+        # Lookup tables, unknown keys fall back to the default of each table
+        self.car = FactorTable(self.group('car'), c['car.petrol'])
+        self.diet = FactorTable(self.group('diet'), c['diet.omnivore'])
+        self.meat = FactorTable(self.group('meat'), 0.0)
+        self.products = FactorTable(self.group('products'), c['average.products'])
+        self.recycling = self.group('recycling')
+
+        # Single factors
+        self.public_transport = c['public_transport.average']
+        self.short_flight = c['air_travel.average_short']
+        self.long_flight = c['air_travel.average_long']
+        self.grid_electricity = c['electricity.grid']
+        self.renewable_electricity = c['electricity.renewable']
+        self.natural_gas = c['energy.natural_gas']
+        self.heating_oil = c['energy.heating_oil']
+        self.general_waste = c['waste.general_waste']
+        self.composting_reduction = c['waste.composting_reduction']
+        self.local_food_reduction = c['reduction.local_food']
+        self.secondhand_reduction = c['reduction.secondhand']
+
+    @property
+    def version(self):
+        """Short stamp changing whenever a factor, period or factor set changes
+
+        The factor set is part of the stamp so that plans of different
+        countries or years with the same factors are cached apart, and the
+        factor set recorded in results stays right.
+        """
+        if self._version is None:
+            canonical = json.dumps([self.coefficients, self.weeks, self.months, self.days, self.factor_set],
+                                   sort_keys=True, default=str)
+            self._version = hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:12]
+        return self._version
+
+    def sample(self, samples, rng, uncertainty=None):
+        """Draw a plan whose coefficients are arrays of sampled factors
+
+        All coefficients are drawn as one log-normal matrix around the point
+        estimates, with the relative uncertainty of their factor group.
+        Shares are drawn from a beta distribution with the same mean and
+        spread instead, so they stay between 0 and 1.
+        """
+        uncertainty = FACTOR_UNCERTAINTY if uncertainty is None else uncertainty
+
+        names = list(self.coefficients)
+        values = np.array([self.coefficients[name] for name in names], dtype=float)
+        sigmas = np.array([uncertainty.get(name.split('.')[0], 0.0) for name in names])
+
+        multipliers = np.exp(rng.standard_normal((len(names), samples)) * sigmas[:, None])
+        sampled = dict(zip(names, values[:, None] * multipliers))
+
+        for name in SHARE_COEFFICIENTS:
+            if name in sampled:
+                sampled[name] = sample_share(self.coefficients[name], uncertainty.get(name.split('.')[0], 0.0),
+                                             samples, rng)
+
+        return FactorPlan(sampled, self.weeks, self.months, self.days)
+
+    def group(self, prefix):
+        """Get the coefficients of one group keyed by name"""
+        prefix = prefix + '.'
+        return {name[len(prefix):]: value for name, value in self.coefficients.items() if name.startswith(prefix)}
+
+
+def sample_share(mean, sigma, samples, rng):
+    """Draw samples of a share from a beta distribution with a relative standard deviation of sigma"""
+    mean = float(np.clip(mean, 0.0, 1.0))
+    variance = (mean * sigma) ** 2
+
+    # A beta distribution can't be that wide, or the share has no spread
+    if variance <= 0 or variance >= mean * (1 - mean):
+        return np.clip(mean * np.exp(rng.standard_normal(samples) * sigma), 0.0, 1.0)
+
+    concentration = mean * (1 - mean) / variance - 1
+    return rng.beta(mean * concentration, (1 - mean) * concentration, samples)
+
+
+def build_factor_plan():
+    """Build the factor plan from the emission factor tables"""
+    coefficients = {}
+
+    # Transportation
+    for fuel, factor in TRANSPORTATION_FACTORS['car'].items():
+        coefficients[f'car.{fuel}'] = factor
+    coefficients['public_transport.average'] = TRANSPORTATION_FACTORS['public_transport']['average']
+    coefficients['air_travel.average_short'] = TRANSPORTATION_FACTORS['air_travel']['average_short']
+    coefficients['air_travel.average_long'] = TRANSPORTATION_FACTORS['air_travel']['average_long']
+
+    # Energy
+    coefficients['electricity.grid'] = ENERGY_FACTORS['electricity']['grid']
+    coefficients['electricity.renewable'] = ENERGY_FACTORS['electricity']['renewable']
+    coefficients['energy.natural_gas'] = ENERGY_FACTORS['natural_gas']
+    coefficients['energy.heating_oil'] = ENERGY_FACTORS['heating_oil']
+
+    # Waste
+    coefficients['waste.general_waste'] = WASTE_FACTORS['general_waste']
+    coefficients['waste.composting_reduction'] = WASTE_FACTORS['composting_reduction']
+    for material, factor in WASTE_FACTORS['recycling'].items():
+        coefficients[f'recycling.{material}'] = factor
+
+    # Food
+    for diet, factor in FOOD_FACTORS['diet_type'].items():
+        coefficients[f'diet.{diet}'] = factor
+    for meat_type, factor in FOOD_FACTORS['meat_and_flesh'].items():
+        coefficients[f'meat.{meat_type}'] = factor
+    coefficients['reduction.local_food'] = FOOD_FACTORS['local_food_reduction']
+
+    # Products
+    for category, factor in PRODUCT_FACTORS.items():
+        if category != 'secondhand_reduction':
+            coefficients[f'products.{category}'] = factor
+    coefficients['average.products'] = AVERAGE_PRODUCT_FACTOR
+    coefficients['reduction.secondhand'] = PRODUCT_FACTORS['secondhand_reduction']
+
+    return FactorPlan(coefficients)
+
+
+# Plan built once at import and shared by all calculators
+FACTOR_PLAN = build_factor_plan()
@@ -0,0 +1,148 @@
+"""
+Carbon Footprint Monitor - Factor Registry
+Country- and year-specific emission factor sets loaded from bundled files
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from app.models.factor_plan import FACTOR_PLAN, FactorPlan
+
+
+# Directory of the bundled factor set files, one '<version>.json' per set
+FACTOR_SETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'factor_sets')
+
+
+class FactorSet:
+    """One loaded factor set version, indexed by (country, year)"""
+
+    def __init__(self, version, data, base_plan):
+        """Building the index of the factor set"""
+        self.version = version
+        self.description = data.get('description', '')
+
+        default = dict(base_plan.coefficients)
+        default.update(data.get('default', {}))
+        self.default_coefficients = default
+
+        # (country, year) -> coefficients, every year between the first and last
+        # year of a country resolves to its latest data at or before that year
+        self.index = {}
+        self.year_range = {}
+        self.countries = {}
+
+        for country, years in data.get('countries', {}).items():
+            key = country.casefold()
+            self.countries[key] = country
+
+            available = sorted(int(year) for year in years)
+            self.year_range[key] = (available[0], available[-1])
+
+            coefficients = None
+            for year in range(available[0], available[-1] + 1):
+                if str(year) in years:
+                    coefficients = dict(default)
+                    coefficients.update(years[str(year)])
+                self.index[(key, year)] = coefficients
+
+        # Plans built so far, keyed like the index
+        self.plans = {}
+        self.weeks, self.months, self.days = base_plan.weeks, base_plan.months, base_plan.days
+
+    def get_plan(self, country=None, year=None):
+        """Get the plan of a country and year, falling back to the default factors"""
+        key = country.casefold() if isinstance(country, str) else None
+
+        if key in self.year_range:
+            first, last = self.year_range[key]
+            year = last if year is None else min(max(int(year), first), last)
+            index_key = (key, year)
+            factor_set = {'version': self.version, 'country': self.countries[key], 'year': year}
+        else:
+            index_key = (None, None)
+            factor_set = {'version': self.version, 'country': None, 'year': None}
+
+        plan = self.plans.get(index_key)
+        if plan is None:
+            coefficients = self.index.get(index_key, self.default_coefficients)
+            plan = FactorPlan(coefficients, self.weeks, self.months, self.days, factor_set)
+            self.plans[index_key] = plan
+
+        return plan
+
+
+class FactorRegistry:
+    """Registry of factor sets keyed by (country, year, version)
+
+    Factor set files are only parsed when a version is first used and at
+    most max_loaded versions are kept in memory at a time.
+    """
+
+    def __init__(self, factor_sets_dir=FACTOR_SETS_DIR, default_version=None, max_loaded=2, base_plan=FACTOR_PLAN):
+        """Initializing the registry without loading any factor set"""
+        self.factor_sets_dir = factor_sets_dir
+        self.max_loaded = max_loaded
+        self.base_plan = base_plan
+
+        self.loaded = OrderedDict()
+        self.lock = threading.Lock()
+
+        versions = self.get_versions()
+        self.default_version = default_version or (versions[-1] if versions else None)
+
+    def get_versions(self):
+        """Get the available factor set versions, oldest first"""
+        if not os.path.isdir(self.factor_sets_dir):
+            return []
+
+        versions = [filename[:-len('.json')] for filename in os.listdir(self.factor_sets_dir)
+                    if filename.endswith('.json')]
+        return sorted(versions, key=_version_key)
+
+    def load(self, version):
+        """Get a factor set, loading its file on first use"""
+        with self.lock:
+            factor_set = self.loaded.get(version)
+            if factor_set is not None:
+                self.loaded.move_to_end(version)
+                return factor_set
+
+        filepath = os.path.join(self.factor_sets_dir, f"{version}.json")
+        if not os.path.exists(filepath):
+            raise KeyError(f"Unknown factor set version: {version}")
+
+        with open(filepath, 'r') as f:
+            factor_set = FactorSet(version, json.load(f), self.base_plan)
+
+        with self.lock:
+            self.loaded[version] = factor_set
+            while len(self.loaded) > self.max_loaded:
+                self.loaded.popitem(last=False)
+
+        return factor_set
+
+    def get_plan(self, country=None, year=None, version=None):
+        """Get the factor plan of a country, year and version"""
+        version = version or self.default_version
+        if version is None:
+            return self.base_plan
+        return self.load(version).get_plan(country, year)
+
+    def plan_for(self, data):
+        """Get the factor plan for user data from its country and date"""
+        return self.get_plan(data.get('country'), _data_year(data))
+
+
+def _data_year(data):
+    """Get the year of the user data's date, None if unknown"""
+    date = data.get('date')
+    if isinstance(date, str) and date[:4].isdigit():
+        return int(date[:4])
+    return None
+
+
+def _version_key(version):
+    """Sort key ordering versions like '2025.1' numerically"""
+    return [int(part) if part.isdigit() else part for part in version.split('.')]
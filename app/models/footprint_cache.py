@@ -0,0 +1,119 @@
+"""
+Carbon Footprint Monitor - Footprint Cache
+Memoizes footprint results keyed by a canonical hash of the input data
+"""
+
+import copy
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from app.models.carbon_calculator import CATEGORY_HANDLERS, PROFILE_FIELDS
+
+
+def normalize_input(data):
+    """Normalize input values so equal inputs hash the same, numbers as floats"""
+    if isinstance(data, dict):
+        return {key: normalize_input(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [normalize_input(value) for value in data]
+    if isinstance(data, (int, float)) and not isinstance(data, bool):
+        return float(data)
+    return data
+
+
+class MemoizedCalculator:
+    """Bounded LRU memo in front of a calculator's calculate_footprint"""
+
+    def __init__(self, calculator, max_entries=256):
+        """Initializing the memo around a calculator"""
+        self.calculator = calculator
+        self.max_entries = max_entries
+
+        # Input hash -> footprint results, least recently used first
+        self.cache = OrderedDict()
+
+        # (input hash, samples, seed) -> uncertainty bands, least recently used first
+        self.bands = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def cache_key(self, data):
+        """Get the canonical hash of the input data and the factor version"""
+        relevant = {key: value for key, value in data.items() if key in CATEGORY_HANDLERS or key in PROFILE_FIELDS}
+        canonical = json.dumps(normalize_input(relevant), sort_keys=True, separators=(',', ':'), default=str)
+
+        digest = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+        return f"{self.calculator.plan_for(data).version}:{digest}"
+
+    def calculate_footprint(self, data):
+        """Get the footprint from the memo or calculate it"""
+        key = self.cache_key(data)
+
+        with self.lock:
+            results = self.cache.get(key)
+            if results is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(results)
+            self.misses += 1
+
+        results = self.calculator.calculate_footprint(data)
+
+        # Errors are not memoized so they are retried on the next request
+        if 'error' not in results:
+            with self.lock:
+                self.cache[key] = results
+                while len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
+                    self.evictions += 1
+
+        return copy.deepcopy(results)
+
+    def calculate_uncertainty(self, data, samples=10000, seed=None):
+        """Get the uncertainty bands from the memo or calculate them
+
+        Bands are kept under the same input key as the footprint, and only
+        for a fixed seed since unseeded draws differ on every call.
+        """
+        if seed is None:
+            return self.calculator.calculate_uncertainty(data, samples=samples)
+
+        key = (self.cache_key(data), samples, seed)
+
+        with self.lock:
+            bands = self.bands.get(key)
+            if bands is not None:
+                self.bands.move_to_end(key)
+                return copy.deepcopy(bands)
+
+        bands = self.calculator.calculate_uncertainty(data, samples=samples, seed=seed)
+
+        with self.lock:
+            self.bands[key] = bands
+            while len(self.bands) > self.max_entries:
+                self.bands.popitem(last=False)
+
+        return copy.deepcopy(bands)
+
+    def stats(self):
+        """Get the memo counters"""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.cache),
+                'max_entries': self.max_entries,
+            }
+
+    def clear(self):
+        """Clear the memo, keeping the counters"""
+        with self.lock:
+            self.cache.clear()
+            self.bands.clear()
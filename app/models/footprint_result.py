@@ -0,0 +1,292 @@
+"""
+Carbon Footprint Monitor - Footprint Results
+Compact result objects for bulk imports and report histories
+"""
+
+from array import array
+
+
+# Shared layouts, so results of the same shape store their structure once
+_layouts = {}
+
+
+def _intern(layout):
+    """Get the shared copy of a layout"""
+    return _layouts.setdefault(layout, layout)
+
+
+def _breakdown_layout(breakdown, values):
+    """Append breakdown values to an array and get their layout
+
+    Items are listed in order, nested items as (item, (subitem, ...)) pairs.
+    """
+    layout = []
+    for item, value in breakdown.items():
+        if isinstance(value, dict):
+            layout.append((item, tuple(value)))
+            values.extend(value.values())
+        else:
+            layout.append(item)
+            values.append(value)
+    return tuple(layout)
+
+
+def _breakdown_dict(layout, values, position):
+    """Rebuild a breakdown dict from its layout and values"""
+    breakdown = {}
+    for entry in layout:
+        if isinstance(entry, tuple):
+            item, subitems = entry
+            breakdown[item] = dict(zip(subitems, values[position:position + len(subitems)]))
+            position += len(subitems)
+        else:
+            breakdown[entry] = values[position]
+            position += 1
+    return breakdown, position
+
+
+def _breakdown_size(layout):
+    """Count the values of a breakdown layout"""
+    return sum(len(entry[1]) if isinstance(entry, tuple) else 1 for entry in layout)
+
+
+class CategoryResult:
+    """Footprint of one category with its breakdown values in a float array"""
+
+    __slots__ = ('total', 'layout', 'values', 'error')
+
+    def __init__(self, total, layout=(), values=None, error=None):
+        """Initializing the category result"""
+        self.total = total
+        self.layout = _intern(layout)
+        self.values = values if values is not None else array('d')
+        self.error = error
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a category result from a calculator dict"""
+        values = array('d')
+        layout = _breakdown_layout(data.get('breakdown', {}), values)
+        return cls(data.get('total', 0), layout, values, data.get('error'))
+
+    def to_dict(self):
+        """Convert back into the calculator's dict format"""
+        result = {'total': self.total, 'breakdown': _breakdown_dict(self.layout, self.values, 0)[0]}
+        if self.error is not None:
+            result['error'] = self.error
+        return result
+
+
+class FootprintResult:
+    """Footprint results of one profile backed by a single float array
+
+    The array holds the total, the per capita value (NaN when it does not
+    apply) and then each category total followed by its breakdown values.
+    The shared layout names the categories and breakdown items. Anything
+    else, such as uncertainty bands or the factor set, is kept in extras.
+    """
+
+    __slots__ = ('layout', 'values', 'extras')
+
+    def __init__(self, layout, values, extras=None):
+        """Initializing the footprint result"""
+        self.layout = _intern(layout)
+        self.values = values
+        self.extras = extras or None
+
+    @property
+    def total(self):
+        """Total footprint"""
+        return self.values[0]
+
+    @property
+    def per_capita(self):
+        """Per capita footprint, None if it does not apply"""
+        value = self.values[1]
+        return None if value != value else value
+
+    @property
+    def names(self):
+        """Category names in order"""
+        return tuple(entry[0] for entry in self.layout)
+
+    @property
+    def categories(self):
+        """Category results in order"""
+        return tuple(self[name] for name in self.names)
+
+    def __getitem__(self, name):
+        """Get a category result by name"""
+        position = 2
+        for category, breakdown_layout, error in self.layout:
+            size = _breakdown_size(breakdown_layout)
+            if category == name:
+                return CategoryResult(self.values[position], breakdown_layout,
+                                      self.values[position + 1:position + 1 + size], error)
+            position += 1 + size
+        raise KeyError(name)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a footprint result from a calculator dict"""
+        per_capita = data.get('per_capita')
+        values = array('d', [data.get('total', 0), float('nan') if per_capita is None else per_capita])
+
+        layout = []
+        for name, category in data.get('categories', {}).items():
+            values.append(category.get('total', 0))
+            layout.append((name, _breakdown_layout(category.get('breakdown', {}), values), category.get('error')))
+
+        extras = {key: value for key, value in data.items() if key not in ('total', 'per_capita', 'categories')}
+        return cls(tuple(layout), values, extras)
+
+    def to_dict(self):
+        """Convert back into the calculator's dict format"""
+        result = {'total': self.values[0], 'categories': {}}
+
+        position = 2
+        for name, breakdown_layout, error in self.layout:
+            category_total = self.values[position]
+            breakdown, position = _breakdown_dict(breakdown_layout, self.values, position + 1)
+
+            result['categories'][name] = {'total': category_total, 'breakdown': breakdown}
+            if error is not None:
+                result['categories'][name]['error'] = error
+
+        if self.per_capita is not None:
+            result['per_capita'] = self.per_capita
+        if self.extras:
+            result.update(self.extras)
+        return result
+
+
+class ReportSeries:
+    """Reports of one entity with their trend values in columnar arrays
+
+    Each value is kept in a float array per column, and category totals and
+    changes in one array per category, with NaN where a value is missing.
+    Indexing or iterating yields SeriesEntry views reading the arrays.
+    """
+
+    __slots__ = ('filenames', 'dates', 'totals', 'deltas', 'moving_averages',
+                 'categories', 'category_changes', 'has_changes')
+
+    def __init__(self):
+        """Initializing an empty series"""
+        self.filenames = []
+        self.dates = []
+        self.totals = array('d')
+        self.deltas = array('d')
+        self.moving_averages = array('d')
+
+        # Category name -> array of totals and of changes, one value per report
+        self.categories = {}
+        self.category_changes = {}
+        self.has_changes = bytearray()
+
+    def append(self, filename, date, total, delta, moving_average, categories, category_changes):
+        """Add a report at the end of the series"""
+        position = len(self.totals)
+        self.filenames.append(filename)
+        self.dates.append(date)
+        self.totals.append(total)
+        self.deltas.append(float('nan') if delta is None else delta)
+        self.moving_averages.append(float('nan') if moving_average is None else moving_average)
+        self.has_changes.append(category_changes is not None)
+
+        for columns, values in ((self.categories, categories), (self.category_changes, category_changes or {})):
+            for name in values:
+                if name not in columns:
+                    columns[name] = array('d', [float('nan')]) * position
+            for name, column in columns.items():
+                column.append(values.get(name, float('nan')))
+
+    def __len__(self):
+        """Number of reports"""
+        return len(self.totals)
+
+    def __getitem__(self, position):
+        """Get the report at a position, negative positions counting from the end"""
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return SeriesEntry(self, position)
+
+    def __iter__(self):
+        """Iterate over the reports, oldest first"""
+        return (SeriesEntry(self, position) for position in range(len(self)))
+
+    def __reversed__(self):
+        """Iterate over the reports, latest first"""
+        return (SeriesEntry(self, position) for position in reversed(range(len(self))))
+
+    def to_list(self):
+        """Convert into a list of report dicts"""
+        return [entry.to_dict() for entry in self]
+
+
+class SeriesEntry:
+    """View of one report of a ReportSeries"""
+
+    __slots__ = ('series', 'position')
+
+    def __init__(self, series, position):
+        """Initializing the view"""
+        self.series = series
+        self.position = position
+
+    @property
+    def filename(self):
+        """Report filename"""
+        return self.series.filenames[self.position]
+
+    @property
+    def date(self):
+        """Report date"""
+        return self.series.dates[self.position]
+
+    @property
+    def total(self):
+        """Total footprint"""
+        return self.series.totals[self.position]
+
+    @property
+    def delta(self):
+        """Change of the total since the previous report, None for the first"""
+        value = self.series.deltas[self.position]
+        return None if value != value else value
+
+    @property
+    def moving_average(self):
+        """Moving average of the total"""
+        value = self.series.moving_averages[self.position]
+        return None if value != value else value
+
+    @property
+    def categories(self):
+        """Category totals"""
+        return _row(self.series.categories, self.position)
+
+    @property
+    def category_changes(self):
+        """Changes of the category totals since the previous report, None for the first"""
+        if not self.series.has_changes[self.position]:
+            return None
+        return _row(self.series.category_changes, self.position)
+
+    def to_dict(self):
+        """Convert into the report dict format"""
+        return {'filename': self.filename, 'date': self.date, 'total': self.total, 'delta': self.delta,
+                'moving_average': self.moving_average, 'categories': self.categories,
+                'category_changes': self.category_changes}
+
+
+def _row(columns, position):
+    """Get the values of one row of per-name columns, skipping missing ones"""
+    row = {}
+    for name, column in columns.items():
+        value = column[position]
+        if value == value:
+            row[name] = value
+    return row
@@ -0,0 +1,183 @@
+"""
+Carbon Footprint Monitor - Footprint Time Series
+Calculates monthly footprints and keeps quarter and year rollups up to date
+"""
+
+import calendar
+from datetime import date
+
+from app.models.carbon_calculator import CarbonCalculator
+from app.models.factor_plan import FactorPlan
+
+
+class FootprintTimeSeries:
+    """Monthly footprints with incrementally maintained rollups
+
+    Monthly records use the same shape as user_data, with values describing
+    that month: weekly values are weekly averages during the month, monthly
+    values are the month's actual usage and flights are the flights taken
+    in the month.
+    """
+
+    def __init__(self, calculator=None):
+        """Initializing an empty time series"""
+        self.calculator = calculator or CarbonCalculator()
+
+        # Calculators for months of 28 to 31 days, keyed by (plan version, days)
+        self.period_calculators = {}
+
+        # 'YYYY-MM' -> footprint of the month, and the rollups built from them
+        self.months = {}
+        self.quarters = {}
+        self.years = {}
+
+    def period_calculator(self, plan, days):
+        """Get a calculator converting weekly, monthly and daily values for a month"""
+        key = (plan.version, days)
+        if key not in self.period_calculators:
+            period_plan = FactorPlan(plan.coefficients, weeks=days / 7, months=1, days=days, factor_set=plan.factor_set)
+            self.period_calculators[key] = CarbonCalculator(period_plan)
+        return self.period_calculators[key]
+
+    def add_month(self, month, data):
+        """Calculate the footprint of a month and update its rollups
+
+        Submitting a month again replaces its earlier footprint. Only the
+        difference is applied to the quarter and year, so history is never
+        reprocessed. Raises ValueError when the footprint can't be calculated.
+        """
+        year, month_number = parse_month(month)
+        key = month_key(month)
+
+        # Factors of the profile's country in the month's year
+        plan = self.calculator.plan_for(dict(data, date=f"{key}-01"))
+        days = calendar.monthrange(year, month_number)[1]
+        footprint_data = self.period_calculator(plan, days).calculate_footprint(data)
+
+        errors = [footprint_data.get('error')] + [values.get('error')
+                                                  for values in footprint_data.get('categories', {}).values()
+                                                  if isinstance(values, dict)]
+        errors = [error for error in errors if error]
+        if errors:
+            raise ValueError(f"{key}: {errors[0]}")
+
+        footprint = {
+            'total': footprint_data.get('total', 0),
+            'categories': {category: values.get('total', 0)
+                           for category, values in footprint_data.get('categories', {}).items()
+                           if isinstance(values, dict)}
+        }
+        self.set_month(key, footprint)
+
+        return footprint
+
+    def set_month(self, key, footprint):
+        """Store a month's footprint and apply the change to its rollups"""
+        quarter_key, year_key = rollup_keys(key)
+        key = month_key(key)
+
+        previous = self.months.get(key)
+        self.months[key] = footprint
+
+        for rollups, rollup_key in ((self.quarters, quarter_key), (self.years, year_key)):
+            rollup = rollups.setdefault(rollup_key, {'total': 0.0, 'categories': {}, 'months': 0})
+            apply_month(rollup, previous, footprint)
+
+    def get_month(self, month):
+        """Get the footprint of a month"""
+        return self.months.get(month_key(month))
+
+    def get_quarter(self, year, quarter):
+        """Get the rollup of a quarter"""
+        return self.quarters.get(f"{int(year):04d}-Q{int(quarter)}")
+
+    def get_year(self, year):
+        """Get the rollup of a year from the months received so far"""
+        return self.years.get(f"{int(year):04d}")
+
+    def year_to_date(self, month):
+        """Get the footprint from January up to and including a month"""
+        year, month_number = parse_month(month)
+
+        # Without later months the year rollup already is the year to date
+        later_months = (f"{year:04d}-{m:02d}" for m in range(month_number + 1, 13))
+        if not any(key in self.months for key in later_months):
+            rollup = self.years.get(f"{year:04d}", {'total': 0.0, 'categories': {}, 'months': 0})
+            return {'total': rollup['total'], 'categories': dict(rollup['categories']), 'months': rollup['months']}
+
+        result = {'total': 0.0, 'categories': {}, 'months': 0}
+        for m in range(1, month_number + 1):
+            key = f"{year:04d}-{m:02d}"
+            if key in self.months:
+                apply_month(result, None, self.months[key])
+        return result
+
+    def to_dict(self):
+        """Convert the monthly footprints and their rollups into a dict for storage"""
+        return {'months': dict(self.months), 'quarters': dict(self.quarters), 'years': dict(self.years)}
+
+    @classmethod
+    def from_dict(cls, data, calculator=None):
+        """Load a time series from stored monthly footprints
+
+        Stored rollups are used as they are, the rollups are only rebuilt
+        from the months when none were stored.
+        """
+        series = cls(calculator)
+        if 'quarters' in data and 'years' in data:
+            series.months = dict(data.get('months', {}))
+            series.quarters = dict(data['quarters'])
+            series.years = dict(data['years'])
+            return series
+
+        for key in sorted(data.get('months', {})):
+            series.set_month(key, data['months'][key])
+        return series
+
+
+def parse_month(month):
+    """Parse 'YYYY-MM' strings, dates or (year, month) tuples, raising ValueError for anything else"""
+    if isinstance(month, str):
+        parts = month.split('-')
+        if len(parts) < 2:
+            raise ValueError(f"Invalid month: {month}")
+        year, month_number = parts[:2]
+    elif isinstance(month, tuple) and len(month) == 2:
+        year, month_number = month
+    elif isinstance(month, date):
+        year, month_number = month.year, month.month
+    else:
+        raise ValueError(f"Invalid month: {month!r}, expected 'YYYY-MM'")
+
+    year, month_number = int(year), int(month_number)
+    if not 1 <= month_number <= 12:
+        raise ValueError(f"Invalid month: {month}")
+    return year, month_number
+
+
+def month_key(month):
+    """Get the 'YYYY-MM' key of a month"""
+    year, month_number = parse_month(month)
+    return f"{year:04d}-{month_number:02d}"
+
+
+def rollup_keys(month):
+    """Get the quarter ('YYYY-QN') and year ('YYYY') keys of a month"""
+    year, month_number = parse_month(month)
+    return f"{year:04d}-Q{(month_number - 1) // 3 + 1}", f"{year:04d}"
+
+
+def apply_month(rollup, previous, footprint):
+    """Replace a month's previous footprint, None for a new month, by its footprint in a rollup"""
+    if previous is None:
+        rollup['months'] += 1
+    else:
+        _apply(rollup, previous, -1)
+    _apply(rollup, footprint, 1)
+
+
+def _apply(rollup, footprint, sign):
+    """Add (sign 1) or remove (sign -1) a month's footprint from a rollup"""
+    rollup['total'] += sign * footprint['total']
+    for category, total in footprint['categories'].items():
+        rollup['categories'][category] = rollup['categories'].get(category, 0.0) + sign * total
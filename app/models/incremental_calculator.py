@@ -0,0 +1,123 @@
+"""
+Carbon Footprint Monitor - Incremental Calculator
+Recalculates only the categories whose inputs have changed
+"""
+
+import copy
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from app.models.carbon_calculator import CarbonCalculator, CATEGORY_HANDLERS
+
+
+def fingerprint(data):
+    """Get a stable fingerprint of a category's input data"""
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class IncrementalCalculator:
+    """Calculator caching each category result with a fingerprint of its inputs"""
+
+    def __init__(self, calculator=None, max_entries=1024):
+        """Initializing the incremental calculator"""
+        self.calculator = calculator or CarbonCalculator()
+        self.max_entries = max_entries
+
+        # (category, plan version, fingerprint) -> category result, least recently used first
+        self.category_cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def plan_for(self, data):
+        """Get the factor plan used for a profile"""
+        return self.calculator.plan_for(data)
+
+    def calculate_uncertainty(self, data, samples=10000, seed=None):
+        """Get the uncertainty bands of a footprint"""
+        return self.calculator.calculate_uncertainty(data, samples=samples, seed=seed)
+
+    def calculate_footprint(self, data):
+        """Calculate the total footprint, recalculating only changed categories"""
+        try:
+            calculator = self.calculator.calculator_for(data)
+            results = {
+                'total': 0,
+                'categories': {}
+            }
+
+            for category in CATEGORY_HANDLERS:
+                if category in data:
+                    category_footprint = self.calculate_category_footprint(calculator, category, data[category])
+                    results['categories'][category] = category_footprint
+
+                    if isinstance(category_footprint, dict) and 'total' in category_footprint:
+                        results['total'] += category_footprint['total']
+
+            per_capita = self.calculator.calculate_per_capita(data, results['total'])
+            if per_capita is not None:
+                results['per_capita'] = per_capita
+
+            if calculator.plan.factor_set is not None:
+                results['factor_set'] = dict(calculator.plan.factor_set)
+
+            return results
+
+        except Exception as e:
+            # Handle calculation errors the same way as the calculator
+            return {'total': 0, 'categories': {}, 'error': 'Error in footprint calculation'}
+
+    def update_category(self, results, data, category):
+        """Recalculate one edited category of earlier results
+
+        Only the given category is recalculated, the total and per capita
+        values are derived again from the category totals in results.
+        """
+        results = dict(results)
+        results['categories'] = dict(results.get('categories', {}))
+
+        if category in data:
+            calculator = self.calculator.calculator_for(data)
+            results['categories'][category] = self.calculate_category_footprint(calculator, category, data[category])
+        else:
+            results['categories'].pop(category, None)
+
+        results['total'] = sum(
+            category_footprint['total'] for category_footprint in results['categories'].values()
+            if isinstance(category_footprint, dict) and 'total' in category_footprint
+        )
+
+        results.pop('per_capita', None)
+        per_capita = self.calculator.calculate_per_capita(data, results['total'])
+        if per_capita is not None:
+            results['per_capita'] = per_capita
+
+        return results
+
+    def calculate_category_footprint(self, calculator, category, data):
+        """Get a category result from the cache or calculate it"""
+        key = (category, calculator.plan.version, fingerprint(data))
+
+        with self.lock:
+            category_footprint = self.category_cache.get(key)
+            if category_footprint is not None:
+                self.category_cache.move_to_end(key)
+
+        if category_footprint is None:
+            category_footprint = calculator.calculate_category_footprint(category, data)
+
+            with self.lock:
+                self.category_cache[key] = category_footprint
+
+                # Dropping the least recently used results
+                while len(self.category_cache) > self.max_entries:
+                    self.category_cache.popitem(last=False)
+
+        # Copy so callers can't change the cached result
+        return copy.deepcopy(category_footprint)
+
+    def clear(self):
+        """Clear all cached category results"""
+        with self.lock:
+            self.category_cache.clear()
@@ -0,0 +1,333 @@
+"""
+Carbon Footprint Monitor - Reduction Optimizer
+Ranks portfolios of reduction actions by the emissions they save
+"""
+
+import numpy as np
+
+from app.models.emission_factors import REDUCTION_POTENTIAL, REDUCTION_EFFORT
+from app.models.factor_plan import FACTOR_PLAN
+
+
+# Share of general waste avoided by going zero waste
+ZERO_WASTE_SHARE = 0.5
+
+# Share of general waste that can be composted, as in the calculator
+COMPOSTABLE_SHARE = 0.3
+
+# Descriptions used when recommending actions
+ACTION_DESCRIPTIONS = {
+    'car_to_public': "Use public transportation instead of a car for regular commutes.",
+    'car_to_bike': "Cycle or walk instead of driving for regular trips.",
+    'petrol_to_electric': "Switch to an electric vehicle for your next car purchase.",
+    'reduce_flights': "Avoid one long-haul flight a year, for example with video conferencing.",
+    'renewable_electricity': "Switch to a renewable energy provider for your electricity.",
+    'energy_efficient_appliances': "Invest in energy-efficient appliances and LED lighting.",
+    'improved_insulation': "Improve insulation to reduce heating needs.",
+    'smart_thermostat': "Install a smart thermostat to avoid unnecessary heating.",
+    'zero_waste': "Adopt zero-waste principles to halve your general waste.",
+    'start_composting': "Start composting organic waste.",
+    'reduce_red_meat': "Cut your red meat consumption in half.",
+    'vegetarian_diet': "Switch to a vegetarian diet.",
+    'vegan_diet': "Switch to a vegan diet.",
+    'local_food': "Choose locally produced food.",
+    'reduce_consumption': "Reduce overall consumption by prioritizing essential purchases.",
+    'buy_secondhand': "Buy secondhand instead of new items.",
+    'extend_product_life': "Extend the life of your products through repair and maintenance.",
+}
+
+
+def build_actions(plan=FACTOR_PLAN):
+    """Build the reduction actions from REDUCTION_POTENTIAL
+
+    Each action reduces one or more targets, a breakdown item such as
+    'energy.electricity' or a whole category such as 'food'. Fractional
+    actions on the same target compound, absolute actions subtract kg CO2e
+    from what is left. Actions sharing a group exclude each other.
+    """
+    transport = REDUCTION_POTENTIAL['transportation']
+    energy = REDUCTION_POTENTIAL['energy']
+    waste = REDUCTION_POTENTIAL['waste']
+    food = REDUCTION_POTENTIAL['food']
+    products = REDUCTION_POTENTIAL['products']
+
+    heating = ['energy.gas', 'energy.heating_oil']
+
+    actions = [
+        # Transportation
+        ('car_to_public', ['transportation.car'], 'fraction', transport['car_to_public'], 'car_use'),
+        ('car_to_bike', ['transportation.car'], 'fraction', transport['car_to_bike'], 'car_use'),
+        ('petrol_to_electric', ['transportation.car'], 'fraction', transport['petrol_to_electric'], None),
+        ('reduce_flights', ['transportation.air_travel'], 'absolute', transport['reduce_flights'], None),
+
+        # Energy
+        ('renewable_electricity', ['energy.electricity'], 'fraction', energy['renewable_electricity'], None),
+        ('energy_efficient_appliances', ['energy.electricity'], 'fraction', energy['energy_efficient_appliances'], None),
+        ('improved_insulation', heating, 'fraction', energy['improved_insulation'], None),
+        ('smart_thermostat', heating, 'fraction', energy['smart_thermostat'], None),
+
+        # Waste, per kg savings converted to a share of general waste emissions
+        ('zero_waste', ['waste.general_waste'], 'fraction',
+         min(1.0, ZERO_WASTE_SHARE * waste['zero_waste'] / plan.general_waste), None),
+        ('start_composting', ['waste.general_waste'], 'fraction',
+         min(1.0, COMPOSTABLE_SHARE * waste['start_composting'] / plan.general_waste), None),
+
+        # Food, diet changes exclude each other
+        ('reduce_red_meat', ['food'], 'fraction', food['reduce_red_meat'], 'diet'),
+        ('vegetarian_diet', ['food'], 'fraction', food['vegetarian_diet'], 'diet'),
+        ('vegan_diet', ['food'], 'fraction', food['vegan_diet'], 'diet'),
+        ('local_food', ['food'], 'fraction', food['local_food'], None),
+
+        # Products
+        ('reduce_consumption', ['products'], 'fraction', products['reduce_consumption'], None),
+        ('buy_secondhand', ['products'], 'fraction', products['buy_secondhand'], None),
+        ('extend_product_life', ['products'], 'fraction', products['extend_product_life'], None),
+    ]
+
+    effort = {name: value for category in REDUCTION_EFFORT.values() for name, value in category.items()}
+
+    return [
+        {'name': name, 'targets': targets, 'kind': kind, 'value': value, 'group': group, 'effort': effort.get(name, 1)}
+        for name, targets, kind, value, group in actions
+    ]
+
+
+def _section(user_data, *path):
+    """Get a nested section of the user data, empty if it is missing"""
+    section = user_data
+    for key in path:
+        section = section.get(key) if isinstance(section, dict) else None
+    return section if isinstance(section, dict) else {}
+
+
+def _share(value):
+    """Convert a percentage to a share between 0 and 1"""
+    try:
+        return min(max(float(value) / 100, 0.0), 1.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _switch_fraction(potential, current, target, reference):
+    """Scale the reduction of switching from reference to target to a switch from current"""
+    if current <= target:
+        return 0.0
+    return potential * (1 - target / current) / (1 - target / reference)
+
+
+class ReductionOptimizer:
+    """Finds the best combinations of reduction actions for a footprint
+
+    Portfolios are built one action (or one choice between exclusive
+    actions) at a time, as vectorized arrays of partial portfolios. Partial
+    portfolios over the effort budget are dropped, and so are those that
+    could not beat the top portfolios found so far even with every
+    remaining action added.
+    """
+
+    def __init__(self, actions=None, plan=FACTOR_PLAN):
+        """Initializing the optimizer with its reduction actions"""
+        self.plan = plan
+        self.actions = actions or build_actions(plan)
+
+    def target_values(self, footprint_data):
+        """Get the emissions of each reduction target from footprint results"""
+        values = {}
+
+        for category, data in footprint_data.get('categories', {}).items():
+            if not isinstance(data, dict):
+                continue
+
+            values[category] = max(0.0, data.get('total', 0))
+            for item, value in data.get('breakdown', {}).items():
+                if isinstance(value, (int, float)):
+                    values[f'{category}.{item}'] = max(0.0, value)
+
+        return values
+
+    def action_value(self, action, user_data):
+        """Get the reduction of an action from the user's current situation, 0 if it does not apply"""
+        name, value = action['name'], action['value']
+        plan = self.plan
+
+        car = _section(user_data, 'transportation', 'car')
+        flights = _section(user_data, 'transportation', 'air_travel')
+        electricity = _section(user_data, 'energy', 'electricity')
+        food = _section(user_data, 'food')
+        products = _section(user_data, 'products')
+
+        diet = food.get('diet_type', 'omnivore')
+        diet_factor = plan.diet[diet]
+
+        if name == 'petrol_to_electric':
+            # Only the difference to an electric car is saved, nothing when it already is one
+            return _switch_fraction(value, plan.car[car.get('fuel_type', 'petrol')], plan.car['electric'], plan.car['petrol'])
+
+        if name == 'reduce_flights':
+            # One long-haul flight avoided, at most what the user's long flights emit
+            try:
+                long_flights = float(flights.get('long_flights', 0) or 0)
+            except (TypeError, ValueError):
+                long_flights = 0.0
+            return min(value, long_flights * plan.long_flight)
+
+        if name == 'renewable_electricity':
+            return value * (1 - _share(electricity.get('renewable_percentage', 0)))
+
+        if name == 'reduce_red_meat':
+            # Only omnivores eat red meat, and not when they tracked none
+            meat = food.get('meat_consumption')
+            if diet != 'omnivore' or (isinstance(meat, dict) and not meat.get('red_meat')):
+                return 0.0
+            return value
+
+        if name == 'vegetarian_diet':
+            return _switch_fraction(value, diet_factor, plan.diet['vegetarian'], plan.diet['omnivore'])
+
+        if name == 'vegan_diet':
+            return _switch_fraction(value, diet_factor, plan.diet['vegan'], plan.diet['omnivore'])
+
+        if name == 'local_food':
+            return value * (1 - _share(food.get('local_food_percentage', 0)))
+
+        if name == 'buy_secondhand':
+            return value * (1 - _share(products.get('secondhand_percentage', 0)))
+
+        return value
+
+    def applicable_actions(self, footprint_data, user_data=None):
+        """Get the actions that can reduce this footprint, scaled to the user's current situation"""
+        values = self.target_values(footprint_data)
+        waste = footprint_data.get('categories', {}).get('waste', {})
+
+        actions = []
+        for action in self.actions:
+            # Composting is already counted when the user composts
+            if action['name'] == 'start_composting' and 'composting_benefits' in waste.get('breakdown', {}):
+                continue
+
+            if user_data is not None:
+                action = dict(action, value=self.action_value(action, user_data))
+                if action['value'] <= 0:
+                    continue
+
+            if sum(values.get(target, 0) for target in action['targets']) > 0:
+                actions.append(action)
+
+        return actions, values
+
+    def optimize(self, footprint_data, top_n=5, budget=None, user_data=None):
+        """Get the top portfolios ranked by kg CO2e saved within an effort budget
+
+        With the user data, actions that do not apply to the user (such as
+        a vegan diet for vegans) are left out and the others are scaled to
+        what the user does today.
+        """
+        actions, values = self.applicable_actions(footprint_data, user_data)
+        if budget is not None:
+            actions = [action for action in actions if action['effort'] <= budget]
+        if not actions:
+            return []
+
+        count = len(actions)
+        effort = np.array([action['effort'] for action in actions], dtype=float)
+
+        # Emission targets with the action columns reducing them
+        targets = sorted({target for action in actions for target in action['targets']})
+        target_actions = []
+        for target in targets:
+            fractions = [i for i, action in enumerate(actions) if target in action['targets'] and action['kind'] == 'fraction']
+            absolutes = [i for i, action in enumerate(actions) if target in action['targets'] and action['kind'] == 'absolute']
+            target_actions.append((values.get(target, 0.0), fractions, absolutes))
+
+        keep = np.array([1 - action['value'] if action['kind'] == 'fraction' else 1.0 for action in actions])
+        absolute = np.array([action['value'] if action['kind'] == 'absolute' else 0.0 for action in actions])
+
+        def savings_of(chosen):
+            """Fractions compound on each target, absolute savings apply to what is left"""
+            savings = np.zeros(len(chosen))
+            factors = np.where(chosen, keep, 1.0)
+            for base, fractions, absolutes in target_actions:
+                remaining = base * np.prod(factors[:, fractions], axis=1) if fractions else np.full(len(chosen), base)
+                if absolutes:
+                    remaining = np.maximum(0.0, remaining - chosen[:, absolutes] @ absolute[absolutes])
+                savings += base - remaining
+            return savings
+
+        # Mutually exclusive actions form one choice, so invalid mixes are never generated
+        units = []
+        groups = {}
+        for i, action in enumerate(actions):
+            if action['group'] is None:
+                units.append([i])
+            elif action['group'] in groups:
+                groups[action['group']].append(i)
+            else:
+                groups[action['group']] = [i]
+                units.append(groups[action['group']])
+
+        # The strongest option of every choice, alone, gives the most a choice can save.
+        # Deciding the biggest choices first lets the bound prune early
+        def strongest(unit):
+            single = np.zeros((len(unit), count), dtype=bool)
+            single[np.arange(len(unit)), unit] = True
+            saved = savings_of(single)
+            return unit[int(np.argmax(saved))], float(saved.max())
+
+        best_options = [strongest(unit) for unit in units]
+        order = sorted(range(len(units)), key=lambda u: -best_options[u][1])
+        units = [units[u] for u in order]
+        best_options = [best_options[u][0] for u in order]
+
+        # Every action that could still be added after deciding the first choices.
+        # Savings only grow with more actions and options of one choice share their
+        # targets, so adding the strongest option of each remaining choice is an upper bound
+        rest = np.zeros((len(units) + 1, count), dtype=bool)
+        for level in range(len(units) - 1, -1, -1):
+            rest[level] = rest[level + 1]
+            rest[level, best_options[level]] = True
+
+        chosen = np.zeros((1, count), dtype=bool)
+        total_effort = np.zeros(1)
+
+        for level, unit in enumerate(units):
+            # Each partial portfolio without, or with one option of, this choice
+            options = len(unit) + 1
+            chosen = np.repeat(chosen, options, axis=0)
+            total_effort = np.repeat(total_effort, options)
+            for position, action_index in enumerate(unit, start=1):
+                chosen[position::options, action_index] = True
+                total_effort[position::options] += effort[action_index]
+
+            if budget is not None:
+                within = total_effort <= budget
+                chosen = chosen[within]
+                total_effort = total_effort[within]
+
+            # Partial portfolios are portfolios too, so the top_n-th best of them is a
+            # floor for the final ranking; drop any whose bound stays below it
+            if len(chosen) > top_n:
+                floor = np.partition(savings_of(chosen), -top_n)[-top_n]
+                bound = savings_of(chosen | rest[level + 1])
+                within = bound >= floor
+                chosen = chosen[within]
+                total_effort = total_effort[within]
+
+        savings = savings_of(chosen)
+        order = np.lexsort((total_effort, -savings))[:top_n]
+        total = footprint_data.get('total', 0)
+
+        portfolios = []
+        for i in order:
+            if savings[i] <= 0:
+                continue
+
+            portfolios.append({
+                'actions': [actions[j]['name'] for j in np.flatnonzero(chosen[i])],
+                'savings': float(savings[i]),
+                'effort': float(total_effort[i]),
+                'remaining_total': float(total - savings[i]),
+                'reduction_percentage': float(savings[i] / total * 100) if total > 0 else 0.0,
+            })
+
+        return portfolios
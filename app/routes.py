@@ -3,24 +3,36 @@ from pkg_resources import safe_name
 
 from app import app
 from app.models.carbon_calculator import CarbonCalculator
+from app.models.factor_registry import FactorRegistry
+from app.models.incremental_calculator import IncrementalCalculator
+from app.models.footprint_cache import MemoizedCalculator
+from app.models.footprint_timeseries import parse_month
 from app.services import pdf_service
 from app.services.data_service import DataService
+from app.services.report_index import FACETS, NUMERIC_FIELDS
 from app.services.report_service import ReportService
 from app.services.pdf_service import PDFService
 from app.services.benchmark_service import BenchmarkService
 from app.services.currency_service import CurrencyService
+from app.services.country_index import COUNTRY_INDEX
+from app.services.ranking_service import RankingService
 import json
 import os
 import io
 import datetime
 
 
-calculator = CarbonCalculator()         # Calculator instance
+calculator = CarbonCalculator(registry=FactorRegistry())  # Calculator with country-specific factors
+incremental_calculator = IncrementalCalculator(calculator)  # Per-category cached calculator
+memo_calculator = MemoizedCalculator(incremental_calculator)  # Memoized footprint results
+uncertainty_seed = 0                    # Fixed seed so refreshed pages show the same bands
 data_service = DataService()            # Data service instance
 report_service = ReportService()        # Report service instance
 pdf_service = PDFService()              # PDF service instance
 benchmark_service = BenchmarkService()  # Benchmark service
 currency_service = CurrencyService()    # Currency service instance
+ranking_service = RankingService(benchmark_service, data_service)  # Percentile ranks
+reports_page_sizes = [10, 20, 50, 100]  # Page sizes offered on the reports listing
 
 
 @app.route('/')
@@ -154,6 +166,12 @@ def energy_entry ():
                     'monthly_usage': float(request.form.get('gas_monthly_usage', 0))
                 }
 
+            # Heating oil data
+            if request.form.get('has_heating_oil') == 'yes':
+                energy_data['heating_oil'] = {
+                    'monthly_litres': float(request.form.get('heating_oil_monthly_litres', 0))
+                }
+
             # Adding energy to the session
             user_data = session.get('user_data', {})
             user_data['energy'] = energy_data
@@ -336,12 +354,19 @@ def results():
 
     try:
         # Calculate carbon footprint
-        footprint_data = calculator.calculate_footprint(user_data)
+        footprint_data = memo_calculator.calculate_footprint(user_data)
+
+        # Uncertainty bands from the emission factor distributions
+        if 'error' not in footprint_data:
+            footprint_data['uncertainty'] = memo_calculator.calculate_uncertainty(user_data, seed=uncertainty_seed)
 
         # Getting the benchmark data for the respective country
         country = user_data.get('country', 'Germany')
         benchmarks = benchmark_service.get_benchmarks(country)
 
+        # Ranking among countries and earlier reports, before this one is saved
+        ranking = ranking_service.rank(footprint_data, user_data.get('user_type'))
+
         # Generate charts
         charts = report_service.generate_charts(footprint_data)
 
@@ -353,6 +378,7 @@ def results():
                                user_data=user_data,
                                footprint_data=footprint_data,
                                benchmarks=benchmarks,
+                               ranking=ranking,
                                charts=charts)
 
     except ZeroDivisionError:
@@ -367,14 +393,41 @@ def results():
 
 @app.route('/reports')
 def reports_list():
-    """List all saved reports"""
+    """List saved reports one page at a time"""
+    page_size = request.args.get('page_size', 20, type=int)
+    if page_size not in reports_page_sizes:
+        page_size = 20
+
+    sort = 'oldest' if request.args.get('sort') == 'oldest' else 'newest'
+    filters = {
+        'user_type': request.args.get('user_type', '').strip(),
+        'country': request.args.get('country', '').strip(),
+        'name': request.args.get('name', '').strip(),
+    }
+
+    # Parameters kept on the page links
+    query = {'page_size': page_size, 'sort': sort}
+    query.update({key: value for key, value in filters.items() if value})
+
     try:
-        reports = data_service.get_all_reports()
-        return render_template('reports.html', title='Saved Reports', reports=reports)
+        page = data_service.get_reports_page(page_size,
+                                             after=request.args.get('after'),
+                                             before=request.args.get('before'),
+                                             sort=sort,
+                                             filters=filters)
     except Exception as e:
         # Handle data service errors
         flash('An error occurred while loading reports.', 'error')
-        return render_template('reports.html', title='Saved Reports', reports=[])
+        page = {'reports': [], 'next_cursor': None, 'previous_cursor': None}
+
+    return render_template('reports.html',
+                           title='Saved Reports',
+                           reports=page['reports'],
+                           next_cursor=page['next_cursor'],
+                           previous_cursor=page['previous_cursor'],
+                           filters=filters,
+                           query=query,
+                           page_sizes=reports_page_sizes)
 
 
 @app.route('/reports/<filename>')
@@ -392,7 +445,8 @@ def view_report(filename):
         return render_template('view_report.html',
                                title='View Report',
                                report_data=report_data,
-                               charts=charts)
+                               charts=charts,
+                               entity_key=data_service.get_entity_key(report_data.get('user_data', {})))
 
     except Exception as e:
         # Handle report loading errors
@@ -400,6 +454,92 @@ def view_report(filename):
         return redirect(url_for('reports_list'))
 
 
+@app.route('/history')
+def entity_history():
+    """View the footprint history of an organization or person"""
+    try:
+        history = data_service.get_entity_history(request.args.get('entity', ''))
+
+        if not history:
+            flash('No history found.', 'error')
+            return redirect(url_for('reports_list'))
+
+        return render_template('history.html',
+                               title='Footprint History',
+                               history=history)
+
+    except Exception as e:
+        # Handle history loading errors
+        flash('An error occurred while loading the history.', 'error')
+        return redirect(url_for('reports_list'))
+
+
+@app.route('/api/reports/search')
+def search_reports():
+    """Search saved reports by facets, numeric ranges and dates
+
+    Facets are given as repeatable parameters (country, user_type, industry,
+    diet, fuel), numeric ranges as min_<field> and max_<field> in kg CO2e
+    for total and each category, and dates as start and end or quarter.
+    """
+    try:
+        facets = {facet: request.args.getlist(facet) for facet in FACETS if request.args.getlist(facet)}
+        ranges = {}
+        for field in NUMERIC_FIELDS:
+            minimum = request.args.get(f'min_{field}', type=float)
+            maximum = request.args.get(f'max_{field}', type=float)
+            if minimum is not None or maximum is not None:
+                ranges[field] = (minimum, maximum)
+
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        reports = data_service.search_reports(facets, ranges,
+                                              start=request.args.get('start'),
+                                              end=request.args.get('end'),
+                                              quarter=request.args.get('quarter'),
+                                              limit=limit)
+
+        return jsonify({'count': len(reports),
+                        'reports': [{key: value for key, value in report.items() if key != 'filepath'}
+                                    for report in reports]})
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/api/entities/months', methods=['POST'])
+def add_month():
+    """Record the footprint of one month of an organization or person
+
+    The JSON body holds the month ('YYYY-MM') and the month's user_data,
+    where monthly values are the month's usage, weekly values are weekly
+    averages during the month and flights are those taken in the month.
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        user_data = body.get('user_data') or {}
+        month = body.get('month')
+        if not isinstance(user_data, dict) or not month:
+            raise ValueError('A month and user_data are required')
+
+        series = data_service.add_month(user_data, month, calculator)
+        year, month_number = parse_month(month)
+
+        return jsonify({'entity': data_service.get_entity_key(user_data),
+                        'month': series.get_month(month),
+                        'quarter': series.get_quarter(year, (month_number - 1) // 3 + 1),
+                        'year_to_date': series.year_to_date(month)})
+
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/api/entities/months')
+def entity_months():
+    """Monthly footprints of an organization or person with quarter and year rollups"""
+    series = data_service.get_timeseries(request.args.get('entity', ''))
+    return jsonify({'months': series.months, 'quarters': series.quarters, 'years': series.years})
+
+
 @app.route('/download-report')
 def download_report():
     """Generate and download the PDF report"""
@@ -411,7 +551,11 @@ def download_report():
 
     try:
         # Calc footprint
-        footprint_data = calculator.calculate_footprint(user_data)
+        footprint_data = memo_calculator.calculate_footprint(user_data)
+
+        # Uncertainty bands from the emission factor distributions
+        if 'error' not in footprint_data:
+            footprint_data['uncertainty'] = memo_calculator.calculate_uncertainty(user_data, seed=uncertainty_seed)
 
         # Generating charts
         charts = report_service.generate_charts(footprint_data)
@@ -450,3 +594,8 @@ def download_report():
         flash('An error occurred while generating the PDF report. Please try again.', 'error')
         return redirect(url_for('results'))
 
+
+@app.route('/api/countries/unmatched')
+def unmatched_countries():
+    """Country names the benchmark and currency services could not match, with counts"""
+    return jsonify(COUNTRY_INDEX.get_misses())
@@ -4,21 +4,104 @@
 """
 
 import requests
-import json
+import csv
+import io
 import os
+import time
+import threading
 from datetime import datetime, timedelta
 
-from tornado.gen import Return
+from app.services.benchmark_snapshot import read_snapshot, write_snapshot
+from app.services.country_index import COUNTRY_INDEX
+
+
+# Our World in Data CO2 emissions per capita dataset
+OWID_URL = "https://github.com/owid/owid-datasets/raw/master/datasets/CO2%20emissions%20(Fossil%20fuels%20and%20cement)/CO2%20emissions%20(Fossil%20fuels%20and%20cement).csv"
+
+# Keeping only the recent data ie., from this year on
+MIN_YEAR = 2018
+
+# OWID entities that are regions or other aggregates rather than countries
+AGGREGATES = {'world', 'africa', 'asia', 'europe', 'north america', 'south america', 'oceania',
+              'international transport', 'kuwaiti oil fires', 'statistical differences'}
+
+
+class CircuitBreaker:
+    """Circuit breaker that stops calls to a failing service for a while
+
+    After failure_threshold failures in a row the circuit opens and calls
+    are refused for cooldown seconds. Then a single probe call is let
+    through (half-open): its success closes the circuit, its failure opens
+    it for another cooldown.
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=300):
+        """Initializing a closed circuit"""
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+
+
+    def allow(self):
+        """Check whether a call may go through"""
+        with self.lock:
+            if self.state == 'closed':
+                return True
+
+            if self.state == 'open' and time.time() - self.opened_at >= self.cooldown:
+                self.state = 'half-open'
+                return True
+
+            return False
+
+
+    def record_success(self):
+        """Close the circuit after a successful call"""
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+
+
+    def record_failure(self):
+        """Count a failed call, opening the circuit at the threshold or after a failed probe"""
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half-open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.time()
 
 
 class BenchmarkService:
     """Service for fetching carbon footprint benchmarks from Our World in Data API"""
 
-    def __init__(self):
-        """Initializing the benchmark service"""
-        self.cache_file = 'cache/benchmark_data.json'
+    def __init__(self, data_file=None, url=None, timeout=10):
+        """Initializing the benchmark service
+
+        data_file is a local copy of the OWID CSV to read instead of the API,
+        for deployments without network access, and url replaces the OWID
+        dataset URL. They default to the OWID_DATA_FILE and OWID_URL
+        environment variables.
+        """
+        self.data_file = data_file or os.environ.get('OWID_DATA_FILE')
+        self.url = url or os.environ.get('OWID_URL', OWID_URL)
+        self.timeout = timeout
+        self.cache_file = 'cache/benchmark_data.bin'
         self.cache_duration = timedelta(days=30) # Cache for 30 days
 
+        # Only one thread and one process fetches from the API at a time
+        self.refresh_lock = threading.Lock()
+        self.lock_file = 'cache/benchmark_data.lock'
+        self.lock_timeout = 120  # seconds before a lock file left by a dead process is taken over
+
+        # Failed fetches are remembered for all processes, and repeated failures open the circuit
+        self.failure_file = 'cache/benchmark_data.failed'
+        self.failure_ttl = 60  # seconds before fetching again after a failure
+        self.breaker = CircuitBreaker(failure_threshold=3, cooldown=300)
+
         # Creating cache directory if it does not exist
         os.makedirs('cache', exist_ok = True)
 
@@ -26,20 +109,19 @@ class BenchmarkService:
         self.sustainable_target = 2.0   # tonnes CO2 per person (Paris Agreement goal)
         self.global_avg_fallback = 4.8  # fallback if API fails
 
+        # Benchmarks precomputed from the last loaded data, replaced as a whole on refresh
+        self.index = None
+
+        # Snapshot of the cached data, kept mapped while its benchmarks are served
+        self.snapshot = None
+
 
     def get_benchmarks(self, country="Germany"):
         """Get carbon footprint benchmark for comparison"""
         try:
-            # Trying to get from cache first
-            cached_data = self.get_cached_data()
-            if cached_data:
-                return self.extract_benchmarks(cached_data, country)
-
-            # Fetching fresh from API
-            data = self.fetch_from_api()
-            if data:
-                self.cache_data(data)
-                return self.extract_benchmarks(data, country)
+            index = self.get_index()
+            if index:
+                return self.extract_benchmarks(index, country)
 
             # Falling back to default values
             return self.get_fallback_benchmarks(country)
@@ -49,73 +131,263 @@ class BenchmarkService:
             return self.get_fallback_benchmarks(country)
 
 
-    def fetch_from_api(self):
-        """Fetching data from Our World in Data API"""
+    def get_index(self):
+        """Get the benchmark index, None if no data could be loaded"""
+        index = self.index
+        if index is None:
+            index = self.load_first_index()
+        if index is not None and time.time() >= index['expires']:
+            # Serving the expired benchmarks while they are refreshed
+            self.refresh_in_background()
+        return index
+
+
+    def get_distribution(self):
+        """Get the latest per capita emissions of every country, sorted"""
         try:
-            # Our World in Data CO2 2mission per capia API
-            url = "https://github.com/owid/owid-datasets/raw/master/datasets/CO2%20emissions%20(Fossil%20fuels%20and%20cement)/CO2%20emissions%20(Fossil%20fuels%20and%20cement).csv"
+            index = self.get_index()
+            return index['distribution'] if index else []
 
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
+        except Exception as e:
+            print(f"Error fetching benchmarks: {e}")
+            return []
 
-            # Parsing CSV data
-            lines = response.text.strip().split('\n')
-            headers = lines[0].split(',')
 
-            # Finding relevant columns
-            country_col = headers.index('Entity') if 'Entity' in headers else 0
-            year_col = headers.index('Year') if 'Year' in headers else 1
-            emissions_col = None
+    def load_first_index(self):
+        """Loading the first benchmark index, once for all waiting threads"""
+        with self.refresh_lock:
+            return self.index or self.load_index()
 
-            # Looking for per capita emissions column
-            for i, header in enumerate(headers):
-                if 'per capita' in header.lower() or 'per-capita' in header.lower():
-                    emissions_col = i
-                    break
 
-            if emissions_col is None:
-                raise ValueError("could not find emissions column in CSV")
+    def refresh_in_background(self):
+        """Starting a refresh of the benchmark index unless one is running"""
+        if self.refresh_lock.acquire(blocking=False):
+            threading.Thread(target=self.refresh, daemon=True).start()
 
-            # Parsing the data
-            data = {}
-            for line in lines[1:]:  # Skipping header
+
+    def refresh(self):
+        """Refreshing the benchmark index, releasing the refresh lock when done"""
+        try:
+            if self.load_index() is None and self.index:
+                # Keeping the expired benchmarks a while longer before trying again
+                self.index = dict(self.index, expires=time.time() + self.failure_ttl)
+
+        except Exception as e:
+            print(f"Error refreshing benchmarks: {e}")
+
+        finally:
+            self.refresh_lock.release()
+
+
+    def load_index(self):
+        """Loading the data from cache or the API and installing its benchmark index"""
+        # Trying to get from cache first. Without benchmarks yet an expired
+        # snapshot is used too, and served while get_index() refreshes it
+        data = self.get_cached_data(allow_expired=self.index is None)
+        if data:
+            expires = os.path.getmtime(self.cache_file) + self.cache_duration.total_seconds()
+        else:
+            # Not fetching while the API is known to fail
+            if self.recently_failed():
+                return None
+
+            # Leaving the fetch to the process that is already at it, before
+            # asking the breaker, so a half-open probe is only taken to be used
+            if not self.acquire_lock_file():
+                return None
+
+            try:
+                if not self.breaker.allow():
+                    return None
+
+                # Fetching fresh from API, every outcome closes or opens the circuit
+                data = None
                 try:
-                    parts= line.split(',')
-                    if len(parts) > max(country_col, year_col, emissions_col):
-                        country = parts[country_col].strip('"')
-                        year = int(parts[year_col])
-                        emissions = float(parts[emissions_col]) if parts[emissions_col] else 0
+                    data = self.fetch_from_api()
+                finally:
+                    if data:
+                        self.breaker.record_success()
+                    else:
+                        self.breaker.record_failure()
+                        self.mark_failed()
+
+                if not data:
+                    return None
+                self.cache_data(data)
+                expires = time.time() + self.cache_duration.total_seconds()
 
+            finally:
+                self.release_lock_file()
 
-                        # Keeping only the recent data ie., last five years
-                        if year >+ 2018 and emissions > 0:
-                            if country not in data:
-                                data[country] = {}
-                            data[country][year] = emissions
+        index = self.build_index(data)
+        index['expires'] = expires
+
+        # Swapping in the new index with a single assignment, so readers see the old or new one
+        self.index = index
+        return index
+
+
+    def acquire_lock_file(self):
+        """Creating the lock file shared by processes, False if another process holds it"""
+        for attempt in range(2):
+            try:
+                fd = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return True
+
+            except FileExistsError:
+                # Taking over a lock left behind by a process that died while fetching
+                try:
+                    if time.time() - os.path.getmtime(self.lock_file) < self.lock_timeout:
+                        return False
+                    os.remove(self.lock_file)
+                except OSError:
+                    return False
+
+        return False
+
+
+    def release_lock_file(self):
+        """Removing the lock file"""
+        try:
+            os.remove(self.lock_file)
+        except OSError:
+            pass
+
+
+    def recently_failed(self):
+        """Check whether any process failed to fetch the data within the failure TTL"""
+        try:
+            return time.time() - os.path.getmtime(self.failure_file) < self.failure_ttl
+        except OSError:
+            return False
 
-                except (ValueError, IndexError):
-                    continue
 
-            return data
+    def mark_failed(self):
+        """Recording a failed fetch for all processes"""
+        try:
+            with open(self.failure_file, 'w') as f:
+                f.write(str(time.time()))
+        except OSError as e:
+            print(f"Error recording failed fetch: {e}")
+
+
+    def build_index(self, data):
+        """Precomputing the benchmarks of every country from the data, keyed by canonical name"""
+        latest = {COUNTRY_INDEX.key(country): country_data[max(country_data)]
+                  for country, country_data in data.items() if country_data}
+
+        return {
+            'countries': latest,
+            'distribution': sorted(emissions for country, emissions in latest.items()
+                                   if not self.is_aggregate(country)),
+            'global_avg': self.calculate_global_average(latest),
+            'reference_countries': self.get_reference_countries(latest),
+            'data_year': self.get_latest_year(data),
+        }
+
+
+    def is_aggregate(self, country):
+        """Check whether an OWID entity is a region or another aggregate of countries"""
+        name = country.casefold()
+        return name in AGGREGATES or '(' in name or 'income' in name or name.startswith(('eu-', 'european union'))
+
+
+    def fetch_from_api(self):
+        """Fetching data from Our World in Data API, or the local data file if there is one"""
+        if self.data_file:
+            return self.load_file(self.data_file)
+
+        try:
+            with requests.get(self.url, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+
+                # Reading the CSV as it downloads instead of holding the whole text
+                response.raw.decode_content = True
+                response.raw.auto_close = False
+                return self.parse_csv(io.TextIOWrapper(response.raw, encoding='utf-8', newline=''))
 
         except Exception as e:
             print(f"Error fetching from Our World in Data API: {e}")
             return None
 
 
-    def get_cached_data(self):
-        """Fetching data from cache if it's still valid"""
+    def load_file(self, source):
+        """Loading data from a local OWID CSV, given as a path or a file object"""
+        try:
+            if hasattr(source, 'read'):
+                return self.parse_csv(source)
+
+            with open(source, 'r', encoding='utf-8', newline='') as f:
+                return self.parse_csv(f)
+
+        except Exception as e:
+            print(f"Error loading Our World in Data file: {e}")
+            return None
+
+
+    def parse_csv(self, lines):
+        """Parsing OWID CSV lines into per capita emissions by country and year
+
+        Rows are read one at a time and only the entity, year and per capita
+        columns of recent years are kept, so memory doesn't grow with the file.
+        """
+        reader = csv.reader(lines)
+        headers = next(reader, None)
+        if not headers:
+            raise ValueError("empty CSV")
+
+        # Finding relevant columns
+        headers = [header.strip() for header in headers]
+        country_col = headers.index('Entity') if 'Entity' in headers else 0
+        year_col = headers.index('Year') if 'Year' in headers else 1
+        emissions_col = None
+
+        # Looking for per capita emissions column
+        for i, header in enumerate(headers):
+            if 'per capita' in header.lower() or 'per-capita' in header.lower():
+                emissions_col = i
+                break
+
+        if emissions_col is None:
+            raise ValueError("could not find emissions column in CSV")
+
+        # Parsing the data
+        data = {}
+        last_col = max(country_col, year_col, emissions_col)
+        for parts in reader:
+            if len(parts) <= last_col:
+                continue
+
+            try:
+                year = int(parts[year_col])
+                if year < MIN_YEAR or not parts[emissions_col]:
+                    continue
+                emissions = float(parts[emissions_col])
+
+            except ValueError:
+                continue
+
+            if emissions > 0:
+                data.setdefault(parts[country_col].strip(), {})[year] = emissions
+
+        return data
+
+
+    def get_cached_data(self, allow_expired=False):
+        """Fetching data from cache if it's still valid, or even if it expired when allowed"""
         try:
             if not os.path.exists(self.cache_file):
                 return None
 
             # Checking if it is still valid
             cache_time = datetime.fromtimestamp(os.path.getmtime(self.cache_file))
-            if datetime.now() - cache_time > self.cache_duration:
+            if datetime.now() - cache_time > self.cache_duration and not allow_expired:
                 return None
 
-            with open(self.cache_file, 'r') as f:
-                data = json.load(f)
+            self.snapshot = read_snapshot(self.cache_file)
+            return self.snapshot
 
         except Exception as e:
             print(f"Error fetching from cache: {e}")
@@ -125,121 +397,70 @@ class BenchmarkService:
     def cache_data(self, data):
         """Caching the fetched data"""
         try:
-            with open(self.cache_file, 'w') as f:
-                json.dump(data, f)
+            # Releasing the old snapshot first, a mapped file can't be replaced on every platform
+            if self.snapshot is not None:
+                self.snapshot.close()
+                self.snapshot = None
+
+            # Written to a temporary file and renamed, so other processes never read it half written
+            write_snapshot(self.cache_file, data)
 
         except Exception as e:
             print(f"Error caching data: {e}")
 
 
-    def extract_benchmarks(self, data, country):
-        """Extracting benchmarks values from the data"""
-        try:
-            # Get the most recent year's data for the specified country
-            country_emissions = self.get_latest_emissions(data, country)
-
-            # Calculate global average from available countries
-            global_emissions = self.calculate_global_average(data)
-
-            # Get some reference countries from comparison
-            reference_countries = self.get_reference_countries(data)
-
-            return {
-                'user_country': country,
-                'country_avg': country_emissions,
-                'global_avg': global_emissions,
-                'sustainable_target': self.sustainable_target,
-                'reference_countries': reference_countries,
-                'data_year': self.get_latest_year(data)
-            }
-
-        except Exception as e:
-            print(f"Error extracting benchmarks: {e}")
-            return self.get_fallback_benchmarks(country)
+    def extract_benchmarks(self, index, country):
+        """Extracting benchmarks values from the benchmark index"""
+        return {
+            'user_country': country,
+            'country_avg': self.get_latest_emissions(index, country),
+            'global_avg': index['global_avg'],
+            'sustainable_target': self.sustainable_target,
+            'reference_countries': dict(index['reference_countries']),
+            'data_year': index['data_year']
+        }
 
 
-    def get_latest_emissions(self, data, country):
+    def get_latest_emissions(self, index, country):
         """Get the most recent emissions for a country"""
-        # Trying exact match first
-        if country in data and data[country]:
-            latest_year = max(data[country].keys())
-            return data[country][latest_year]
-
-        # Trying common variations
-        variations = [
-            country.title(),
-            country.upper(),
-            country.lower(),
-        ]
-
-        for v in variations:
-            if v in data and data[v]:
-                latest_year = max(data[v].keys())
-                return data[v][latest_year]
+        emissions = index['countries'].get(COUNTRY_INDEX.key(country))
+        if emissions is not None:
+            return emissions
 
         # Return global average if country not found
-        return self.calculate_global_average(data)
-
-
-    def calculate_global_average(self, data):
-        """Calculating the global average from available data"""
-        try:
-            # Getting world data if available
-            if 'world' in data and data['world']:
-                latest_year = max(data['world'].keys())
-                return data['world'][latest_year]
-
-            # Calculate average from major countries
-            major_countries = ['United States', 'China', 'Germany', 'United Kingdom',
-                               'France', 'Japan', 'Canada', 'Australia']
+        COUNTRY_INDEX.record_miss(country, 'benchmarks')
+        return index['global_avg']
 
-            total_emissions = 0
-            count = 0
 
-            for c in major_countries:
-                if c in data and data[c]:
-                    latest_year = max(data[c].keys())
-                    total_emissions += data[c][latest_year]
-                    count += 1
+    def calculate_global_average(self, latest):
+        """Calculating the global average from the latest emissions by country"""
+        # Getting world data if available
+        if 'World' in latest:
+            return latest['World']
 
-            if count > 0:
-                return total_emissions / count
+        # Calculate average from major countries
+        major_countries = ['United States', 'China', 'Germany', 'United Kingdom',
+                           'France', 'Japan', 'Canada', 'Australia']
 
-            return self.global_avg_fallback
+        emissions = [latest[c] for c in major_countries if c in latest]
+        if emissions:
+            return sum(emissions) / len(emissions)
 
-        except Exception:
-            return self.global_avg_fallback
+        return self.global_avg_fallback
 
 
-    def get_reference_countries(self, data):
+    def get_reference_countries(self, latest):
         """Getting reference countries for comparison"""
-        reference_countries = {}
-
         countries_to_check = ['United States', 'China', 'Germany', 'United Kingdom',
                               'France', 'Japan', 'Canada', 'Australia']
 
-
-        for c in countries_to_check:
-            if c in data and data[c]:
-                latest_year = max(data[c].keys())
-                reference_countries[c] = data[c][latest_year]
-
-
-        return reference_countries
+        return {c: latest[c] for c in countries_to_check if c in latest}
 
 
     def get_latest_year(self, data):
         """Getting latest year for comparison"""
-        try:
-            all_years = []
-            for country_data in data.values():
-                if isinstance(country_data, dict):
-                    all_years.append(country_data.keys())
-
-            return max(all_years) if all_years else 2022
-
-        except Exception:
-            return 2022
+        years = [year for country_data in data.values() for year in country_data]
+        return max(years) if years else 2022
 
 
     def get_fallback_benchmarks(self, country):
@@ -0,0 +1,143 @@
+"""
+Benchmark Snapshot:
+    Compact binary snapshot of benchmark data, read through mmap
+"""
+
+
+import os
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+
+
+MAGIC = b'OWID'
+VERSION = 1
+
+# Magic, version, number of countries, number of rows
+HEADER = struct.Struct('<4sIII')
+
+
+def write_snapshot(filepath, data):
+    """Write {country: {year: emissions}} data as a snapshot, replacing the file atomically
+
+    After the header come the emissions (float64) and years (int32) of all
+    rows, grouped by country and sorted by year, then the first row of
+    every country and the offsets of the country names (uint32), and the
+    UTF-8 country names.
+    """
+    emissions = array('d')
+    years = array('i')
+    row_starts = array('I', [0])
+    name_offsets = array('I', [0])
+    names = bytearray()
+
+    for country in sorted(data):
+        for year in sorted(data[country]):
+            years.append(int(year))
+            emissions.append(float(data[country][year]))
+        row_starts.append(len(years))
+
+        names += country.encode('utf-8')
+        name_offsets.append(len(names))
+
+    with open(filepath + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(data), len(years)))
+        for values in (emissions, years, row_starts, name_offsets):
+            f.write(values.tobytes())
+        f.write(names)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(filepath + '.tmp', filepath)
+
+
+def read_snapshot(filepath):
+    """Open a snapshot as {country: {year: emissions}} data, read straight from its mapping"""
+    return Snapshot(filepath)
+
+
+class CountrySeries(Mapping):
+    """Years and emissions of one country, indexing the snapshot's columns without copying"""
+
+    def __init__(self, snapshot, start, end):
+        """Initializing the series of rows [start, end)"""
+        self.snapshot = snapshot
+        self.start = start
+        self.end = end
+
+    def __getitem__(self, year):
+        """Get the emissions of a year, found by bisecting the sorted years"""
+        years = self.snapshot.years
+        row = bisect_left(years, year, self.start, self.end)
+        if row == self.end or years[row] != year:
+            raise KeyError(year)
+        return self.snapshot.emissions[row]
+
+    def __iter__(self):
+        """Iterate over the years, oldest first"""
+        years = self.snapshot.years
+        return (years[row] for row in range(self.start, self.end))
+
+    def __len__(self):
+        """Count the years"""
+        return self.end - self.start
+
+
+class Snapshot(Mapping):
+    """Benchmark data of a snapshot file, read through a mapping kept open
+
+    Processes reading the same snapshot share its pages in the page cache.
+    The columns are typed views into the mapping, and only the country
+    names are decoded when the snapshot is opened; a country's rows are
+    read when they are used. close() releases the mapping.
+    """
+
+    def __init__(self, filepath):
+        """Mapping the snapshot file and slicing its columns"""
+        with open(filepath, 'rb') as f:
+            self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, countries, rows = HEADER.unpack_from(self.mapped)
+        if magic != MAGIC or version != VERSION:
+            self.mapped.close()
+            raise ValueError("not a benchmark snapshot")
+
+        self.view = memoryview(self.mapped)
+
+        offset = HEADER.size
+        self.emissions = self.column(offset, rows, 'd')
+        self.years = self.column(offset + rows * 8, rows, 'i')
+        self.row_starts = self.column(offset + rows * 12, countries + 1, 'I')
+        name_offsets = self.column(offset + rows * 12 + (countries + 1) * 4, countries + 1, 'I')
+        names = offset + rows * 12 + (countries + 1) * 8
+
+        # Country name -> position of its rows
+        self.positions = {bytes(self.view[names + name_offsets[i]:names + name_offsets[i + 1]]).decode('utf-8'): i
+                          for i in range(countries)}
+        name_offsets.release()
+
+    def column(self, offset, count, typecode):
+        """Get a typed view of count values at an offset of the mapping"""
+        return self.view[offset:offset + count * array(typecode).itemsize].cast(typecode)
+
+    def __getitem__(self, country):
+        """Get the series of a country"""
+        i = self.positions[country]
+        return CountrySeries(self, self.row_starts[i], self.row_starts[i + 1])
+
+    def __iter__(self):
+        """Iterate over the country names"""
+        return iter(self.positions)
+
+    def __len__(self):
+        """Count the countries"""
+        return len(self.positions)
+
+    def close(self):
+        """Release the column views and the mapping"""
+        if self.mapped.closed:
+            return
+        for values in (self.emissions, self.years, self.row_starts, self.view):
+            values.release()
+        self.mapped.close()
@@ -0,0 +1,155 @@
+"""
+Country Index:
+    Resolves country names, ISO codes and aliases to one canonical name
+"""
+
+
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+
+# Distinct unmatched names counted per source, and the length they are cut to,
+# so names sent by clients can't grow the counts without bound
+MAX_MISSES = 200
+MAX_MISS_LENGTH = 64
+
+# Name counting unmatched names once a source has MAX_MISSES of them
+OTHER_MISSES = '(other)'
+
+# Canonical names (as used by Our World in Data), ISO 3166 alpha-2 and alpha-3 codes and aliases
+COUNTRIES = [
+    ('Argentina', 'AR', 'ARG', ()),
+    ('Australia', 'AU', 'AUS', ()),
+    ('Austria', 'AT', 'AUT', ('Österreich',)),
+    ('Bangladesh', 'BD', 'BGD', ()),
+    ('Belgium', 'BE', 'BEL', ('België', 'Belgique')),
+    ('Brazil', 'BR', 'BRA', ('Brasil',)),
+    ('Canada', 'CA', 'CAN', ()),
+    ('Chile', 'CL', 'CHL', ()),
+    ('China', 'CN', 'CHN', ("People's Republic of China", 'PRC', 'Mainland China')),
+    ('Colombia', 'CO', 'COL', ()),
+    ("Cote d'Ivoire", 'CI', 'CIV', ('Ivory Coast',)),
+    ('Czechia', 'CZ', 'CZE', ('Czech Republic',)),
+    ('Democratic Republic of Congo', 'CD', 'COD', ('DR Congo', 'DRC', 'Congo-Kinshasa')),
+    ('Denmark', 'DK', 'DNK', ('Danmark',)),
+    ('Egypt', 'EG', 'EGY', ()),
+    ('Ethiopia', 'ET', 'ETH', ()),
+    ('Finland', 'FI', 'FIN', ('Suomi',)),
+    ('France', 'FR', 'FRA', ()),
+    ('Germany', 'DE', 'DEU', ('Deutschland', 'Federal Republic of Germany')),
+    ('Greece', 'GR', 'GRC', ('Hellas',)),
+    ('Hungary', 'HU', 'HUN', ()),
+    ('India', 'IN', 'IND', ('Bharat',)),
+    ('Indonesia', 'ID', 'IDN', ()),
+    ('Iran', 'IR', 'IRN', ('Islamic Republic of Iran',)),
+    ('Ireland', 'IE', 'IRL', ('Eire', 'Republic of Ireland')),
+    ('Israel', 'IL', 'ISR', ()),
+    ('Italy', 'IT', 'ITA', ('Italia',)),
+    ('Japan', 'JP', 'JPN', ('Nippon',)),
+    ('Kenya', 'KE', 'KEN', ()),
+    ('Malaysia', 'MY', 'MYS', ()),
+    ('Mexico', 'MX', 'MEX', ('México',)),
+    ('Morocco', 'MA', 'MAR', ()),
+    ('Netherlands', 'NL', 'NLD', ('Holland', 'The Netherlands', 'Nederland')),
+    ('New Zealand', 'NZ', 'NZL', ('Aotearoa',)),
+    ('Nigeria', 'NG', 'NGA', ()),
+    ('Norway', 'NO', 'NOR', ('Norge',)),
+    ('Pakistan', 'PK', 'PAK', ()),
+    ('Peru', 'PE', 'PER', ()),
+    ('Philippines', 'PH', 'PHL', ()),
+    ('Poland', 'PL', 'POL', ('Polska',)),
+    ('Portugal', 'PT', 'PRT', ()),
+    ('Qatar', 'QA', 'QAT', ()),
+    ('Romania', 'RO', 'ROU', ()),
+    ('Russia', 'RU', 'RUS', ('Russian Federation',)),
+    ('Saudi Arabia', 'SA', 'SAU', ('KSA',)),
+    ('Singapore', 'SG', 'SGP', ()),
+    ('South Africa', 'ZA', 'ZAF', ('RSA',)),
+    ('South Korea', 'KR', 'KOR', ('Korea', 'Republic of Korea', 'Korea, South', 'Korea, Republic of')),
+    ('Spain', 'ES', 'ESP', ('España',)),
+    ('Sweden', 'SE', 'SWE', ('Sverige',)),
+    ('Switzerland', 'CH', 'CHE', ('Schweiz', 'Suisse', 'Svizzera')),
+    ('Thailand', 'TH', 'THA', ()),
+    ('Turkey', 'TR', 'TUR', ('Türkiye', 'Turkiye')),
+    ('Ukraine', 'UA', 'UKR', ()),
+    ('United Arab Emirates', 'AE', 'ARE', ('UAE',)),
+    ('United Kingdom', 'GB', 'GBR', ('UK', 'Great Britain', 'Britain', 'England', 'Scotland', 'Wales')),
+    ('United States', 'US', 'USA', ('United States of America', 'America', 'U.S.', 'U.S.A.')),
+    ('Vietnam', 'VN', 'VNM', ('Viet Nam',)),
+    ('World', None, 'OWID_WRL', ('Global',)),
+]
+
+
+def normalize(name):
+    """Normalize a country name for lookups: accents, case, dots and spacing removed"""
+    name = unicodedata.normalize('NFKD', str(name))
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    name = name.casefold().replace('&', ' and ').replace('.', '').replace('’', "'")
+    return re.sub(r'\s+', ' ', name).strip()
+
+
+class CountryIndex:
+    """Lookup table from every known spelling of a country to its canonical name
+
+    Names, ISO codes and aliases are normalized once when the index is
+    built, so resolving a name is one normalization and one dict lookup.
+    Services record the names they could not match, by source.
+    """
+
+    def __init__(self, countries=COUNTRIES):
+        """Initializing the index from (name, iso2, iso3, aliases) entries"""
+        self.lock = threading.Lock()
+        self.names = {}
+        self.codes = {}
+
+        for name, iso2, iso3, aliases in countries:
+            self.codes[name] = {'iso2': iso2, 'iso3': iso3}
+            for spelling in (name, iso2, iso3) + tuple(aliases):
+                if spelling:
+                    self.names[normalize(spelling)] = name
+
+        # source -> name -> number of unmatched lookups
+        self.misses = {}
+
+
+    def resolve(self, name):
+        """Get the canonical name of a country, None if it is unknown"""
+        if not name:
+            return None
+        return self.names.get(normalize(name))
+
+
+    def key(self, name):
+        """Get the lookup key of a country, its canonical name or else its normalized name"""
+        return self.resolve(name) or normalize(name)
+
+
+    def get_codes(self, name):
+        """Get the ISO codes of a country, None if it is unknown"""
+        return self.codes.get(self.resolve(name))
+
+
+    def record_miss(self, name, source):
+        """Count a country name a service could not match
+
+        Names are cut to MAX_MISS_LENGTH characters, and new names are counted
+        as OTHER_MISSES once a source has MAX_MISSES distinct names.
+        """
+        name = str(name)[:MAX_MISS_LENGTH]
+        with self.lock:
+            counts = self.misses.setdefault(source, Counter())
+            if name not in counts and len(counts) >= MAX_MISSES:
+                name = OTHER_MISSES
+            counts[name] += 1
+
+
+    def get_misses(self):
+        """Get the unmatched country names with their counts, by source"""
+        with self.lock:
+            return {source: dict(counts.most_common()) for source, counts in self.misses.items()}
+
+
+# Shared index, built once at import
+COUNTRY_INDEX = CountryIndex()
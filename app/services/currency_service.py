@@ -3,6 +3,9 @@
     Handles currency selection based on country
 """
 
+from app.services.country_index import COUNTRY_INDEX
+
+
 class CurrencyService:
     """Service handling currency based on the country selected in the data entry form"""
 
@@ -55,7 +58,12 @@ class CurrencyService:
 
     def get_currency_for_country(self, country):
         """To get the information of currency on a specific country"""
-        return self.country_currency_map.get(country, self.default_currency)
+        # Resolving ISO codes and aliases such as 'DE' or 'Deutschland' to the map's names
+        currency = self.country_currency_map.get(COUNTRY_INDEX.resolve(country))
+        if currency is None:
+            COUNTRY_INDEX.record_miss(country, 'currency')
+            return self.default_currency
+        return currency
 
     def get_currency_symbol(self, country):
         """To get the currency symbol on a specific country"""
@@ -6,22 +6,116 @@ Data Service:
 
 import os
 import json
+import atexit
+import base64
+import binascii
+import shutil
+import sqlite3
 import datetime
+import tempfile
+import threading
+
+import numpy as np
+
+from app.models.footprint_result import FootprintResult
+from app.models.footprint_timeseries import FootprintTimeSeries, month_key, parse_month
+from app.services.report_store import ReportStore, content_hash
+from app.services.footprint_archive import FootprintArchive
+from app.services.entity_history import EntityHistory, entity_key
+from app.services.report_writer import ReportWriter
+from app.services.report_bundles import ReportBundles
+from app.services.report_index import ReportIndex, report_facets
+from app.services.ranking_service import ReportRanking, footprint_value
+
+
+# Default directory of the report files, bundles and database
+REPORTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'reports')
+
+# Reports older than this many days are moved into compressed monthly bundles
+HOT_DAYS = 90
+
 
 class DataService:
     """Service for storing and retrieving carbon footprint data"""
 
-    def __init__(self):
-        """Initializing data service"""
-        self.reports_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'reports')
+    def __init__(self, reports_dir=None, write_behind=True, hot_days=HOT_DAYS, retention_days=None):
+        """Initializing data service
+
+        archive_old_reports() moves reports older than hot_days from
+        individual files into compressed monthly bundles. With retention_days
+        set, it also reduces whole months older than that to monthly
+        aggregates. It only runs when called, see archive_reports.py.
+        """
+        self.reports_dir = reports_dir or REPORTS_DIR
 
         # Creating the report directory if it doesn't already exist
         if not os.path.exists(self.reports_dir):
             os.makedirs(self.reports_dir)
 
+        # Cold tier of older reports, moved there by archive_old_reports()
+        self.bundles = ReportBundles(os.path.join(self.reports_dir, 'bundles'))
+        self.hot_days = hot_days
+        self.retention_days = retention_days
+
+        # Indexed store serving listings and lookups, the JSON files and bundles of reports stay as the archive
+        self.store = ReportStore(os.path.join(self.reports_dir, 'reports.db'))
+        self.store.migrate_json_reports(self.reports_dir, self.get_report_name, bundles=self.bundles)
+        self.store.backfill_hashes()
+
+        # Columnar archive of footprints for analytics, also keeping the reports reduced by retention,
+        # rebuilt from the store whenever they disagree
+        self.archive = FootprintArchive(os.path.join(self.reports_dir, 'archive'))
+        if self.archive.count() != self.store.count() + self.store.rolled_up()[0]:
+            self.rebuild_archive()
+        atexit.register(self.archive.flush)
+
+        # Footprints of stored reports for percentile ranks, loaded from the archive
+        self.ranking = ReportRanking()
+        self.load_ranking()
+
+        # Report series of every organization and person, filled from the store on first use
+        self.history = EntityHistory(self.store)
+        if self.history.count() == 0 and self.store.count() > 0:
+            self.rebuild_history()
+
+        # Faceted search index, loaded from the facets kept in the store
+        self.index = ReportIndex()
+        self.index_rowid = 0
+        self.backfill_facets()
+        self.refresh_index()
+
+        # Reports queued for writing, readable by filename until they are written,
+        # and the filenames of queued reports by content hash
+        self.pending = {}
+        self.pending_hashes = {}
+        self.lock = threading.Lock()
+
+        # Writing reports on a background thread, finishing the queue on shutdown
+        self.writer = ReportWriter(self.write_reports) if write_behind else None
+        if self.writer:
+            atexit.register(self.close)
+
 
     def save_report(self, user_data, footprint_data):
-        """Save report data to the file"""
+        """Save report data to the file
+
+        Reports are content-addressed: saving the same user data and results
+        again does not write anything and returns the path of the existing
+        report.
+        """
+        return self.add_report(user_data, footprint_data)[0]
+
+
+    def add_report(self, user_data, footprint_data):
+        """Save report data like save_report(), returning the path and whether a new report was created"""
+        if isinstance(footprint_data, FootprintResult):
+            footprint_data = footprint_data.to_dict()
+
+        report_hash = content_hash(user_data, footprint_data)
+        existing = self.pending_hashes.get(report_hash) or self.store.find_by_hash(report_hash)
+        if existing:
+            return os.path.join(self.reports_dir, existing), False
+
         # Creating a unique file for it
         timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
 
@@ -33,9 +127,6 @@ class DataService:
         # Clean the name for the file name
         safe_name = ''.join(c if c.isalnum() else '_' for c in name)
 
-        filename = f"{timestamp}_{safe_name}.json"
-        filepath = os.path.join(self.reports_dir, filename)
-
         # Combine data for storage
         report_data = {
             'user_data': user_data,
@@ -44,64 +135,570 @@ class DataService:
             'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         }
 
-        # Save to file
-        with open(filepath, 'w') as f:
-            json.dump(report_data, f, indent=4)
+        with self.lock:
+            # Checking again in case the same report was queued meanwhile
+            if report_hash in self.pending_hashes:
+                return os.path.join(self.reports_dir, self.pending_hashes[report_hash]), False
+
+            filename = f"{timestamp}_{safe_name}.json"
+            filepath = os.path.join(self.reports_dir, filename)
+
+            # Numbering reports saved for the same name within the same second
+            counter = 1
+            while filename in self.pending or os.path.exists(filepath):
+                filename = f"{timestamp}_{safe_name}_{counter}.json"
+                filepath = os.path.join(self.reports_dir, filename)
+                counter += 1
+
+            self.pending[filename] = report_data
+            self.pending_hashes[report_hash] = filename
+
+        # Save to file, in the background when write-behind is on
+        if self.writer:
+            self.writer.submit((filename, report_data))
+        else:
+            self.write_reports([(filename, report_data)])
+
+        return filepath, True
+
+
+    def write_reports(self, reports):
+        """Durably write a batch of (filename, report_data) and index them
+
+        Returns the reports that could not be written. They stay queued and
+        readable by filename, so they can be written again.
+        """
+        written = []
+        failed = []
+        for report in reports:
+            filename, report_data = report
+            filepath = os.path.join(self.reports_dir, filename)
+            try:
+                with open(filepath + '.tmp', 'w') as f:
+                    json.dump(report_data, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(filepath + '.tmp', filepath)
+                written.append(report)
+            except (OSError, TypeError, ValueError) as e:
+                print(f"Error saving report {filename}: {e}")
+                failed.append(report)
+
+        _fsync_dir(self.reports_dir)
+
+        names = [self.get_report_name(report_data.get('user_data', {})) for filename, report_data in written]
+        self.store.add_reports([(filename, report_data, name)
+                                for (filename, report_data), name in zip(written, names)])
+        for (filename, report_data), name in zip(written, names):
+            self.archive.append(report_data['date'], report_data['user_data'], report_data['footprint_data'])
+            self.history.add_report(filename, report_data, name)
+            value = footprint_value(report_data['footprint_data'], report_data['user_data'].get('user_type'))
+            if value is not None:
+                self.ranking.add(value)
+        self.archive.flush()
+        self.refresh_index()
+
+        # Only reports that are written and indexed leave the queue
+        with self.lock:
+            for filename, report_data in written:
+                self.pending.pop(filename, None)
+                self.pending_hashes.pop(content_hash(report_data['user_data'], report_data['footprint_data']), None)
+
+        return failed
+
+
+    def flush(self):
+        """Wait until every saved report is written"""
+        if self.writer:
+            self.writer.flush()
+
+
+    def close(self):
+        """Write the queued reports and stop the writer, trying failed reports once more"""
+        if self.writer:
+            self.writer.close()
+
+        with self.lock:
+            failed = list(self.pending.items())
+        if failed:
+            self.write_reports(failed)
+        self.archive.flush()
 
-        return filepath
+
+    def deduplicate(self, dry_run=False):
+        """Remove reports whose content repeats an older report
+
+        Indexes any report files and bundled reports not yet in the store,
+        keeps the oldest report of every set of identical reports and
+        deletes the others, files and bundle entries included. The history
+        and analytics archive are rebuilt afterwards. Returns the number of
+        reports checked and removed and the bytes freed.
+        """
+        self.flush()
+        duplicates, summary = find_duplicates(self.store, self.bundles, self.reports_dir)
+        if dry_run:
+            return summary
+
+        # Duplicates moved into bundles, by month
+        bundled = {}
+        for filename in duplicates:
+            bundle = self.store.get_bundle(filename)
+            if bundle:
+                bundled.setdefault(bundle, []).append(filename)
+
+            filepath = os.path.join(self.reports_dir, filename)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+        for month, filenames in bundled.items():
+            self.bundles.discard(month, filenames)
+
+        if duplicates:
+            self.store.delete_reports(duplicates)
+            for filename in duplicates:
+                self.index.remove(filename)
+
+            self.history.clear()
+            self.rebuild_history()
+            self.rebuild_archive()
+            self.load_ranking()
+
+        return summary
+
+
+    def write_stats(self):
+        """Get the write queue metrics, None without write-behind"""
+        return self.writer.stats() if self.writer else None
 
 
     def get_all_reports(self):
         """Get a list of all saved reports"""
         reports = []
 
-        if not os.path.exists(self.reports_dir):
-            return reports
+        # Reading our own writes, queued reports are written first
+        if self.pending:
+            self.flush()
 
-        for filename in os.listdir(self.reports_dir):
-            if filename.endswith('.json'):
-                filepath = os.path.join(self.reports_dir, filename)
-                try:
-                    with open(filepath, 'r') as f:
-                        report_data = json.load(f)
-
-                    # Extracting key information for listing
-                    report_info = {
-                        'filename': filename,
-                        'date': report_data.get('date', 'Unknown'),
-                        'name': self.get_report_name(report_data.get('user_data', {})),
-                        'total_footprint': report_data.get('footprint_data', {}).get('total', 0),
-                        'filepath': filepath
-                    }
-
-                    reports.append(report_info)
-                except:
-                    # Skip files that can't be parsed
-                    continue
-
-        # Sort by date (newest first)
-        reports.sort(key=lambda x: x['date'], reverse=True)
+        # Sorted by date (newest first) through the store's index
+        for row in self.store.list_reports():
+            reports.append(self.report_info(row))
 
         return reports
 
-def get_report(self, filename):
-    """Get a specific report by filename"""
-    filepath = os.path.join(self.reports_dir, filename)
 
-    if not os.path.exists(filepath):
-        return None
+    def get_reports_page(self, page_size=20, after=None, before=None, sort='newest', filters=None):
+        """Get one page of saved reports
 
-    try:
-        with open(filepath, 'r') as f:
-            report_data = json.load(f)
-        return report_data
-    except:
-        return None
+        after and before are cursors from a previous page, sort is 'newest'
+        or 'oldest' and filters may hold user_type, country and a name
+        prefix. Only the rows of the requested page are read.
+        """
+        if self.pending:
+            self.flush()
+
+        after_key = decode_cursor(after)
+        before_key = decode_cursor(before)
+        if before_key is not None:
+            after_key = None
+
+        rows, has_more = self.store.list_page(page_size, after_key, before_key,
+                                              descending=sort != 'oldest', filters=filters)
+
+        if before_key is not None:
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = after_key is not None, has_more
+
+        return {
+            'reports': [self.report_info(row) for row in rows],
+            'next_cursor': encode_cursor(rows[-1]) if rows and has_next else None,
+            'previous_cursor': encode_cursor(rows[0]) if rows and has_previous else None,
+        }
+
+
+    def report_info(self, row):
+        """Get the listing information of a stored report"""
+        return {
+            'filename': row['filename'],
+            'date': row['date'],
+            'name': row['name'],
+            'total_footprint': row['total'],
+            'filepath': os.path.join(self.reports_dir, row['filename'])
+        }
+
+
+    def iter_reports(self, before=None):
+        """Yield (filename, report data) of every stored report, oldest first"""
+        for filename, report_data, bundle in self.store.iter_reports(before):
+            if report_data is None and bundle:
+                report_data = self.bundles.get(bundle, filename)
+            if report_data is not None:
+                yield filename, report_data
+
+
+    def archive_old_reports(self, now=None):
+        """Move older reports into monthly bundles and apply the retention policy
+
+        Bundled reports keep their listing entry but their file and stored
+        payload are removed. Returns the number of bundled reports and of
+        reports reduced to aggregates.
+        """
+        now = now or datetime.datetime.now()
+        summary = {'bundled': 0, 'rolled_up': 0}
+
+        if self.hot_days is not None:
+            cutoff = (now - datetime.timedelta(days=self.hot_days)).strftime('%Y-%m-%d %H:%M:%S')
+
+            months = {}
+            for filename, date, report_data in self.store.unbundled_before(cutoff):
+                months.setdefault(date[:7], []).append((filename, report_data))
+
+            for month, reports in months.items():
+                self.bundles.add(month, reports)
+                self.store.mark_bundled([filename for filename, report_data in reports], month)
+
+                for filename, report_data in reports:
+                    filepath = os.path.join(self.reports_dir, filename)
+                    if os.path.exists(filepath):
+                        os.remove(filepath)
+                summary['bundled'] += len(reports)
+
+        if self.retention_days is not None:
+            # Only whole months are reduced, so their bundles can be deleted
+            cutoff_month = (now - datetime.timedelta(days=self.retention_days)).strftime('%Y-%m')
+            summary['rolled_up'] = self.roll_up_before(f"{cutoff_month}-01")
+
+        return summary
+
+
+    def roll_up_before(self, date):
+        """Reduce the reports before a date to monthly aggregates and delete them"""
+        rollups = {}
+        filenames = []
+        for filename, report_data in self.iter_reports(before=date):
+            user_data = report_data.get('user_data', {})
+            footprint_data = report_data.get('footprint_data', {})
+
+            key = (report_data.get('date', 'Unknown')[:7], user_data.get('country') or '', user_data.get('user_type') or '')
+            rollup = rollups.setdefault(key, [0, 0.0, {}])
+            rollup[0] += 1
+            rollup[1] += footprint_data.get('total', 0)
+            for category, values in footprint_data.get('categories', {}).items():
+                if isinstance(values, dict):
+                    rollup[2][category] = rollup[2].get(category, 0) + values.get('total', 0)
+            filenames.append(filename)
+
+        if not filenames:
+            return 0
 
+        # The archive and ranking keep the footprints of the reports, the history drops them
+        self.store.roll_up([key + tuple(rollup) for key, rollup in rollups.items()], filenames, date)
+        self.history.remove_reports(filenames)
+        for filename in filenames:
+            self.index.remove(filename)
 
-def get_report_name(self, user_data):
+        for filename in filenames:
+            filepath = os.path.join(self.reports_dir, filename)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        for month in self.bundles.months():
+            if month < date[:7]:
+                self.bundles.remove(month)
+
+        return len(filenames)
+
+
+    def backfill_facets(self):
+        """Store the facets of reports saved before the search index existed"""
+        facets = []
+        for filename, report_data, bundle in self.store.missing_facets():
+            if report_data is None and bundle:
+                report_data = self.bundles.get(bundle, filename)
+            if report_data is not None:
+                facets.append((filename, report_facets(report_data)))
+
+        if facets:
+            self.store.set_facets(facets)
+
+
+    def refresh_index(self):
+        """Add reports stored since the index was last refreshed, including ones saved by other processes"""
+        with self.index.lock:
+            self.index_rowid, reports = self.store.get_facets(self.index_rowid)
+            self.index.load(reports)
+
+
+    def search_reports(self, facets=None, ranges=None, start=None, end=None, quarter=None, limit=100):
+        """Find saved reports by facets, numeric ranges and date, newest first
+
+        facets may hold country, user_type, industry, diet and fuel values
+        (or lists of values), ranges maps 'total' or a category to a
+        (minimum, maximum) pair in kg CO2e, and quarter such as '2025-Q3'
+        sets the date range. For example the Organization reports in
+        Germany with over 10 t of energy emissions in Q3 2025:
+
+            search_reports({'country': 'Germany', 'user_type': 'Organization'},
+                           {'energy': (10000, None)}, quarter='2025-Q3')
+        """
+        if self.pending:
+            self.flush()
+        self.refresh_shared()
+        self.refresh_index()
+
+        if quarter:
+            start, end = quarter_range(quarter)
+
+        filenames = self.index.query(facets, ranges, start, end, limit)
+        return [self.report_info(row) for row in self.store.get_infos(filenames)]
+
+
+    def get_rollups(self):
+        """Get the monthly aggregates of reports removed by the retention policy"""
+        return self.store.get_rollups()
+
+
+    def rebuild_archive(self):
+        """Rebuild the footprint archive from the stored reports
+
+        Rows of reports reduced to aggregates by retention are kept, since
+        the store no longer has them.
+        """
+        rolled_up, before = self.store.rolled_up()
+        kept = self.archive.truncate(before) if before else 0
+        if not before:
+            self.archive.clear()
+
+        # Rows that were lost can't be restored, so they are no longer expected
+        if kept != rolled_up:
+            self.store.set_meta('rolled_up_reports', str(kept))
+
+        for filename, report_data in self.iter_reports():
+            self.archive.append(report_data.get('date'), report_data.get('user_data', {}),
+                                report_data.get('footprint_data', {}))
+        self.archive.flush()
+
+
+    def load_ranking(self):
+        """Load the footprints of the archived reports into the ranking, as footprint_value() ranks them"""
+        with self.archive.lock:
+            parts = list(self.archive.scan())
+            organization = self.archive.code_index['user_type'].get('Organization', -1)
+            self.archive_changes = self.archive.changes
+
+        values = []
+        for columns in parts:
+            per_capita = columns['per_capita']
+            missing = np.isnan(per_capita)
+            ranked = ~(missing & (columns['user_type'] == organization))
+            values.append(np.where(missing, columns['total'], per_capita)[ranked])
+        self.ranking.load(np.concatenate(values) if values else [])
+
+
+    def refresh_shared(self):
+        """Reload the ranking and search index when another process changed the archive
+
+        Both are kept in each process and only follow its own saves, while
+        every process writes its saves, deduplication and rebuilds to the
+        shared archive.
+        """
+        self.archive.refresh()
+        if self.archive.changes == self.archive_changes:
+            return
+
+        self.load_ranking()
+        with self.index.lock:
+            self.index.clear()
+            self.index_rowid = 0
+            self.refresh_index()
+
+
+    def get_report_percentile(self, value):
+        """Get the percentage of stored reports with a lower footprint, None without reports"""
+        self.refresh_shared()
+        return self.ranking.percentile(value)
+
+
+    def rebuild_history(self):
+        """Add every stored report to the entity history"""
+        for filename, report_data in self.iter_reports():
+            self.history.add_report(filename, report_data, self.get_report_name(report_data.get('user_data', {})))
+
+
+    def get_entity_history(self, key):
+        """Get the summary and report series of an organization or person, None if unknown"""
+        entity = self.history.get_entity(key)
+        if entity is None:
+            return None
+
+        entity['series'] = self.history.get_series(key)
+        return entity
+
+
+    def add_month(self, user_data, month, calculator=None):
+        """Calculate and store the footprint of one month of an organization or person
+
+        Returns the entity's time series, with the month in its quarter and
+        year rollups. Raises ValueError when the footprint can't be calculated.
+        """
+        key = entity_key(user_data)
+        footprint = FootprintTimeSeries(calculator).add_month(month, user_data)
+        self.history.set_month(key, month_key(month), footprint)
+        return self.get_timeseries(key, calculator, year=parse_month(month)[0])
+
+
+    def get_timeseries(self, key, calculator=None, year=None):
+        """Get the monthly footprints of an organization or person with their stored rollups, of one year if given"""
+        return FootprintTimeSeries.from_dict(self.history.get_months(key, year), calculator)
+
+
+    def get_entity_key(self, user_data):
+        """Get the history key of the organization or person of a report"""
+        return entity_key(user_data)
+
+
+    def get_report(self, filename):
+        """Get a specific report by filename"""
+        report_data = self.pending.get(filename)
+        if report_data is not None:
+            return report_data
+
+        report_data = self.store.get_payload(filename)
+        if report_data is not None:
+            return report_data
+
+        # Older reports are read from their monthly bundle
+        bundle = self.store.get_bundle(filename)
+        if bundle:
+            return self.bundles.get(bundle, filename)
+
+        # Falling back to report files added to the directory by hand
+        filepath = os.path.join(self.reports_dir, os.path.basename(filename))
+
+        if not os.path.exists(filepath):
+            return None
+
+        try:
+            with open(filepath, 'r') as f:
+                report_data = json.load(f)
+            return report_data
+        except:
+            return None
+
+
+    def get_report_name(self, user_data):
+        """Get the name to display for a report"""
+        return report_name(user_data)
+
+
+def report_name(user_data):
     """Get the name to display for a report"""
     if user_data.get('user_type') == 'Organization':
         return user_data.get('org_name', 'Unknown Organization')
     else:
-        return user_data.get('name', 'Unknown Individual')
\ No newline at end of file
+        return user_data.get('name', 'Unknown Individual')
+
+
+def find_duplicates(store, bundles, reports_dir):
+    """Get the reports whose content repeats an older report
+
+    Indexes any report files and bundled reports not yet in the store
+    first. Returns the duplicates, all but the oldest report of every set
+    of identical reports, and the summary of deduplicate().
+    """
+    store.migrate_json_reports(reports_dir, report_name, force=True, bundles=bundles)
+    store.backfill_hashes()
+
+    duplicates = [filename for group in store.duplicate_groups() for filename in group[1:]]
+    summary = {'reports': store.count(), 'duplicates': len(duplicates), 'bytes_freed': 0}
+
+    for filename in duplicates:
+        filepath = os.path.join(reports_dir, filename)
+        if os.path.exists(filepath):
+            summary['bytes_freed'] += os.path.getsize(filepath)
+
+        bundle = store.get_bundle(filename)
+        if bundle:
+            summary['bytes_freed'] += bundles.size(bundle, filename)
+
+    return duplicates, summary
+
+
+def preview_deduplicate(reports_dir=REPORTS_DIR):
+    """Get the summary of deduplicate() without changing the reports directory
+
+    Opens a copy of the report database instead of starting a DataService,
+    so nothing is migrated, rebuilt or written in the reports directory.
+    """
+    with tempfile.TemporaryDirectory() as scratch:
+        db_path = os.path.join(reports_dir, 'reports.db')
+        copy_path = os.path.join(scratch, 'reports.db')
+        if os.path.exists(db_path):
+            # Without a write-ahead log the database file is complete, and copying it
+            # leaves no log behind, unlike opening it. A database changed meanwhile is read instead
+            copied = False
+            if not os.path.exists(db_path + '-wal'):
+                mtime = os.stat(db_path).st_mtime_ns
+                shutil.copyfile(db_path, copy_path)
+                copied = not os.path.exists(db_path + '-wal') and os.stat(db_path).st_mtime_ns == mtime
+
+            if not copied:
+                source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+                target = sqlite3.connect(copy_path)
+                try:
+                    source.backup(target)
+                finally:
+                    source.close()
+                    target.close()
+
+        bundles_dir = os.path.join(reports_dir, 'bundles')
+        bundles = ReportBundles(bundles_dir if os.path.isdir(bundles_dir) else os.path.join(scratch, 'bundles'))
+
+        store = ReportStore(copy_path)
+        try:
+            duplicates, summary = find_duplicates(store, bundles, reports_dir)
+        finally:
+            store.connection().close()
+        return summary
+
+
+def quarter_range(quarter):
+    """Get the [start, end) dates of a quarter such as '2025-Q3'"""
+    year, number = str(quarter).upper().split('-Q')
+    year, number = int(year), int(number)
+    if not 1 <= number <= 4:
+        raise ValueError(f"Invalid quarter: {quarter}")
+
+    start = f"{year:04d}-{(number - 1) * 3 + 1:02d}-01"
+    end = f"{year:04d}-{number * 3 + 1:02d}-01" if number < 4 else f"{year + 1:04d}-01-01"
+    return start, end
+
+
+def encode_cursor(row):
+    """Encode the (date, filename) key of a report row as a URL-safe cursor"""
+    key = json.dumps([row['date'], row['filename']])
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor into its (date, filename) key, None if missing or invalid"""
+    if not cursor:
+        return None
+    try:
+        date, filename = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(date), str(filename)
+    except (ValueError, TypeError, binascii.Error):
+        return None
+
+
+def _fsync_dir(path):
+    """Make renames within a directory durable, where the platform allows it"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,355 @@
+"""
+Entity History:
+    Ordered footprint series of each organization or person with trend values,
+    and the monthly footprints they submit
+"""
+
+
+import json
+
+from app.models.footprint_result import ReportSeries
+from app.models.footprint_timeseries import FootprintTimeSeries, apply_month, rollup_keys
+from app.services.country_index import COUNTRY_INDEX
+
+
+# Number of reports averaged by the moving average
+MOVING_AVERAGE_WINDOW = 3
+
+# Version of entity_key() the stored keys were built with, kept in the store's meta table
+ENTITY_KEYS = 'canonical-country'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    entity_key TEXT PRIMARY KEY,
+    name TEXT,
+    country TEXT,
+    user_type TEXT,
+    reports INTEGER NOT NULL,
+    first_date TEXT,
+    latest_date TEXT,
+    latest_total REAL
+);
+CREATE TABLE IF NOT EXISTS entity_reports (
+    entity_key TEXT NOT NULL,
+    date TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    total REAL NOT NULL,
+    delta REAL,
+    moving_average REAL,
+    categories TEXT NOT NULL,
+    category_changes TEXT,
+    PRIMARY KEY (entity_key, date, filename)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS entity_months (
+    entity_key TEXT NOT NULL,
+    month TEXT NOT NULL,
+    total REAL NOT NULL,
+    categories TEXT NOT NULL,
+    PRIMARY KEY (entity_key, month)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS entity_rollups (
+    entity_key TEXT NOT NULL,
+    period TEXT NOT NULL,
+    total REAL NOT NULL,
+    categories TEXT NOT NULL,
+    months INTEGER NOT NULL,
+    PRIMARY KEY (entity_key, period)
+) WITHOUT ROWID;
+"""
+
+
+def entity_key(user_data):
+    """Get the stable key of the organization or person of a report
+
+    Built from the organization name (or person's name) and the country,
+    ignoring case and extra whitespace. Countries are keyed by their
+    canonical name, so 'DE' and 'Deutschland' are the same entity.
+    """
+    if user_data.get('user_type') == 'Organization':
+        name = user_data.get('org_name', '')
+    else:
+        name = user_data.get('name', '')
+
+    name = ' '.join(str(name).split()).casefold()
+    return f"{name}|{country_key(user_data.get('country'))}"
+
+
+def country_key(country):
+    """Get the key part of a country, its canonical name casefolded"""
+    return COUNTRY_INDEX.key(country).casefold() if country else ''
+
+
+class EntityHistory:
+    """Per-entity report series kept in the report store's database
+
+    Rows of one entity are stored clustered by (date, filename), so reading
+    a history is a single range read. Deltas, moving averages and category
+    changes are computed when a report is added, touching only the reports
+    that follow it in the entity's series.
+    """
+
+    def __init__(self, store, window=MOVING_AVERAGE_WINDOW):
+        """Initializing the history tables"""
+        self.store = store
+        self.window = window
+
+        with self.store.connection() as conn:
+            conn.executescript(SCHEMA)
+        if self.store.get_meta('entity_keys') != ENTITY_KEYS:
+            self.rekey_entities()
+        self.backfill_rollups()
+
+
+    def count(self):
+        """Count the reports in the history"""
+        return self.store.connection().execute('SELECT COUNT(*) FROM entity_reports').fetchone()[0]
+
+
+    def clear(self):
+        """Remove every entity and report from the history"""
+        with self.store.connection() as conn:
+            conn.execute('DELETE FROM entity_reports')
+            conn.execute('DELETE FROM entities')
+
+
+    def add_report(self, filename, report_data, name):
+        """Add a report to its entity's series and update the trend values"""
+        user_data = report_data.get('user_data', {})
+        footprint_data = report_data.get('footprint_data', {})
+        key = entity_key(user_data)
+        date = report_data.get('date', 'Unknown')
+
+        categories = {category: values.get('total', 0)
+                      for category, values in footprint_data.get('categories', {}).items()
+                      if isinstance(values, dict)}
+
+        with self.store.connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO entity_reports (entity_key, date, filename, total, categories) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, date, filename, footprint_data.get('total', 0), json.dumps(categories))
+            )
+
+            following = self.update_trends(conn, key, date, filename)
+
+            summary = conn.execute(
+                'SELECT COUNT(*) AS reports, MIN(date) AS first_date FROM entity_reports WHERE entity_key = ?',
+                (key,)
+            ).fetchone()
+
+            # The last row read is the entity's latest report, which also sets its display name
+            latest = following[-1]
+            naming = ', name = excluded.name, user_type = excluded.user_type' if len(following) == 1 else ''
+            conn.execute(
+                'INSERT INTO entities (entity_key, name, country, user_type, reports, first_date, latest_date, latest_total) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (entity_key) DO UPDATE SET reports = excluded.reports, first_date = excluded.first_date, '
+                'latest_date = excluded.latest_date, latest_total = excluded.latest_total' + naming,
+                (key, name, user_data.get('country'), user_data.get('user_type'), summary['reports'],
+                 summary['first_date'], latest['date'], latest['total'])
+            )
+
+
+    def update_trends(self, conn, key, date, filename):
+        """Recalculate the trend values of an entity's reports from (date, filename) on
+
+        Returns the rows recalculated, oldest first.
+        """
+        # Reports before the first one that the trend values depend on
+        previous = conn.execute(
+            'SELECT total, categories FROM entity_reports '
+            'WHERE entity_key = ? AND (date, filename) < (?, ?) '
+            'ORDER BY date DESC, filename DESC LIMIT ?',
+            (key, date, filename, self.window - 1)
+        ).fetchall()
+        totals = [row['total'] for row in reversed(previous)]
+        last_categories = json.loads(previous[0]['categories']) if previous else None
+
+        # The first report and any later ones, normally just a new report
+        following = conn.execute(
+            'SELECT filename, date, total, categories FROM entity_reports '
+            'WHERE entity_key = ? AND (date, filename) >= (?, ?) ORDER BY date, filename',
+            (key, date, filename)
+        ).fetchall()
+
+        updates = []
+        for row in following:
+            row_categories = json.loads(row['categories'])
+            delta = row['total'] - totals[-1] if totals else None
+
+            totals = (totals + [row['total']])[-self.window:]
+            moving_average = sum(totals) / len(totals)
+
+            category_changes = None
+            if last_categories is not None:
+                category_changes = {category: total - last_categories.get(category, 0)
+                                    for category, total in row_categories.items()}
+            last_categories = row_categories
+
+            updates.append((delta, moving_average,
+                            json.dumps(category_changes) if category_changes is not None else None,
+                            key, row['date'], row['filename']))
+
+        conn.executemany(
+            'UPDATE entity_reports SET delta = ?, moving_average = ?, category_changes = ? '
+            'WHERE entity_key = ? AND date = ? AND filename = ?',
+            updates
+        )
+
+        return following
+
+
+    def remove_reports(self, filenames):
+        """Remove reports from their entities' series, recalculating the trends and summaries left"""
+        with self.store.connection() as conn:
+            keys = set()
+            for start in range(0, len(filenames), 500):
+                chunk = filenames[start:start + 500]
+                keys.update(row['entity_key'] for row in conn.execute(
+                    f"SELECT DISTINCT entity_key FROM entity_reports WHERE filename IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ))
+            conn.executemany('DELETE FROM entity_reports WHERE filename = ?', [(filename,) for filename in filenames])
+
+            for key in keys:
+                following = self.update_trends(conn, key, '', '')
+                if not following:
+                    conn.execute('DELETE FROM entities WHERE entity_key = ?', (key,))
+                    continue
+
+                latest = following[-1]
+                conn.execute(
+                    'UPDATE entities SET reports = ?, first_date = ?, latest_date = ?, latest_total = ? '
+                    'WHERE entity_key = ?',
+                    (len(following), following[0]['date'], latest['date'], latest['total'], key)
+                )
+
+
+    def get_entity(self, key):
+        """Get the summary of an entity, None if unknown"""
+        row = self.store.connection().execute('SELECT * FROM entities WHERE entity_key = ?', (key,)).fetchone()
+        return dict(row) if row else None
+
+
+    def set_month(self, key, month, footprint):
+        """Store the footprint of one month of an entity, replacing an earlier one
+
+        Only the difference to the earlier footprint is applied to the
+        stored quarter and year rollups.
+        """
+        with self.store.connection() as conn:
+            row = conn.execute('SELECT total, categories FROM entity_months WHERE entity_key = ? AND month = ?',
+                               (key, month)).fetchone()
+            previous = {'total': row['total'], 'categories': json.loads(row['categories'])} if row else None
+
+            conn.execute(
+                'INSERT OR REPLACE INTO entity_months (entity_key, month, total, categories) VALUES (?, ?, ?, ?)',
+                (key, month, footprint['total'], json.dumps(footprint['categories']))
+            )
+
+            for period in rollup_keys(month):
+                row = conn.execute('SELECT total, categories, months FROM entity_rollups '
+                                   'WHERE entity_key = ? AND period = ?', (key, period)).fetchone()
+                rollup = ({'total': row['total'], 'categories': json.loads(row['categories']), 'months': row['months']}
+                          if row else {'total': 0.0, 'categories': {}, 'months': 0})
+                apply_month(rollup, previous, footprint)
+                conn.execute(
+                    'INSERT OR REPLACE INTO entity_rollups (entity_key, period, total, categories, months) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, period, rollup['total'], json.dumps(rollup['categories']), rollup['months'])
+                )
+
+
+    def get_months(self, key, year=None):
+        """Get the monthly footprints of an entity and their rollups, as stored by FootprintTimeSeries.to_dict
+
+        With a year, only the months and rollups of that year are read.
+        """
+        prefix = f"{int(year):04d}" if year is not None else ''
+        conn = self.store.connection()
+
+        months = conn.execute(
+            'SELECT month, total, categories FROM entity_months '
+            'WHERE entity_key = ? AND month >= ? AND month < ? ORDER BY month',
+            (key, prefix, prefix + '~')
+        )
+        rollups = conn.execute(
+            'SELECT period, total, categories, months FROM entity_rollups '
+            'WHERE entity_key = ? AND period >= ? AND period < ? ORDER BY period',
+            (key, prefix, prefix + '~')
+        )
+
+        data = {'months': {}, 'quarters': {}, 'years': {}}
+        for row in months:
+            data['months'][row['month']] = {'total': row['total'], 'categories': json.loads(row['categories'])}
+        for row in rollups:
+            rollup = {'total': row['total'], 'categories': json.loads(row['categories']), 'months': row['months']}
+            data['quarters' if '-Q' in row['period'] else 'years'][row['period']] = rollup
+        return data
+
+
+    def rekey_entities(self):
+        """Move the entities keyed before countries were canonicalized to their current keys
+
+        Monthly footprints are moved, a month already stored under the new
+        key winning, and their rollups rebuilt. The report series are
+        cleared when any key changed, for the data service to rebuild them.
+        """
+        conn = self.store.connection()
+        keys = [row['entity_key'] for row in conn.execute(
+            'SELECT entity_key FROM entities UNION SELECT entity_key FROM entity_months'
+        )]
+        moved = {}
+        for key in keys:
+            name, _, country = key.rpartition('|')
+            if country_key(country) != country:
+                moved[key] = f"{name}|{country_key(country)}"
+
+        with self.store.connection() as conn:
+            for old, new in moved.items():
+                conn.execute('INSERT OR IGNORE INTO entity_months (entity_key, month, total, categories) '
+                             'SELECT ?, month, total, categories FROM entity_months WHERE entity_key = ?', (new, old))
+                conn.execute('DELETE FROM entity_months WHERE entity_key = ?', (old,))
+                conn.execute('DELETE FROM entity_rollups WHERE entity_key IN (?, ?)', (old, new))
+            if moved:
+                conn.execute('DELETE FROM entity_reports')
+                conn.execute('DELETE FROM entities')
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('entity_keys', ENTITY_KEYS))
+
+
+    def backfill_rollups(self):
+        """Build the stored rollups of monthly footprints submitted before they were stored"""
+        conn = self.store.connection()
+        keys = [row['entity_key'] for row in conn.execute(
+            'SELECT DISTINCT entity_key FROM entity_months '
+            'WHERE entity_key NOT IN (SELECT entity_key FROM entity_rollups)'
+        )]
+
+        with self.store.connection() as conn:
+            for key in keys:
+                rows = conn.execute('SELECT month, total, categories FROM entity_months WHERE entity_key = ?', (key,))
+                series = FootprintTimeSeries.from_dict({'months': {
+                    row['month']: {'total': row['total'], 'categories': json.loads(row['categories'])} for row in rows
+                }})
+                conn.executemany(
+                    'INSERT OR REPLACE INTO entity_rollups (entity_key, period, total, categories, months) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(key, period, rollup['total'], json.dumps(rollup['categories']), rollup['months'])
+                     for period, rollup in list(series.quarters.items()) + list(series.years.items())]
+                )
+
+
+    def get_series(self, key):
+        """Get the reports of an entity, oldest first, with their trend values in a ReportSeries"""
+        rows = self.store.connection().execute(
+            'SELECT filename, date, total, delta, moving_average, categories, category_changes '
+            'FROM entity_reports WHERE entity_key = ? ORDER BY date, filename',
+            (key,)
+        )
+
+        series = ReportSeries()
+        for filename, date, total, delta, moving_average, categories, category_changes in rows:
+            series.append(filename, date, total, delta, moving_average, json.loads(categories),
+                          json.loads(category_changes) if category_changes else None)
+
+        return series
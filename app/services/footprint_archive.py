@@ -0,0 +1,412 @@
+"""
+Footprint Archive:
+    Append-only columnar archive of report footprints for analytics
+"""
+
+
+import os
+import json
+import shutil
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # File locks between processes are only available on POSIX systems
+    fcntl = None
+
+from app.models.carbon_calculator import CATEGORIES
+
+
+# Columns holding codes into the manifest's lists of distinct values
+CODE_COLUMNS = {'country': np.int16, 'user_type': np.int8}
+
+# Columns holding footprint values, besides one per category
+VALUE_COLUMNS = ['total', 'per_capita']
+
+# Columns that aggregations can group by
+GROUP_COLUMNS = ('country', 'user_type', 'year')
+
+STATISTICS = ('mean', 'sum', 'count')
+
+
+class FootprintArchive:
+    """Columnar archive of footprints in memory-mapped .npy segments
+
+    Appended rows are buffered and written as a new segment once the
+    buffer is full or on flush(). Segments are never changed after they
+    are written; whenever fanout segments of the same level exist they are
+    merged into one segment of the next level, so the number of segments
+    stays logarithmic in the number of rows.
+
+    Several processes can share an archive: changes to the manifest are
+    made under a lock file after reading its latest version, and country
+    and user type codes are only assigned then.
+    """
+
+    def __init__(self, archive_dir, segment_size=1024, fanout=8):
+        """Initializing the archive and reading its manifest"""
+        self.archive_dir = archive_dir
+        self.segment_size = segment_size
+        self.fanout = fanout
+        self.lock = threading.RLock()
+
+        if not os.path.exists(self.archive_dir):
+            os.makedirs(self.archive_dir)
+
+        # Memory-mapped columns of the segments read so far
+        self.segments = {}
+        self.lock_depth = 0
+
+        # Number of times the manifest was found changed by another process
+        self.changes = 0
+
+        self.manifest_mtime = None
+        self.refresh(force=True)
+        self.buffer = {column: [] for column in self.columns()}
+
+
+    def columns(self):
+        """Get the names of all columns"""
+        return ['timestamp'] + list(CODE_COLUMNS) + VALUE_COLUMNS + self.manifest['categories']
+
+
+    def read_manifest(self):
+        """Read the manifest listing the segments and code values"""
+        filepath = os.path.join(self.archive_dir, 'manifest.json')
+        if os.path.exists(filepath):
+            with open(filepath, 'r') as f:
+                return json.load(f)
+
+        return {
+            'categories': list(CATEGORIES),
+            'codes': {column: [] for column in CODE_COLUMNS},
+            'segments': [],
+            'next_segment': 0,
+        }
+
+
+    def refresh(self, force=False):
+        """Read the manifest again if another process changed it"""
+        filepath = os.path.join(self.archive_dir, 'manifest.json')
+        mtime = os.stat(filepath).st_mtime_ns if os.path.exists(filepath) else None
+        if mtime == self.manifest_mtime and not force:
+            return
+        if mtime != self.manifest_mtime:
+            self.changes += 1
+
+        self.manifest = self.read_manifest()
+        self.manifest_mtime = mtime
+        self.code_index = {column: {value: code for code, value in enumerate(values)}
+                           for column, values in self.manifest['codes'].items()}
+
+        names = {segment['name'] for segment in self.manifest['segments']}
+        for name in list(self.segments):
+            if name not in names:
+                del self.segments[name]
+
+
+    def write_manifest(self):
+        """Replace the manifest atomically"""
+        filepath = os.path.join(self.archive_dir, 'manifest.json')
+        with open(filepath + '.tmp', 'w') as f:
+            json.dump(self.manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(filepath + '.tmp', filepath)
+        self.manifest_mtime = os.stat(filepath).st_mtime_ns
+
+
+    @contextmanager
+    def file_lock(self, exclusive=True):
+        """Hold the archive's lock file, shared for reading or exclusive for changes"""
+        if fcntl is None or self.lock_depth:
+            self.lock_depth += 1
+            try:
+                yield
+            finally:
+                self.lock_depth -= 1
+            return
+
+        with open(os.path.join(self.archive_dir, 'archive.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self.lock_depth += 1
+            try:
+                yield
+            finally:
+                self.lock_depth -= 1
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+    def count(self):
+        """Count the archived rows, including buffered ones"""
+        with self.lock:
+            self.refresh()
+            return sum(segment['rows'] for segment in self.manifest['segments']) + len(self.buffer['timestamp'])
+
+
+    def clear(self):
+        """Remove every segment and buffered row"""
+        with self.lock, self.file_lock():
+            self.refresh(force=True)
+            names = [segment['name'] for segment in self.manifest['segments']]
+            self.manifest['segments'] = []
+            self.write_manifest()
+
+            for name in names:
+                self.segments.pop(name, None)
+                shutil.rmtree(os.path.join(self.archive_dir, name), ignore_errors=True)
+            self.buffer = {column: [] for column in self.columns()}
+
+
+    def truncate(self, before):
+        """Keep only the rows dated before a date, returning how many are kept
+
+        Later, undated and buffered rows are removed, and the rows kept are
+        merged into one segment.
+        """
+        before = np.datetime64(before, 's')
+
+        with self.lock, self.file_lock():
+            self.refresh(force=True)
+            segments = self.manifest['segments']
+            self.buffer = {column: [] for column in self.columns()}
+
+            kept = {column: np.zeros(0) for column in self.columns()}
+            if segments:
+                timestamps = np.concatenate([self.segment(segment['name'])['timestamp'] for segment in segments])
+                mask = timestamps < before
+                kept = {column: np.concatenate([self.segment(segment['name'])[column] for segment in segments])[mask]
+                        for column in self.columns()}
+
+            replaces = {segment['name'] for segment in segments}
+            if len(kept['timestamp']):
+                level = max(segment['level'] for segment in segments) + 1
+                self.add_segment(kept, level, replaces=replaces)
+            else:
+                self.manifest['segments'] = []
+                self.write_manifest()
+                for name in replaces:
+                    self.segments.pop(name, None)
+                    shutil.rmtree(os.path.join(self.archive_dir, name), ignore_errors=True)
+
+            return len(kept['timestamp'])
+
+
+    def code(self, column, value):
+        """Get the code of a country or user type, adding new values"""
+        index = self.code_index[column]
+        if value not in index:
+            index[value] = len(index)
+            self.manifest['codes'][column].append(value)
+        return index[value]
+
+
+    def append(self, date, user_data, footprint_data):
+        """Add the footprint of a report"""
+        categories = footprint_data.get('categories', {})
+        per_capita = footprint_data.get('per_capita')
+
+        with self.lock:
+            self.buffer['timestamp'].append(_timestamp(date))
+            for column in CODE_COLUMNS:
+                self.buffer[column].append(user_data.get(column) or '')
+            self.buffer['total'].append(footprint_data.get('total', 0))
+            self.buffer['per_capita'].append(np.nan if per_capita is None else per_capita)
+            for category in self.manifest['categories']:
+                category_data = categories.get(category)
+                self.buffer[category].append(category_data.get('total', 0) if isinstance(category_data, dict) else 0)
+
+            if len(self.buffer['timestamp']) >= self.segment_size:
+                self.flush()
+
+
+    def flush(self):
+        """Write the buffered rows as a new segment"""
+        with self.lock:
+            if not self.buffer['timestamp']:
+                return
+
+            with self.file_lock():
+                self.refresh(force=True)
+                columns = self.buffer_columns()
+                self.add_segment(columns, level=0)
+                self.buffer = {column: [] for column in self.columns()}
+
+                self.compact()
+
+
+    def buffer_columns(self):
+        """Get the buffered rows as typed arrays, coding their countries and user types"""
+        columns = {'timestamp': np.array(self.buffer['timestamp'], dtype='datetime64[s]')}
+        for column, dtype in CODE_COLUMNS.items():
+            columns[column] = np.array([self.code(column, value) for value in self.buffer[column]], dtype=dtype)
+        for column in VALUE_COLUMNS + self.manifest['categories']:
+            columns[column] = np.array(self.buffer[column], dtype=np.float64)
+        return columns
+
+
+    def add_segment(self, columns, level, replaces=()):
+        """Write a segment and record it in the manifest in place of merged segments"""
+        name = f"segment_{self.manifest['next_segment']:06d}"
+        self.manifest['next_segment'] += 1
+
+        # Writing into a temporary directory first, so a segment is never seen half written
+        path = os.path.join(self.archive_dir, name)
+        os.makedirs(path + '.tmp')
+        for column, values in columns.items():
+            np.save(os.path.join(path + '.tmp', f"{column}.npy"), values)
+        os.rename(path + '.tmp', path)
+
+        segments = [segment for segment in self.manifest['segments'] if segment['name'] not in replaces]
+        segments.append({'name': name, 'rows': len(columns['timestamp']), 'level': level})
+        self.manifest['segments'] = segments
+        self.write_manifest()
+
+        # Removing merged segments only once the manifest no longer lists them
+        for replaced in replaces:
+            self.segments.pop(replaced, None)
+            shutil.rmtree(os.path.join(self.archive_dir, replaced), ignore_errors=True)
+
+
+    def compact(self, full=False):
+        """Merge segments, fanout segments of a level at a time or all of them when full"""
+        with self.lock, self.file_lock():
+            self.refresh()
+            while True:
+                segments = self.manifest['segments']
+                if full:
+                    group = segments if len(segments) > 1 else []
+                    level = max((segment['level'] for segment in segments), default=0) + 1
+                else:
+                    levels = {}
+                    for segment in segments:
+                        levels.setdefault(segment['level'], []).append(segment)
+                    group, level = next(((group, level + 1) for level, group in sorted(levels.items())
+                                         if len(group) >= self.fanout), ([], 0))
+
+                if not group:
+                    return
+
+                merged = {column: np.concatenate([self.segment(segment['name'])[column] for segment in group])
+                          for column in self.columns()}
+                self.add_segment(merged, level, replaces={segment['name'] for segment in group})
+                if full:
+                    return
+
+
+    def segment(self, name):
+        """Get the memory-mapped columns of a segment"""
+        columns = self.segments.get(name)
+        if columns is None:
+            path = os.path.join(self.archive_dir, name)
+            columns = {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode='r')
+                       for column in self.columns()}
+            self.segments[name] = columns
+        return columns
+
+
+    def scan(self):
+        """Yield the columns of every segment and of the buffered rows"""
+        with self.lock, self.file_lock(exclusive=False):
+            self.refresh()
+            names = [segment['name'] for segment in self.manifest['segments']]
+            parts = [self.segment(name) for name in names]
+            if self.buffer['timestamp']:
+                parts.append(self.buffer_columns())
+
+        for columns in parts:
+            yield columns
+
+
+    def aggregate(self, value='total', by=None, statistic='mean', year=None, start=None, end=None,
+                  country=None, user_type=None):
+        """Aggregate a footprint column over the archive
+
+        value is 'total', 'per_capita' or a category, by is None or one of
+        'country', 'user_type' and 'year', and statistic is 'mean', 'sum' or
+        'count'. Rows can be limited to a year, a [start, end) date range, a
+        country and a user type. Returns one value, or a dict of values by
+        group. For example the mean energy footprint by country in 2025:
+
+            archive.aggregate('energy', by='country', year=2025)
+        """
+        if value not in VALUE_COLUMNS + self.manifest['categories']:
+            raise ValueError(f"Unknown column: {value}")
+        if by is not None and by not in GROUP_COLUMNS:
+            raise ValueError(f"Cannot group by: {by}")
+        if statistic not in STATISTICS:
+            raise ValueError(f"Unknown statistic: {statistic}")
+
+        if year is not None:
+            start, end = f"{int(year):04d}-01-01", f"{int(year) + 1:04d}-01-01"
+        start = np.datetime64(start, 's') if start is not None else None
+        end = np.datetime64(end, 's') if end is not None else None
+
+        # Reading under a shared lock, so codes and segments match while aggregating
+        with self.lock, self.file_lock(exclusive=False):
+            # Scanning first, which also codes the countries and user types of buffered rows
+            parts = list(self.scan())
+
+            # Filters on unknown values match nothing
+            filters = {}
+            for column, filter_value in (('country', country), ('user_type', user_type)):
+                if filter_value is not None:
+                    filters[column] = self.code_index[column].get(filter_value, -1)
+
+            sums = np.zeros(0)
+            counts = np.zeros(0)
+
+            for columns in parts:
+                values = columns[value]
+                mask = ~np.isnan(values)
+                if start is not None:
+                    mask &= columns['timestamp'] >= start
+                if end is not None:
+                    mask &= columns['timestamp'] < end
+                for column, code in filters.items():
+                    mask &= columns[column] == code
+
+                if by == 'year':
+                    # Rows without a valid date have no year
+                    mask &= ~np.isnat(columns['timestamp'])
+                    keys = columns['timestamp'][mask].astype('datetime64[Y]').astype(np.intp) + 1970
+                elif by is not None:
+                    keys = columns[by][mask].astype(np.intp)
+                else:
+                    keys = np.zeros(np.count_nonzero(mask), dtype=np.intp)
+
+                sums = _add(sums, np.bincount(keys, weights=values[mask]))
+                counts = _add(counts, np.bincount(keys))
+
+            if statistic == 'sum':
+                results = sums
+            elif statistic == 'count':
+                results = counts.astype(np.int64)
+            else:
+                results = np.divide(sums, counts, out=np.full(len(sums), np.nan), where=counts > 0)
+
+            if by is None:
+                return results[0].item() if len(results) else (0 if statistic != 'mean' else float('nan'))
+
+            labels = self.manifest['codes'][by] if by in CODE_COLUMNS else range(len(results))
+            return {labels[key]: results[key].item() for key in np.flatnonzero(counts)}
+
+
+def _timestamp(date):
+    """Convert a report date to a timestamp, NaT if it can't be parsed"""
+    try:
+        return np.datetime64(str(date).replace(' ', 'T'), 's')
+    except ValueError:
+        return np.datetime64('NaT', 's')
+
+
+def _add(totals, partial):
+    """Add per-group partial results of different lengths"""
+    if len(partial) > len(totals):
+        totals, partial = partial.astype(np.float64), totals
+    totals[:len(partial)] += partial
+    return totals
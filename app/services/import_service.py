@@ -0,0 +1,188 @@
+"""
+Carbon Footprint Monitor - Import Service
+Streams CSV or JSONL profile files and scores them across processes
+"""
+
+import csv
+import datetime
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from app.models.carbon_calculator import CarbonCalculator, TEXT_COLUMNS
+from app.models.factor_registry import FactorRegistry
+from app.models.footprint_result import FootprintResult
+
+
+# Fields kept as text, everything else is numeric
+TEXT_FIELDS = ['country', 'date', 'name', 'org_name', 'contact_person', 'industry'] + TEXT_COLUMNS
+TEXT_PREFIXES = ('products.currency.',)
+
+# Numeric fields holding whole numbers
+INTEGER_FIELDS = ['employees', 'household_size',
+                  'transportation.air_travel.short_flights', 'transportation.air_travel.long_flights']
+
+# Yes/no fields
+BOOLEAN_FIELDS = ['waste.composting']
+
+# Calculator of a worker process, created on first use
+_calculator = None
+
+
+def read_rows(path, file_format=None):
+    """Stream (line number, row) pairs from a CSV or JSONL file"""
+    if file_format is None:
+        file_format = 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.json', '.ndjson') else 'csv'
+
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_number, line
+
+
+def row_to_user_data(row):
+    """Map a flat row with dotted column names onto the nested user_data shape"""
+    if isinstance(row, str):
+        row = json.loads(row)
+
+    flat = {}
+    _flatten_row(flat, '', row)
+
+    user_data = {}
+    for column, value in flat.items():
+        if value is None or (isinstance(value, str) and not value.strip()):
+            continue
+
+        try:
+            value = _convert(column, value)
+        except (ValueError, TypeError):
+            raise ValueError(f"Invalid value {value!r} for column '{column}'")
+
+        # Creating the nested dicts along the dotted path
+        target = user_data
+        parts = column.split('.')
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+            if not isinstance(target, dict):
+                raise ValueError(f"Column '{column}' conflicts with another column")
+        target[parts[-1]] = value
+
+    user_data.setdefault('date', datetime.datetime.now().strftime('%Y-%m-%d'))
+    return user_data
+
+
+def score_chunk(chunk):
+    """Score a chunk of (line number, row) pairs in a worker process"""
+    global _calculator
+    if _calculator is None:
+        _calculator = CarbonCalculator(registry=FactorRegistry())
+
+    scored = []
+    for line_number, row in chunk:
+        try:
+            user_data = row_to_user_data(row)
+            footprint_data = _calculator.calculate_footprint(user_data)
+            error = footprint_data.get('error') or next(
+                (category['error'] for category in footprint_data['categories'].values() if 'error' in category), None)
+            scored.append((line_number, user_data, FootprintResult.from_dict(footprint_data), error))
+        except Exception as e:
+            scored.append((line_number, None, None, str(e)))
+
+    return scored
+
+
+class ImportService:
+    """Service for bulk importing profile files"""
+
+    def __init__(self, data_service=None, workers=None, chunk_size=500):
+        """Initializing the import service"""
+        self.data_service = data_service
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+    def import_file(self, path, file_format=None, save=True, on_error=None):
+        """Score every row of a file, saving results through the data service
+
+        Rows are read lazily and only a few chunks per worker are in flight,
+        so memory stays constant whatever the file size. on_error is called
+        with the line number and message of every row that fails.
+        """
+        summary = {'rows': 0, 'saved': 0, 'duplicates': 0, 'failed': 0, 'total_footprint': 0.0}
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+
+            for chunk in self.read_chunks(path, file_format):
+                pending.append(executor.submit(score_chunk, chunk))
+
+                # Waiting for the oldest chunk once enough are in flight
+                if len(pending) >= self.workers * 2:
+                    self.store_scored(pending.popleft().result(), summary, save, on_error)
+
+            while pending:
+                self.store_scored(pending.popleft().result(), summary, save, on_error)
+
+        # Waiting for reports still queued for writing
+        if save and self.data_service is not None:
+            self.data_service.flush()
+
+        return summary
+
+    def read_chunks(self, path, file_format=None):
+        """Group the rows of a file into chunks"""
+        chunk = []
+        for line_number, row in read_rows(path, file_format):
+            chunk.append((line_number, row))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+    def store_scored(self, scored, summary, save, on_error):
+        """Save the scored rows of a chunk and update the summary"""
+        for line_number, user_data, footprint_data, error in scored:
+            summary['rows'] += 1
+
+            if error:
+                summary['failed'] += 1
+                if on_error:
+                    on_error(line_number, error)
+                continue
+
+            # Rows repeating a saved report are counted, not saved again
+            if save and self.data_service is not None:
+                created = self.data_service.add_report(user_data, footprint_data)[1]
+                summary['saved' if created else 'duplicates'] += 1
+
+            summary['total_footprint'] += footprint_data.total
+
+
+def _flatten_row(flat, prefix, row):
+    """Flatten nested JSON rows into dotted column names"""
+    for key, value in row.items():
+        column = f'{prefix}{str(key).strip()}'
+        if isinstance(value, dict):
+            _flatten_row(flat, column + '.', value)
+        else:
+            flat[column] = value
+
+
+def _convert(column, value):
+    """Convert a raw value to the type used by the calculator"""
+    if column in TEXT_FIELDS or column.startswith(TEXT_PREFIXES):
+        return str(value).strip()
+    if column in BOOLEAN_FIELDS:
+        if isinstance(value, bool):
+            return value
+        return str(value).strip().lower() in ('yes', 'true', '1', 'y')
+    if column in INTEGER_FIELDS:
+        return int(float(value))
+    return float(value)
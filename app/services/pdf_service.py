@@ -12,12 +12,16 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, Tabl
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 
+from app.models.reduction_optimizer import ReductionOptimizer, ACTION_DESCRIPTIONS
+
 class PDFService:
     """Service for generating PDF reports"""
 
     def __init__(self):
         """Initialize PDF service"""
         self.static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static')
+        self.reduction_optimizer = ReductionOptimizer()
+        self.effort_budget = 8  # Effort points for the recommended action plan
 
     def generate_report_pdf(self, user_data, footprint_data, charts=None):
         """Generate PDF report for the footprint data"""
@@ -90,6 +94,13 @@ class PDFService:
         if 'per_capita' in footprint_data:
             elements.append(Paragraph(f"Per Capita Annual Carbon Footprint: {footprint_data.get('per_capita', 0):.2f} kg CO2e", normal_style))
 
+        # Uncertainty range if available
+        uncertainty = footprint_data.get('uncertainty', {})
+        if 'total' in uncertainty:
+            band = uncertainty['total']
+            elements.append(Paragraph(f"90% Range: {band['p5']:.0f} - {band['p95']:.0f} kg CO2e "
+                                      f"(median {band['p50']:.0f} kg CO2e)", normal_style))
+
         # Global context
         global_average = 5000       # Example value
         sustainable_level = 2000    # Example value
@@ -115,19 +126,27 @@ class PDFService:
         if categories:
             # Prepare data for category
             category_data = [["Category", "Emissions (kg CO2e)", "Percentage"]]
+            category_bands = uncertainty.get('categories', {})
+            if category_bands:
+                category_data[0].append("90% Range")
 
             for category, data in categories.items():
                 if isinstance(data, dict) and 'total' in data:
                     category_total = data.get('total', 0)
                     percentage = (category_total / footprint_data.get('total', 1)) * 100
-                    category_data.append([
+                    row = [
                         category.capitalize(),
                         f"{category_total:.2f}",
                         f"{percentage:.1f}"
-                    ])
+                    ]
+                    if category_bands:
+                        band = category_bands.get(category)
+                        row.append(f"{band['p5']:.0f} - {band['p95']:.0f}" if band else "N/A")
+                    category_data.append(row)
 
             # Creating category table
-            category_table = Table(category_data, colWidths=[2*inch, 2*inch, 1.5*inch])
+            col_widths = [1.5*inch, 1.5*inch, 1*inch, 1.5*inch] if category_bands else [2*inch, 2*inch, 1.5*inch]
+            category_table = Table(category_data, colWidths=col_widths)
             category_table.setStyle(TableStyle([
                 ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
                 ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
@@ -178,7 +197,7 @@ class PDFService:
         elements.append(Paragraph("Recommendations", section_style))
 
         # Add generic recommendations based on the footprint data
-        recommendations = self.generate_recommendations(footprint_data)
+        recommendations = self.generate_recommendations(footprint_data, user_data)
 
         for i, recommendation in enumerate(recommendations, 1):
             elements.append(Paragraph(f"{i}. {recommendation}", normal_style))
@@ -200,7 +219,7 @@ class PDFService:
         return pdf
 
     # Method for generating recommendations
-    def generate_recommendations(self, footprint_data):
+    def generate_recommendations(self, footprint_data, user_data=None):
         """Generate recommendations based on footprint data"""
         recommendations = []
 
@@ -217,6 +236,17 @@ class PDFService:
         recommendations.append("Track your carbon footprint regularly to monitor your progress.")
         recommendations.append("Consider carbon offsetting for emissions you cannot eliminate.")
 
+        # Best portfolio of reduction actions within the effort budget
+        portfolios = self.reduction_optimizer.optimize(footprint_data, top_n=1, budget=self.effort_budget,
+                                                      user_data=user_data)
+        if portfolios:
+            best = portfolios[0]
+            for action in best['actions']:
+                recommendations.append(ACTION_DESCRIPTIONS.get(action, action.replace('_', ' ').capitalize()))
+            recommendations.append(f"Together these actions could save about {best['savings']:.0f} kg CO2e "
+                                   f"per year ({best['reduction_percentage']:.1f}% of your footprint).")
+            return recommendations
+
         # Category-specific recommendations
         if highest_category_name == 'transportation':
             recommendations.append("Consider using public transportation instead of a car for regular commutes.")
@@ -0,0 +1,158 @@
+"""
+Ranking Service:
+    Percentile of a footprint among countries and among stored reports
+"""
+
+
+import threading
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from app.models.footprint_result import FootprintResult
+
+
+def footprint_value(footprint_data, user_type=None):
+    """Get the footprint a report is ranked by, per capita where it applies, in kg CO2e
+
+    Individuals without a household size are ranked by their total, as one
+    person. Organizations without an employee count have no per capita
+    footprint to compare, and get None.
+    """
+    if isinstance(footprint_data, FootprintResult):
+        per_capita, total = footprint_data.per_capita, footprint_data.total
+    else:
+        per_capita, total = footprint_data.get('per_capita'), footprint_data.get('total', 0)
+
+    # NaN marks a missing per capita value in the archive
+    if per_capita is not None and per_capita == per_capita:
+        return per_capita
+    if user_type == 'Organization':
+        return None
+    return total
+
+
+def midrank_percentile(below, equal, count):
+    """Get the percentage of values below a value, counting equal values half"""
+    return 100.0 * (below + equal / 2) / count
+
+
+class FenwickTree:
+    """Binary indexed tree of counts, with O(log n) updates and prefix sums"""
+
+    def __init__(self, size):
+        """Initializing an empty tree of size counts"""
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+
+    def build(self, counts):
+        """Replace the tree with the given counts in O(n)"""
+        tree = [0] + [int(count) for count in counts]
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] += tree[i]
+        self.tree = tree
+
+
+    def add(self, position, delta=1):
+        """Add delta to the count at position"""
+        i = position + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+
+    def prefix(self, position):
+        """Sum the counts before position"""
+        total = 0
+        i = position
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+
+class ReportRanking:
+    """Counts of stored report footprints in fixed-width buckets, kept in a Fenwick tree
+
+    Adding a report and ranking a footprint both take O(log buckets), and
+    ranks are exact up to the bucket width.
+    """
+
+    def __init__(self, bucket_size=10, max_value=200000):
+        """Initializing an empty ranking, footprints above max_value share the last bucket"""
+        self.bucket_size = bucket_size
+        self.buckets = int(max_value // bucket_size) + 1
+        self.tree = FenwickTree(self.buckets)
+        self.count = 0
+        self.lock = threading.Lock()
+
+
+    def bucket(self, value):
+        """Get the bucket of a footprint"""
+        return min(max(int(value // self.bucket_size), 0), self.buckets - 1)
+
+
+    def add(self, value):
+        """Count a saved report's footprint"""
+        with self.lock:
+            self.tree.add(self.bucket(value))
+            self.count += 1
+
+
+    def load(self, values):
+        """Replace the counts with an array of footprints"""
+        values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+        buckets = np.clip(values // self.bucket_size, 0, self.buckets - 1).astype(np.intp)
+
+        with self.lock:
+            self.tree.build(np.bincount(buckets, minlength=self.buckets))
+            self.count = len(values)
+
+
+    def percentile(self, value):
+        """Get the percentage of reports with a lower footprint, None without reports"""
+        with self.lock:
+            if not self.count:
+                return None
+            bucket = self.bucket(value)
+            below = self.tree.prefix(bucket)
+            return midrank_percentile(below, self.tree.prefix(bucket + 1) - below, self.count)
+
+
+class RankingService:
+    """Service ranking footprints among OWID countries and stored reports"""
+
+    def __init__(self, benchmark_service, data_service):
+        """Initializing the service"""
+        self.benchmark_service = benchmark_service
+        self.data_service = data_service
+
+
+    def rank(self, footprint_data, user_type=None):
+        """Get the percentile of a footprint among countries and among stored reports
+
+        The country percentile compares the per capita footprint with the
+        latest per capita emissions of every country in the OWID data. A
+        percentile is None when there is nothing to compare with, as for an
+        organization without an employee count.
+        """
+        value = footprint_value(footprint_data, user_type)
+
+        countries = self.benchmark_service.get_distribution() if value is not None else []
+        country_percentile = None
+        if countries:
+            # OWID values are tonnes per person
+            tonnes = value / 1000
+            below = bisect_left(countries, tonnes)
+            country_percentile = midrank_percentile(below, bisect_right(countries, tonnes) - below, len(countries))
+
+        return {
+            'value': value,
+            'countries': country_percentile,
+            'country_count': len(countries),
+            'reports': self.data_service.get_report_percentile(value) if value is not None else None,
+            'report_count': self.data_service.ranking.count,
+        }
@@ -0,0 +1,178 @@
+"""
+Report Bundles:
+    Compressed per-month bundles of archived reports
+"""
+
+
+import os
+import json
+import zlib
+import threading
+
+
+class ReportBundles:
+    """Per-month bundle files of individually compressed reports
+
+    A month's bundle holds the compressed reports one after the other, and
+    'YYYY-MM.index' names the bundle file and maps each filename to its
+    offset and length, so a single report is read with one seek. Bundles
+    are only appended to, except when reports are discarded and the bundle
+    is rewritten without them under a new name.
+    """
+
+    def __init__(self, bundles_dir):
+        """Initializing the bundles directory"""
+        self.bundles_dir = bundles_dir
+        self.lock = threading.Lock()
+
+        # (index file version, bundle filename, index) of the bundles read so far
+        self.indexes = {}
+
+        if not os.path.exists(self.bundles_dir):
+            os.makedirs(self.bundles_dir)
+
+
+    def months(self):
+        """Get the months that have a bundle, oldest first"""
+        return sorted(filename[:-len('.index')] for filename in os.listdir(self.bundles_dir)
+                      if filename.endswith('.index'))
+
+
+    def read_index(self, month):
+        """Get the bundle filename and index of a month, read again whenever the index file changed"""
+        filepath = os.path.join(self.bundles_dir, f"{month}.index")
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            self.indexes.pop(month, None)
+            return f"{month}.bundle", {}
+
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self.indexes.get(month)
+        if cached is None or cached[0] != version:
+            with open(filepath, 'r') as f:
+                data = json.load(f)
+
+            # Indexes written before bundles were renamed on rewrite are plain mappings
+            if isinstance(data.get('reports'), dict):
+                cached = (version, data['bundle'], data['reports'])
+            else:
+                cached = (version, f"{month}.bundle", data)
+            self.indexes[month] = cached
+
+        return cached[1], cached[2]
+
+
+    def get_index(self, month):
+        """Get the index of a month's bundle"""
+        return self.read_index(month)[1]
+
+
+    def write_index(self, month, bundle, index):
+        """Replace a month's index atomically, once it is on disk"""
+        index_path = os.path.join(self.bundles_dir, f"{month}.index")
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump({'bundle': bundle, 'reports': index}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(index_path + '.tmp', index_path)
+
+
+    def add(self, month, reports):
+        """Append (filename, report_data) reports to a month's bundle"""
+        with self.lock:
+            bundle, index = self.read_index(month)
+            index = dict(index)
+            bundle_path = os.path.join(self.bundles_dir, bundle)
+
+            with open(bundle_path, 'ab') as f:
+                offset = f.tell()
+                for filename, report_data in reports:
+                    entry = zlib.compress(json.dumps(report_data, separators=(',', ':')).encode('utf-8'), 9)
+                    f.write(entry)
+                    index[filename] = [offset, len(entry)]
+                    offset += len(entry)
+                f.flush()
+                os.fsync(f.fileno())
+
+            # The index only lists entries once their data is on disk
+            self.write_index(month, bundle, index)
+
+
+    def get(self, month, filename):
+        """Read one report from a month's bundle, None if it isn't there"""
+        for attempt in range(2):
+            bundle, index = self.read_index(month)
+            location = index.get(filename)
+            if location is None:
+                return None
+
+            offset, length = location
+            try:
+                with open(os.path.join(self.bundles_dir, bundle), 'rb') as f:
+                    f.seek(offset)
+                    return json.loads(zlib.decompress(f.read(length)))
+            except FileNotFoundError:
+                # The bundle was rewritten since its index was read
+                if attempt:
+                    raise
+
+
+    def reports(self, month):
+        """Yield (filename, report_data) of every report in a month's bundle"""
+        for filename in list(self.get_index(month)):
+            yield filename, self.get(month, filename)
+
+
+    def size(self, month, filename):
+        """Get the compressed size of a report in a month's bundle, 0 if it isn't there"""
+        location = self.get_index(month).get(filename)
+        return location[1] if location else 0
+
+
+    def discard(self, month, filenames):
+        """Rewrite a month's bundle without some of its reports, returning the bytes freed
+
+        The rewritten bundle is written under a new name, the index is then
+        replaced by one naming it, and only then is the old bundle removed,
+        so the index always names a bundle holding its reports.
+        """
+        with self.lock:
+            bundle, index = self.read_index(month)
+            discarded = {filename for filename in filenames if filename in index}
+            if not discarded:
+                return 0
+
+            generation = int(bundle.split('.')[1]) + 1 if bundle.count('.') == 2 else 1
+            new_bundle = f"{month}.{generation}.bundle"
+
+            kept = {}
+            freed = sum(index[filename][1] for filename in discarded)
+            with open(os.path.join(self.bundles_dir, bundle), 'rb') as source, \
+                    open(os.path.join(self.bundles_dir, new_bundle), 'wb') as f:
+                offset = 0
+                for filename, (start, length) in sorted(index.items(), key=lambda item: item[1][0]):
+                    if filename in discarded:
+                        continue
+                    source.seek(start)
+                    f.write(source.read(length))
+                    kept[filename] = [offset, length]
+                    offset += length
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.write_index(month, new_bundle, kept)
+            os.remove(os.path.join(self.bundles_dir, bundle))
+
+            return freed
+
+
+    def remove(self, month):
+        """Delete a month's bundle"""
+        with self.lock:
+            bundle = self.read_index(month)[0]
+            self.indexes.pop(month, None)
+            for filename in (f"{month}.index", bundle):
+                filepath = os.path.join(self.bundles_dir, filename)
+                if os.path.exists(filepath):
+                    os.remove(filepath)
@@ -0,0 +1,239 @@
+"""
+Report Index:
+    In-memory faceted search index over stored reports
+"""
+
+
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from app.models.carbon_calculator import CATEGORIES
+from app.services.country_index import COUNTRY_INDEX
+
+
+# Facets and their path in the report's user_data
+FACETS = {
+    'country': ('country',),
+    'user_type': ('user_type',),
+    'industry': ('industry',),
+    'diet': ('food', 'diet_type'),
+    'fuel': ('transportation', 'car', 'fuel_type'),
+}
+
+# Numeric fields with sorted indexes, the total and every category total
+NUMERIC_FIELDS = ['total'] + CATEGORIES
+
+
+def facet_value(facet, value):
+    """Get the indexed form of a facet value, countries by their canonical name"""
+    if facet == 'country':
+        return COUNTRY_INDEX.key(value)
+    return str(value)
+
+
+def report_facets(report_data):
+    """Get the facet values and numeric fields of a report"""
+    user_data = report_data.get('user_data', {})
+    footprint_data = report_data.get('footprint_data', {})
+
+    facets = {}
+    for facet, path in FACETS.items():
+        value = user_data
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value not in (None, ''):
+            facets[facet] = facet_value(facet, value)
+
+    facets['total'] = footprint_data.get('total', 0)
+    for category in CATEGORIES:
+        values = footprint_data.get('categories', {}).get(category)
+        facets[category] = values.get('total', 0) if isinstance(values, dict) else 0
+
+    return facets
+
+
+class ReportIndex:
+    """Inverted index of report facets with sorted numeric indexes
+
+    Every report gets a document id in the order it is added. Facet values
+    map to posting lists of ids, kept sorted by appending, and every
+    numeric field and the date have a sorted list of values with the ids
+    next to them. Queries intersect the posting lists and id ranges,
+    smallest first.
+    """
+
+    def __init__(self):
+        """Initializing an empty index"""
+        self.lock = threading.RLock()
+        self.clear()
+
+
+    def clear(self):
+        """Remove every report from the index"""
+        with self.lock:
+            self.filenames = []
+            self.dates = []
+            self.ids = {}
+            self.deleted = set()
+
+            # facet -> value -> posting list of ids
+            self.postings = {facet: {} for facet in FACETS}
+
+            # field -> (sorted values, ids in the same order)
+            self.sorted = {field: ([], array('q')) for field in NUMERIC_FIELDS + ['date']}
+
+
+    def __len__(self):
+        """Count the indexed reports"""
+        return len(self.ids)
+
+
+    def add(self, filename, date, facets):
+        """Index a report"""
+        with self.lock:
+            doc_id, date = self.assign(filename, date, facets)
+
+            for field in NUMERIC_FIELDS + ['date']:
+                value = date if field == 'date' else facets.get(field, 0)
+                values, ids = self.sorted[field]
+                position = bisect_right(values, value)
+                values.insert(position, value)
+                ids.insert(position, doc_id)
+
+
+    def load(self, reports):
+        """Index many (filename, date, facets) reports, sorting the numeric indexes once"""
+        reports = list(reports)
+
+        with self.lock:
+            # Inserting a few reports costs less than sorting everything again
+            if len(reports) * 64 < len(self.filenames):
+                for filename, date, facets in reports:
+                    self.add(filename, date, facets)
+                return
+
+            added = {field: [] for field in self.sorted}
+
+            for filename, date, facets in reports:
+                doc_id, date = self.assign(filename, date, facets)
+                for field in NUMERIC_FIELDS:
+                    added[field].append((facets.get(field, 0), doc_id))
+                added['date'].append((date, doc_id))
+
+            for field, pairs in added.items():
+                values, ids = self.sorted[field]
+                all_values = np.array(values + [value for value, doc_id in pairs])
+                all_ids = np.concatenate([np.frombuffer(ids, dtype=np.int64),
+                                          np.array([doc_id for value, doc_id in pairs], dtype=np.int64)])
+
+                order = np.argsort(all_values, kind='stable')
+                sorted_ids = array('q')
+                sorted_ids.frombytes(all_ids[order].tobytes())
+                self.sorted[field] = (all_values[order].tolist(), sorted_ids)
+
+
+    def assign(self, filename, date, facets):
+        """Give a report its document id and add it to the facet posting lists"""
+        if filename in self.ids:
+            self.remove(filename)
+
+        date = str(date)
+        doc_id = len(self.filenames)
+        self.filenames.append(filename)
+        self.dates.append(date)
+        self.ids[filename] = doc_id
+
+        for facet in FACETS:
+            value = facets.get(facet)
+            if value is not None:
+                self.postings[facet].setdefault(value, array('q')).append(doc_id)
+
+        return doc_id, date
+
+
+    def remove(self, filename):
+        """Remove a report from query results"""
+        with self.lock:
+            doc_id = self.ids.pop(filename, None)
+            if doc_id is not None:
+                self.deleted.add(doc_id)
+
+
+    def facet_values(self, facet):
+        """Get the values of a facet with their number of reports"""
+        with self.lock:
+            return {value: len(posting) - sum(1 for doc_id in posting if doc_id in self.deleted)
+                    for value, posting in self.postings[facet].items()}
+
+
+    def query(self, facets=None, ranges=None, start=None, end=None, limit=None):
+        """Get the filenames of the matching reports, newest first
+
+        facets maps facet names to a value or a list of accepted values
+        (countries in any spelling the country index resolves),
+        ranges maps numeric fields to (minimum, maximum) pairs where either
+        bound may be None, and start and end limit the report dates to
+        [start, end).
+        """
+        with self.lock:
+            candidates = []
+
+            for facet, accepted in (facets or {}).items():
+                if facet not in FACETS:
+                    raise ValueError(f"Unknown facet: {facet}")
+                if isinstance(accepted, str):
+                    accepted = [accepted]
+                accepted = [facet_value(facet, value) for value in accepted]
+
+                postings = [np.frombuffer(self.postings[facet][value], dtype=np.int64)
+                            for value in accepted if value in self.postings[facet]]
+                if not postings:
+                    return []
+
+                # Copies, so the posting lists stay free to grow. A report has one
+                # value per facet, so the lists of different values never overlap
+                candidates.append(postings[0].copy() if len(postings) == 1 else np.sort(np.concatenate(postings)))
+                del postings
+
+            bounds = dict(ranges or {})
+            if start is not None or end is not None:
+                bounds['date'] = (start, end)
+
+            for field, (minimum, maximum) in bounds.items():
+                if field not in self.sorted:
+                    raise ValueError(f"Unknown numeric field: {field}")
+                values, ids = self.sorted[field]
+
+                first = bisect_left(values, minimum) if minimum is not None else 0
+                if field == 'date':
+                    last = bisect_left(values, maximum) if maximum is not None else len(values)
+                else:
+                    last = bisect_right(values, maximum) if maximum is not None else len(values)
+                candidates.append(np.sort(np.frombuffer(ids, dtype=np.int64)[first:last]))
+
+            if candidates:
+                candidates.sort(key=len)
+                result = candidates[0]
+                for ids in candidates[1:]:
+                    if not len(result):
+                        break
+                    result = np.intersect1d(result, ids, assume_unique=True)
+                matches = result.tolist()
+            else:
+                matches = range(len(self.filenames))
+
+            matches = [doc_id for doc_id in matches if doc_id not in self.deleted]
+
+            def key(doc_id):
+                return self.dates[doc_id], self.filenames[doc_id]
+
+            if limit is not None:
+                matches = heapq.nlargest(limit, matches, key=key)
+            else:
+                matches.sort(key=key, reverse=True)
+
+            return [self.filenames[doc_id] for doc_id in matches]
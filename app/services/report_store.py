@@ -0,0 +1,473 @@
+"""
+Report Store:
+    Indexed SQLite storage of report metadata and payloads
+"""
+
+
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+import zlib
+
+from app.services.report_index import facet_value, report_facets
+
+
+# Columns the listing can be filtered on
+FILTER_COLUMNS = ('user_type', 'country', 'name')
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    filename TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    name TEXT,
+    user_type TEXT,
+    country TEXT,
+    total REAL,
+    payload TEXT NOT NULL,
+    content_hash TEXT,
+    bundle TEXT,
+    facets TEXT
+);
+CREATE TABLE IF NOT EXISTS report_rollups (
+    month TEXT NOT NULL,
+    country TEXT NOT NULL,
+    user_type TEXT NOT NULL,
+    reports INTEGER NOT NULL,
+    total REAL NOT NULL,
+    categories TEXT NOT NULL,
+    PRIMARY KEY (month, country, user_type)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+INDEXES = """
+DROP INDEX IF EXISTS idx_reports_date;
+DROP INDEX IF EXISTS idx_reports_user_type;
+DROP INDEX IF EXISTS idx_reports_country;
+CREATE INDEX IF NOT EXISTS idx_reports_date_filename ON reports (date, filename);
+CREATE INDEX IF NOT EXISTS idx_reports_name ON reports (name);
+CREATE INDEX IF NOT EXISTS idx_reports_user_type_date ON reports (user_type, date, filename);
+CREATE INDEX IF NOT EXISTS idx_reports_country_date ON reports (country, date, filename);
+CREATE INDEX IF NOT EXISTS idx_reports_total ON reports (total);
+CREATE INDEX IF NOT EXISTS idx_reports_content_hash ON reports (content_hash);
+"""
+
+
+def create_schema(conn):
+    """Create the tables and indexes, upgrading stores created before schema versions were recorded"""
+    _execute_script(conn, SCHEMA)
+
+    # Adding the columns missing from stores created by earlier versions
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(reports)')]
+    for column in ('content_hash', 'bundle', 'facets'):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE reports ADD COLUMN {column} TEXT')
+
+    # Replacing the single-column indexes of earlier versions
+    _execute_script(conn, INDEXES)
+
+
+def canonicalize_countries(conn):
+    """Store the country facets of earlier reports by their canonical name"""
+    updates = []
+    for row in conn.execute('SELECT filename, facets FROM reports WHERE facets IS NOT NULL'):
+        facets = json.loads(row['facets'])
+        if 'country' in facets:
+            facets['country'] = facet_value('country', facets['country'])
+            updates.append((json.dumps(facets), row['filename']))
+    conn.executemany('UPDATE reports SET facets = ? WHERE filename = ?', updates)
+
+
+# Schema changes in order. Each runs once, and PRAGMA user_version records how many ran
+MIGRATIONS = [create_schema, canonicalize_countries]
+
+
+def content_hash(user_data, footprint_data):
+    """Get the SHA-256 of the canonical JSON of a report's inputs and results"""
+    canonical = json.dumps({'user_data': user_data, 'footprint_data': footprint_data},
+                           sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _execute_script(conn, script):
+    """Run the statements of a script in the current transaction, unlike executescript()"""
+    for statement in script.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+
+
+class ReportStore:
+    """SQLite backend holding indexed report metadata next to the full payload"""
+
+    def __init__(self, db_path):
+        """Initializing the store and creating its schema"""
+        self.db_path = db_path
+        self.local = threading.local()
+
+        self.migrate()
+
+
+    def migrate(self):
+        """Apply the schema changes the database has not had yet"""
+        conn = self.connection()
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= len(MIGRATIONS):
+            return
+
+        # Holding the write lock, so processes starting together migrate once
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+    def connection(self):
+        """Get the connection of the current thread"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+
+    def add_report(self, filename, report_data, name):
+        """Insert or replace a report"""
+        self.add_reports([(filename, report_data, name)])
+
+
+    def add_reports(self, reports):
+        """Insert or replace (filename, report_data, name) reports in one transaction"""
+        with self.connection() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO reports (filename, date, name, user_type, country, total, payload, content_hash, facets) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [self.report_row(filename, report_data, name) for filename, report_data, name in reports]
+            )
+
+
+    def report_row(self, filename, report_data, name):
+        """Get the column values of a report"""
+        user_data = report_data.get('user_data', {})
+        footprint_data = report_data.get('footprint_data', {})
+
+        return (
+            filename,
+            report_data.get('date', 'Unknown'),
+            name,
+            user_data.get('user_type'),
+            user_data.get('country'),
+            footprint_data.get('total', 0),
+            json.dumps(report_data),
+            content_hash(user_data, footprint_data),
+            json.dumps(report_facets(report_data)),
+        )
+
+
+    def list_reports(self):
+        """Get the metadata of all reports, newest first, without payloads"""
+        rows = self.connection().execute(
+            'SELECT filename, date, name, user_type, country, total FROM reports ORDER BY date DESC, filename DESC'
+        )
+        return [dict(row) for row in rows]
+
+
+    def list_page(self, limit, after=None, before=None, descending=True, filters=None):
+        """Get one page of report metadata by keyset on (date, filename)
+
+        after and before are the (date, filename) keys of the last or first
+        row of the neighbouring page. Returns the rows, in listing order, and
+        whether more rows exist past the page in the direction walked.
+        """
+        conditions = []
+        params = []
+
+        for column, value in (filters or {}).items():
+            if column not in FILTER_COLUMNS or not value:
+                continue
+            if column == 'name':
+                # Names match by prefix
+                escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                conditions.append("name LIKE ? ESCAPE '\\'")
+                params.append(escaped + '%')
+            else:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+
+        # Walking back to the previous page reverses the order
+        backwards = before is not None
+        ascending = descending == backwards
+        key = before if backwards else after
+
+        if key is not None:
+            operator = '>' if ascending else '<'
+            conditions.append(f'(date, filename) {operator} (?, ?)')
+            params.extend(key)
+
+        order = 'ASC' if ascending else 'DESC'
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = self.connection().execute(
+            f'SELECT filename, date, name, user_type, country, total FROM reports {where} '
+            f'ORDER BY date {order}, filename {order} LIMIT ?',
+            params + [limit + 1]
+        ).fetchall()
+
+        has_more = len(rows) > limit
+        rows = [dict(row) for row in rows[:limit]]
+        if backwards:
+            rows.reverse()
+
+        return rows, has_more
+
+
+    def iter_reports(self, before=None):
+        """Yield (filename, report data, bundle) of every report, oldest first
+
+        The report data is None for reports moved into a bundle. before
+        limits the reports to dates before it.
+        """
+        if before is None:
+            rows = self.connection().execute('SELECT filename, payload, bundle FROM reports ORDER BY date, filename')
+        else:
+            rows = self.connection().execute(
+                'SELECT filename, payload, bundle FROM reports WHERE date < ? ORDER BY date, filename', (before,)
+            )
+
+        for row in rows:
+            yield row['filename'], json.loads(row['payload']) if row['payload'] else None, row['bundle']
+
+
+    def get_facets(self, after_rowid=0):
+        """Get the last row id and (filename, date, facets) of the reports stored after a row id"""
+        rows = self.connection().execute(
+            'SELECT rowid, filename, date, facets FROM reports WHERE rowid > ? AND facets IS NOT NULL ORDER BY rowid',
+            (after_rowid,)
+        ).fetchall()
+
+        last_rowid = rows[-1]['rowid'] if rows else after_rowid
+        return last_rowid, [(row['filename'], row['date'], json.loads(row['facets'])) for row in rows]
+
+
+    def missing_facets(self):
+        """Get (filename, report data, bundle) of reports stored before facets were indexed"""
+        rows = self.connection().execute('SELECT filename, payload, bundle FROM reports WHERE facets IS NULL')
+        return [(row['filename'], json.loads(row['payload']) if row['payload'] else None, row['bundle'])
+                for row in rows]
+
+
+    def set_facets(self, facets):
+        """Store the facets of (filename, facets) reports"""
+        with self.connection() as conn:
+            conn.executemany('UPDATE reports SET facets = ? WHERE filename = ?',
+                             [(json.dumps(values), filename) for filename, values in facets])
+
+
+    def get_infos(self, filenames):
+        """Get the listing metadata of reports by filename, in the given order"""
+        rows = {}
+        for start in range(0, len(filenames), 500):
+            chunk = filenames[start:start + 500]
+            for row in self.connection().execute(
+                f"SELECT filename, date, name, user_type, country, total FROM reports "
+                f"WHERE filename IN ({','.join('?' * len(chunk))})", chunk
+            ):
+                rows[row['filename']] = dict(row)
+        return [rows[filename] for filename in filenames if filename in rows]
+
+
+    def get_payload(self, filename):
+        """Get the full report data, None if unknown or moved into a bundle"""
+        row = self.connection().execute('SELECT payload FROM reports WHERE filename = ?', (filename,)).fetchone()
+        return json.loads(row['payload']) if row and row['payload'] else None
+
+
+    def get_bundle(self, filename):
+        """Get the bundle holding a report, None if it isn't bundled"""
+        row = self.connection().execute('SELECT bundle FROM reports WHERE filename = ?', (filename,)).fetchone()
+        return row['bundle'] if row else None
+
+
+    def unbundled_before(self, date):
+        """Get (filename, date, report data) of the reports before a date still held individually"""
+        rows = self.connection().execute(
+            "SELECT filename, date, payload FROM reports WHERE date < ? AND bundle IS NULL AND payload != '' "
+            'ORDER BY date, filename', (date,)
+        )
+        return [(row['filename'], row['date'], json.loads(row['payload'])) for row in rows]
+
+
+    def mark_bundled(self, filenames, bundle):
+        """Record that reports moved into a bundle, dropping their payloads"""
+        with self.connection() as conn:
+            conn.executemany("UPDATE reports SET bundle = ?, payload = '' WHERE filename = ?",
+                             [(bundle, filename) for filename in filenames])
+
+
+    def roll_up(self, rollups, filenames, before):
+        """Replace reports dated before a date by (month, country, user_type, reports, total, categories) aggregates
+
+        Adding the aggregates, deleting the reports and counting them as
+        rolled up happen in one transaction, so the footprint archive,
+        which keeps their rows, can tell them from lost reports.
+        """
+        with self.connection() as conn:
+            for month, country, user_type, reports, total, categories in rollups:
+                row = conn.execute(
+                    'SELECT reports, total, categories FROM report_rollups '
+                    'WHERE month = ? AND country = ? AND user_type = ?', (month, country, user_type)
+                ).fetchone()
+                if row:
+                    reports += row['reports']
+                    total += row['total']
+                    previous = json.loads(row['categories'])
+                    categories = {category: categories.get(category, 0) + previous.get(category, 0)
+                                  for category in set(categories) | set(previous)}
+
+                conn.execute(
+                    'INSERT OR REPLACE INTO report_rollups (month, country, user_type, reports, total, categories) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (month, country, user_type, reports, total, json.dumps(categories))
+                )
+
+            conn.executemany('DELETE FROM reports WHERE filename = ?', [(filename,) for filename in filenames])
+
+            rolled_up = conn.execute("SELECT value FROM meta WHERE key = 'rolled_up_reports'").fetchone()
+            cutoff = conn.execute("SELECT value FROM meta WHERE key = 'rolled_up_before'").fetchone()
+            conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', [
+                ('rolled_up_reports', str(int(rolled_up['value'] if rolled_up else 0) + len(filenames))),
+                ('rolled_up_before', max(before, cutoff['value']) if cutoff else before),
+            ])
+
+
+    def rolled_up(self):
+        """Get the number of reports reduced to aggregates and the date they were dated before, None if none were"""
+        return int(self.get_meta('rolled_up_reports') or 0), self.get_meta('rolled_up_before')
+
+
+    def get_rollups(self):
+        """Get the monthly aggregates of reports removed by retention, oldest first"""
+        rows = self.connection().execute('SELECT * FROM report_rollups ORDER BY month, country, user_type')
+        return [dict(row, categories=json.loads(row['categories'])) for row in rows]
+
+
+    def find_by_hash(self, report_hash):
+        """Get the filename of the oldest report with a content hash, None if there is none"""
+        row = self.connection().execute(
+            'SELECT filename FROM reports WHERE content_hash = ? ORDER BY date, filename LIMIT 1', (report_hash,)
+        ).fetchone()
+        return row['filename'] if row else None
+
+
+    def backfill_hashes(self):
+        """Hash reports stored before reports were content-addressed"""
+        rows = self.connection().execute(
+            "SELECT filename, payload FROM reports WHERE content_hash IS NULL AND payload != ''"
+        ).fetchall()
+
+        updates = []
+        for row in rows:
+            report_data = json.loads(row['payload'])
+            updates.append((content_hash(report_data.get('user_data', {}), report_data.get('footprint_data', {})),
+                            row['filename']))
+
+        with self.connection() as conn:
+            conn.executemany('UPDATE reports SET content_hash = ? WHERE filename = ?', updates)
+
+        return len(updates)
+
+
+    def duplicate_groups(self):
+        """Get the filenames of reports sharing a content hash, oldest first in each group"""
+        rows = self.connection().execute(
+            'SELECT content_hash, filename FROM reports WHERE content_hash IN '
+            '(SELECT content_hash FROM reports GROUP BY content_hash HAVING COUNT(*) > 1) '
+            'ORDER BY content_hash, date, filename'
+        )
+
+        groups = {}
+        for row in rows:
+            groups.setdefault(row['content_hash'], []).append(row['filename'])
+        return list(groups.values())
+
+
+    def delete_reports(self, filenames):
+        """Remove reports from the store"""
+        with self.connection() as conn:
+            conn.executemany('DELETE FROM reports WHERE filename = ?', [(filename,) for filename in filenames])
+
+
+    def count(self):
+        """Count the stored reports"""
+        return self.connection().execute('SELECT COUNT(*) FROM reports').fetchone()[0]
+
+
+    def get_meta(self, key):
+        """Get a stored setting"""
+        row = self.connection().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+
+    def set_meta(self, key, value):
+        """Store a setting"""
+        with self.connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+
+    def migrate_json_reports(self, reports_dir, name_for, force=False, bundles=None):
+        """Import the existing JSON report files and bundled reports once
+
+        Runs in a single transaction and is recorded in the meta table, so
+        later starts skip it unless forced. Reports already in the store
+        are kept, and report files win over bundled copies. Bundled reports
+        are stored without their payload, like when they were bundled, so
+        a lost database can be rebuilt from the files and bundles. Returns
+        the number of reports read.
+        """
+        if self.get_meta('json_migrated') and not force:
+            return 0
+
+        rows = []
+        if os.path.exists(reports_dir):
+            for filename in sorted(os.listdir(reports_dir)):
+                if not filename.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(reports_dir, filename), 'r') as f:
+                        report_data = json.load(f)
+                    rows.append(self.report_row(filename, report_data, name_for(report_data.get('user_data', {}))) + (None,))
+                except (OSError, ValueError, AttributeError):
+                    # Skip files that can't be parsed
+                    continue
+
+        if bundles is not None:
+            for month in bundles.months():
+                try:
+                    for filename, report_data in bundles.reports(month):
+                        row = self.report_row(filename, report_data, name_for(report_data.get('user_data', {})))
+                        rows.append(row[:6] + ('',) + row[7:] + (month,))
+                except (OSError, ValueError, AttributeError, zlib.error):
+                    # Skip bundles that can't be read
+                    continue
+
+        with self.connection() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO reports (filename, date, name, user_type, country, total, payload, content_hash, facets, bundle) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', '1')")
+
+        return len(rows)
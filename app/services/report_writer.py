@@ -0,0 +1,141 @@
+"""
+Report Writer:
+    Write-behind queue persisting reports on a background thread
+"""
+
+
+import time
+import queue
+import threading
+
+
+class ReportWriter:
+    """Bounded queue drained in batches by a writer thread
+
+    submit() returns as soon as an item is queued and only blocks while the
+    queue is full. The writer thread takes up to batch_size queued items at
+    a time and hands them to write_batch together, which returns the items
+    it could not write. Those are retried up to max_attempts times in all.
+    """
+
+    def __init__(self, write_batch, max_queue=1000, batch_size=50, max_attempts=3, retry_delay=0.5):
+        """Initializing the queue and starting the writer thread"""
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.closed = False
+
+        self.metrics = {
+            'written': 0,
+            'failed': 0,
+            'batches': 0,
+            'max_queue_depth': 0,
+            'total_latency': 0.0,
+            'max_latency': 0.0,
+            'last_batch_time': 0.0,
+        }
+
+        self.thread = threading.Thread(target=self.run, name='report-writer', daemon=True)
+        self.thread.start()
+
+
+    def submit(self, item):
+        """Queue an item for writing"""
+        if self.closed:
+            raise RuntimeError('Report writer is closed')
+
+        self.queue.put((time.perf_counter(), item))
+
+        with self.lock:
+            self.metrics['max_queue_depth'] = max(self.metrics['max_queue_depth'], self.queue.qsize())
+
+
+    def run(self):
+        """Write queued items until the writer is closed"""
+        while True:
+            entries = [self.queue.get()]
+
+            # Taking whatever else is already waiting, up to a batch
+            while len(entries) < self.batch_size:
+                try:
+                    entries.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            items = [entry for entry in entries if entry is not None]
+            stopping = len(items) < len(entries)
+
+            if items:
+                self.write(items)
+
+            for _ in entries:
+                self.queue.task_done()
+
+            if stopping:
+                return
+
+
+    def write(self, items):
+        """Write a batch and record its metrics, retrying the items that failed"""
+        started = time.perf_counter()
+
+        remaining = items
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(self.retry_delay)
+
+            try:
+                failed = {id(item) for item in self.write_batch([item for queued_at, item in remaining]) or ()}
+            except Exception as e:
+                print(f"Error writing reports: {e}")
+                continue
+
+            remaining = [entry for entry in remaining if id(entry[1]) in failed]
+            if not remaining:
+                break
+
+        finished = time.perf_counter()
+
+        with self.lock:
+            self.metrics['batches'] += 1
+            self.metrics['last_batch_time'] = finished - started
+            self.metrics['failed'] += len(remaining)
+
+            failed = {id(entry) for entry in remaining}
+            for entry in items:
+                if id(entry) in failed:
+                    continue
+
+                latency = finished - entry[0]
+                self.metrics['written'] += 1
+                self.metrics['total_latency'] += latency
+                self.metrics['max_latency'] = max(self.metrics['max_latency'], latency)
+
+
+    def flush(self):
+        """Wait until every queued item is written"""
+        self.queue.join()
+
+
+    def close(self):
+        """Write the remaining items and stop the writer thread"""
+        if self.closed:
+            return
+        self.closed = True
+
+        self.queue.put(None)
+        self.thread.join()
+
+
+    def stats(self):
+        """Get the queue depth and write latency metrics"""
+        with self.lock:
+            stats = dict(self.metrics)
+
+        total_latency = stats.pop('total_latency')
+        stats['queue_depth'] = self.queue.qsize()
+        stats['average_latency'] = total_latency / stats['written'] if stats['written'] else 0.0
+        return stats
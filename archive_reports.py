@@ -0,0 +1,32 @@
+"""
+Carbon Footprint Monitor - Archive Reports
+Moves older reports into compressed monthly bundles and applies the retention policy
+"""
+
+import argparse
+import sys
+
+from app.services.data_service import DataService, HOT_DAYS
+
+
+def main(argv=None):
+    """Run the report archiving from the command line"""
+    parser = argparse.ArgumentParser(description='Move older carbon footprint reports into monthly bundles')
+    parser.add_argument('--reports-dir', help='reports directory (default: app/reports)')
+    parser.add_argument('--hot-days', type=int, default=HOT_DAYS,
+                        help=f'bundle reports older than this many days (default: {HOT_DAYS})')
+    parser.add_argument('--retention-days', type=int,
+                        help='reduce whole months older than this many days to monthly aggregates')
+    args = parser.parse_args(argv)
+
+    service = DataService(args.reports_dir, write_behind=False, hot_days=args.hot_days,
+                          retention_days=args.retention_days)
+    summary = service.archive_old_reports()
+
+    print(f"Reports bundled: {summary['bundled']}, reduced to aggregates: {summary['rolled_up']}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""
+Carbon Footprint Monitor - Bulk Import
+Scores a CSV or JSONL file of profiles and saves a report for every row
+
+Columns use the dotted user_data paths, for example:
+    user_type,name,household_size,transportation.car.weekly_km,energy.electricity.monthly_kwh
+"""
+
+import argparse
+import sys
+
+from app.services.data_service import DataService
+from app.services.import_service import ImportService
+
+
+def main(argv=None):
+    """Run the bulk import from the command line"""
+    parser = argparse.ArgumentParser(description='Score a CSV or JSONL file of carbon footprint profiles')
+    parser.add_argument('path', help='CSV or JSONL file with one profile per row')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='file format (default: from the extension)')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=500, help='rows scored per worker task')
+    parser.add_argument('--dry-run', action='store_true', help='score rows without saving reports')
+    parser.add_argument('--reports-dir', help='reports directory (default: app/reports)')
+    args = parser.parse_args(argv)
+
+    def report_error(line_number, message):
+        print(f"Line {line_number}: {message}", file=sys.stderr)
+
+    # A dry run only scores rows, so the report store isn't opened
+    data_service = None if args.dry_run else DataService(args.reports_dir)
+    service = ImportService(data_service, workers=args.workers, chunk_size=args.chunk_size)
+    summary = service.import_file(args.path, args.format, save=not args.dry_run, on_error=report_error)
+
+    print(f"Rows: {summary['rows']}, saved: {summary['saved']}, duplicates: {summary['duplicates']}, "
+          f"failed: {summary['failed']}, total footprint: {summary['total_footprint']:.2f} kg CO2e")
+
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
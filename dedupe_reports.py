@@ -0,0 +1,34 @@
+"""
+Carbon Footprint Monitor - Deduplicate Reports
+Removes saved reports whose content repeats an older report, keeping the oldest copy
+"""
+
+import argparse
+import sys
+
+from app.services.data_service import DataService, REPORTS_DIR, preview_deduplicate
+
+
+def main(argv=None):
+    """Run the deduplication from the command line"""
+    parser = argparse.ArgumentParser(description='Remove duplicate carbon footprint reports')
+    parser.add_argument('--reports-dir', help='reports directory (default: app/reports)')
+    parser.add_argument('--dry-run', action='store_true', help='count duplicates without removing them')
+    args = parser.parse_args(argv)
+
+    # A dry run reads a copy of the store, without starting the data service
+    if args.dry_run:
+        summary = preview_deduplicate(args.reports_dir or REPORTS_DIR)
+    else:
+        summary = DataService(args.reports_dir, write_behind=False).deduplicate()
+
+    action = 'duplicates found' if args.dry_run else 'duplicates removed'
+    freed = 'can be freed' if args.dry_run else 'freed'
+    print(f"Reports: {summary['reports']}, {action}: {summary['duplicates']}, "
+          f"{freed}: {summary['bytes_freed'] / 1024:.1f} KB")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+Carbon Footprint Monitor - Benchmark Service Tests
+Circuit breaker, failure caching and the data snapshot against a local stand-in for the OWID API
+"""
+
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.services.benchmark_service import BenchmarkService, CircuitBreaker
+
+
+CSV = b'Entity,Year,Per capita CO2\nGermany,2021,8.1\nWorld,2021,4.7\n'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves the OWID CSV, slowly or failing depending on the server mode"""
+
+    def do_GET(self):
+        self.server.hits += 1
+
+        if self.server.mode == 'slow':
+            time.sleep(self.server.delay)
+
+        try:
+            if self.server.mode in ('slow', 'fail'):
+                self.send_response(500)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(CSV)))
+            self.end_headers()
+            self.wfile.write(CSV)
+
+        except OSError:
+            # The client gave up on a slow response
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """Local HTTP server standing in for the OWID API"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.mode = 'ok'
+    server.delay = 1.0
+    server.hits = 0
+    server.url = f'http://127.0.0.1:{server.server_port}/owid.csv'
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def service(server, tmp_path, monkeypatch):
+    """Benchmark service with its cache in a temporary directory"""
+    monkeypatch.chdir(tmp_path)
+    return BenchmarkService(url=server.url, timeout=0.3)
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=60)
+
+    breaker.record_failure()
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_breaker_probe_closes_or_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.state == 'half-open'
+
+    # Only one probe at a time
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_success_is_cached(service, server):
+    assert service.get_benchmarks('Germany')['country_avg'] == 8.1
+    assert service.get_benchmarks('Germany')['country_avg'] == 8.1
+    assert server.hits == 1
+
+
+def test_slow_outage_costs_one_timeout(service, server):
+    server.mode = 'slow'
+
+    start = time.perf_counter()
+    for _ in range(20):
+        benchmarks = service.get_benchmarks('Germany')
+    elapsed = time.perf_counter() - start
+
+    # The failure is cached, so only the first request waits for the timeout
+    assert server.hits == 1
+    assert elapsed < 2
+    assert benchmarks == service.get_fallback_benchmarks('Germany')
+
+
+def test_failures_open_the_circuit(service, server):
+    server.mode = 'fail'
+    service.failure_ttl = 0
+
+    for _ in range(10):
+        service.get_benchmarks('Germany')
+
+    assert service.breaker.state == 'open'
+    assert server.hits == service.breaker.failure_threshold
+
+
+def test_half_open_probe_recovers(service, server):
+    server.mode = 'fail'
+    service.failure_ttl = 0
+    service.breaker.cooldown = 0
+    for _ in range(service.breaker.failure_threshold):
+        service.get_benchmarks('Germany')
+    assert service.breaker.state == 'open'
+
+    server.mode = 'ok'
+    assert service.get_benchmarks('Germany')['country_avg'] == 8.1
+    assert service.breaker.state == 'closed'
+
+
+def test_held_lock_keeps_breaker_open(service, server):
+    server.mode = 'fail'
+    service.failure_ttl = 0
+    service.breaker.cooldown = 0
+    for _ in range(service.breaker.failure_threshold):
+        service.get_benchmarks('Germany')
+    hits = server.hits
+
+    # Another process is fetching, so no probe is taken
+    assert service.acquire_lock_file()
+    assert service.load_index() is None
+    assert service.breaker.state == 'open'
+    assert server.hits == hits
+
+    # Once the lock is released the probe goes through
+    service.release_lock_file()
+    server.mode = 'ok'
+    assert service.load_index() is not None
+    assert service.breaker.state == 'closed'
+
+
+def test_cached_snapshot_serves_benchmarks(service, server):
+    assert service.get_benchmarks('Germany')['country_avg'] == 8.1
+
+    # A new process reads the snapshot written by the first one instead of the API
+    cached = BenchmarkService(url=server.url, timeout=0.3)
+    assert cached.get_benchmarks('Germany')['country_avg'] == 8.1
+    assert server.hits == 1
+
+    assert dict(cached.snapshot['Germany']) == {2021: 8.1}
+    assert cached.snapshot == {'Germany': {2021: 8.1}, 'World': {2021: 4.7}}
+
+
+def test_expired_snapshot_is_served_while_refreshing(service, server):
+    assert service.get_benchmarks('Germany')['country_avg'] == 8.1
+
+    # A new process finds only an expired snapshot and the API down
+    expired = time.time() - service.cache_duration.total_seconds() - 60
+    os.utime(service.cache_file, (expired, expired))
+    server.mode = 'fail'
+
+    stale = BenchmarkService(url=server.url, timeout=0.3)
+    assert stale.get_benchmarks('Germany')['country_avg'] == 8.1
+    assert stale.index['expires'] < time.time()
+
+    # The failed refresh in the background keeps the stale benchmarks a while longer
+    with stale.refresh_lock:
+        pass
+    assert server.hits == 2
+    assert stale.get_benchmarks('Germany')['country_avg'] == 8.1
+    assert stale.index['expires'] > time.time()
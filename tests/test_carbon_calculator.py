@@ -0,0 +1,95 @@
+"""
+Carbon Footprint Monitor - Carbon Calculator Tests
+Footprint calculations, batch scoring and uncertainty bands
+"""
+
+import math
+import random
+
+import pytest
+
+from app.models.carbon_calculator import CarbonCalculator
+
+
+# Profile whose reductions cover all of its food, waste and products
+FULL_REDUCTION_PROFILE = {
+    'user_type': 'Individual',
+    'waste': {'general_waste': {'weekly_kg': 5}, 'composting': True},
+    'food': {'diet_type': 'vegan', 'local_food_percentage': 100},
+    'products': {'monthly_spending': {'clothing': 100, 'electronics': 50}, 'secondhand_percentage': 100},
+}
+
+
+def random_profile(rng):
+    """Random profile with a random subset of the categories filled in"""
+    profile = {'user_type': rng.choice(['Organization', 'Individual']), 'country': rng.choice(['Germany', 'France'])}
+    if profile['user_type'] == 'Organization':
+        profile['employees'] = rng.choice([0, 1, 50])
+    else:
+        profile['household_size'] = rng.choice([0, 1, 3])
+
+    if rng.random() < 0.9:
+        profile['transportation'] = {
+            'car': {'weekly_km': rng.uniform(0, 300), 'fuel_type': rng.choice(['petrol', 'diesel', 'electric', 'hydrogen'])},
+            'public_transport': {'weekly_km': rng.uniform(0, 100)},
+            'air_travel': {'short_flights': rng.randint(0, 4), 'long_flights': rng.randint(0, 2)},
+        }
+    if rng.random() < 0.9:
+        profile['energy'] = {'electricity': {'monthly_kwh': rng.uniform(0, 900), 'renewable_percentage': rng.uniform(0, 100)},
+                             'gas': {'monthly_usage': rng.uniform(0, 80)},
+                             'heating_oil': {'monthly_litres': rng.choice([0, rng.uniform(0, 100)])}}
+    if rng.random() < 0.9:
+        profile['waste'] = {'general_waste': {'weekly_kg': rng.uniform(0, 20)},
+                            'recycling': {'paper': rng.uniform(0, 3), 'plastic': rng.uniform(0, 3), 'metal': 1},
+                            'composting': rng.random() < 0.5}
+    if rng.random() < 0.9:
+        profile['food'] = {'diet_type': rng.choice(['omnivore', 'vegan', 'vegetarian', 'pescatarian', 'keto']),
+                           'local_food_percentage': rng.choice([0, 30, 100])}
+        if rng.random() < 0.5:
+            profile['food']['meat_consumption'] = {'red_meat': rng.uniform(0, 2), 'fish': rng.uniform(0, 1)}
+    if rng.random() < 0.9:
+        profile['products'] = {'monthly_spending': {'clothing': rng.uniform(0, 200), 'electronics': rng.uniform(0, 100),
+                                                    'furniture': rng.uniform(0, 100)},
+                               'secondhand_percentage': rng.choice([0, 40])}
+    return profile
+
+
+def leaves(values, prefix=''):
+    """Flatten nested breakdown values into dotted names"""
+    flat = {}
+    for name, value in values.items():
+        if isinstance(value, dict):
+            flat.update(leaves(value, f"{prefix}{name}."))
+        else:
+            flat[prefix + name] = value
+    return flat
+
+
+def test_batch_matches_single_profiles():
+    calculator = CarbonCalculator()
+    profiles = [random_profile(random.Random(seed)) for seed in range(200)]
+    batch = calculator.calculate_batch(calculator.profiles_to_columns(profiles))
+
+    for i, profile in enumerate(profiles):
+        single = calculator.calculate_footprint(profile)
+
+        assert batch['total'][i] == pytest.approx(single['total'])
+        if single.get('per_capita') is None:
+            assert math.isnan(batch['per_capita'][i])
+        else:
+            assert batch['per_capita'][i] == pytest.approx(single['per_capita'])
+
+        for category, values in single['categories'].items():
+            assert batch['categories'][category]['total'][i] == pytest.approx(values['total'])
+            batch_breakdown = leaves(batch['categories'][category]['breakdown'])
+            for name, value in leaves(values['breakdown']).items():
+                assert batch_breakdown[name][i] == pytest.approx(value), (category, name)
+
+
+def test_uncertainty_bands_are_not_negative():
+    calculator = CarbonCalculator()
+    bands = calculator.calculate_uncertainty(FULL_REDUCTION_PROFILE, samples=20000, seed=1)
+
+    for values in [bands['total']] + list(bands['categories'].values()):
+        assert values['p5'] >= 0
+        assert values['p5'] <= values['p50'] <= values['p95']
@@ -0,0 +1,237 @@
+"""
+Carbon Footprint Monitor - Data Service Tests
+Report storage, retention and maintenance on copies of the sample reports
+"""
+
+import datetime
+import glob
+import json
+import os
+import shutil
+
+import pytest
+
+from app.services.data_service import DataService, preview_deduplicate
+from app.services.ranking_service import RankingService, footprint_value
+
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'app', 'reports')
+
+
+@pytest.fixture
+def reports_dir(tmp_path):
+    """Copy of the sample reports in a temporary directory"""
+    for filepath in glob.glob(os.path.join(SAMPLE_DIR, '*.json')):
+        shutil.copy(filepath, tmp_path)
+    return str(tmp_path)
+
+
+def test_retention_keeps_archive_after_restart(reports_dir):
+    service = DataService(reports_dir, write_behind=False)
+    reports = service.store.count()
+    assert service.archive.count() == reports
+    assert service.history.count() == reports
+
+    rolled_up = service.roll_up_before('2025-06-01')
+    assert 0 < rolled_up < reports
+
+    # The archive and ranking keep the rolled-up footprints, the history drops them
+    assert service.store.count() == reports - rolled_up
+    assert service.archive.count() == reports
+    assert service.ranking.count == reports
+    assert service.history.count() == service.store.count()
+
+    restarted = DataService(reports_dir, write_behind=False)
+    assert restarted.archive.count() == reports
+    assert restarted.ranking.count == reports
+    assert restarted.history.count() == restarted.store.count()
+    assert restarted.archive.aggregate('total', statistic='count', end='2025-06-01') == rolled_up
+
+    # Rebuilding from the store also keeps them
+    restarted.rebuild_archive()
+    assert restarted.archive.count() == reports
+
+
+def test_monthly_rollups_apply_resubmitted_months(reports_dir):
+    service = DataService(reports_dir, write_behind=False)
+    profile = {'user_type': 'Organization', 'org_name': 'Acme', 'country': 'France', 'employees': 10}
+
+    def month(kwh):
+        return dict(profile, energy={'electricity': {'monthly_kwh': kwh}})
+
+    january = service.add_month(month(1000), '2025-01').get_month('2025-01')['total']
+    service.add_month(month(2000), '2025-02')
+    series = service.add_month(month(500), '2025-01')
+    february = series.get_month('2025-02')['total']
+
+    # The resubmitted month replaces its earlier footprint in the rollups
+    quarter = series.get_quarter(2025, 1)
+    assert quarter['months'] == 2
+    assert quarter['total'] == pytest.approx(january / 2 + february)
+    assert series.year_to_date('2025-01')['total'] == pytest.approx(january / 2)
+
+    stored = DataService(reports_dir, write_behind=False).get_timeseries(service.get_entity_key(profile))
+    assert stored.quarters == series.quarters
+    assert stored.years == series.years
+
+
+@pytest.mark.parametrize('month', [202503, None, ['2025', '03'], '2025'])
+def test_invalid_months_are_rejected(reports_dir, month):
+    service = DataService(reports_dir, write_behind=False)
+    with pytest.raises(ValueError):
+        service.add_month({'user_type': 'Individual', 'name': 'Ada'}, month)
+
+
+def test_history_series_matches_stored_rows(reports_dir):
+    service = DataService(reports_dir, write_behind=False)
+    key = service.store.connection().execute(
+        'SELECT entity_key FROM entities ORDER BY reports DESC, entity_key').fetchone()[0]
+
+    series = service.get_entity_history(key)['series']
+    rows = service.store.connection().execute(
+        'SELECT * FROM entity_reports WHERE entity_key = ? ORDER BY date, filename', (key,)).fetchall()
+    assert len(series) == len(rows) > 1
+
+    for entry, row in zip(series, rows):
+        assert entry.to_dict() == {
+            'filename': row['filename'], 'date': row['date'], 'total': row['total'], 'delta': row['delta'],
+            'moving_average': row['moving_average'], 'categories': json.loads(row['categories']),
+            'category_changes': json.loads(row['category_changes']) if row['category_changes'] else None,
+        }
+    assert series[-1].filename == rows[-1]['filename']
+    assert [entry.date for entry in reversed(series)] == [row['date'] for row in reversed(rows)]
+
+
+def write_report(reports_dir, filename, date, user_data, total):
+    """Write a report file as saved by DataService.save_report"""
+    report_data = {'user_data': user_data, 'footprint_data': {'total': total, 'categories': {}}, 'date': date}
+    with open(os.path.join(reports_dir, filename), 'w') as f:
+        json.dump(report_data, f)
+
+
+@pytest.mark.parametrize('sort', ['newest', 'oldest'])
+def test_report_pages_have_no_gaps_or_duplicates(tmp_path, sort):
+    # Reports sharing their date are ordered by filename
+    for i in range(23):
+        write_report(tmp_path, f"report_{i:02d}.json", f"2025-01-{i // 5 + 1:02d} 12:00:00",
+                     {'user_type': 'Individual', 'name': f"Person {i}"}, i)
+    service = DataService(str(tmp_path), write_behind=False)
+
+    filenames = []
+    pages = []
+    cursor = None
+    while True:
+        page = service.get_reports_page(page_size=4, after=cursor, sort=sort)
+        pages.append(page)
+        filenames.extend(report['filename'] for report in page['reports'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    expected = sorted(f"report_{i:02d}.json" for i in range(23))
+    assert filenames == (expected if sort == 'oldest' else expected[::-1])
+
+    # Paging back from the last page gives the same pages
+    for previous, page in zip(reversed(pages[:-1]), reversed(pages[1:])):
+        assert service.get_reports_page(page_size=4, before=page['previous_cursor'], sort=sort)['reports'] == \
+            previous['reports']
+
+
+def tree_contents(path):
+    """Map every file under a directory to its contents, leaving out SQLite's shared memory index"""
+    contents = {}
+    for root, dirs, files in os.walk(path):
+        for filename in files:
+            if not filename.endswith('-shm'):
+                filepath = os.path.join(root, filename)
+                with open(filepath, 'rb') as f:
+                    contents[os.path.relpath(filepath, path)] = f.read()
+    return contents
+
+
+def test_deduplicate_keeps_oldest_copy(tmp_path):
+    reports_dir = str(tmp_path)
+    user_data = {'user_type': 'Individual', 'name': 'Ada'}
+    write_report(reports_dir, 'report_a.json', '2024-01-05 10:00:00', user_data, 10)
+    write_report(reports_dir, 'report_b.json', '2024-01-20 10:00:00', user_data, 10)
+    write_report(reports_dir, 'report_c.json', '2025-06-01 10:00:00', user_data, 10)
+    write_report(reports_dir, 'report_d.json', '2025-06-02 10:00:00', user_data, 20)
+
+    # The two oldest copies are moved into a bundle
+    service = DataService(reports_dir, write_behind=False, hot_days=365)
+    assert service.archive_old_reports(now=datetime.datetime(2025, 7, 1))['bundled'] == 2
+    service.close()
+    service.store.connection().close()
+
+    before = tree_contents(reports_dir)
+    summary = preview_deduplicate(reports_dir)
+    assert summary['reports'] == 4
+    assert summary['duplicates'] == 2
+    assert summary['bytes_freed'] > 0
+    assert tree_contents(reports_dir) == before
+
+    service = DataService(reports_dir, write_behind=False)
+    assert service.deduplicate()['duplicates'] == 2
+
+    assert [report['filename'] for report in service.get_reports_page(sort='oldest')['reports']] == \
+        ['report_a.json', 'report_d.json']
+    assert not os.path.exists(os.path.join(reports_dir, 'report_c.json'))
+    assert [filename for filename, report_data in service.bundles.reports('2024-01')] == ['report_a.json']
+    assert service.get_report('report_a.json')['footprint_data']['total'] == 10
+    assert service.archive.count() == 2
+    assert service.history.count() == 2
+
+
+def test_ranking_follows_other_processes(reports_dir):
+    service = DataService(reports_dir, write_behind=False)
+    other = DataService(reports_dir, write_behind=False)
+    ranked = service.ranking.count
+
+    # A report saved by another process is ranked and found once the archive changed
+    other.save_report({'user_type': 'Individual', 'name': 'Ada', 'country': 'Iceland', 'household_size': 1},
+                      {'total': 1.0, 'per_capita': 1.0, 'categories': {}})
+    assert service.get_report_percentile(1.0) < 100 / ranked
+    assert service.ranking.count == ranked + 1
+    assert len(service.search_reports({'country': 'Iceland'})) == 1
+
+
+def test_organization_without_employees_is_not_ranked(reports_dir):
+    service = DataService(reports_dir, write_behind=False)
+    ranked = service.ranking.count
+
+    service.save_report({'user_type': 'Organization', 'org_name': 'Acme', 'employees': 0},
+                        {'total': 500000.0, 'categories': {}})
+    assert service.ranking.count == ranked
+
+    ranking = RankingService(None, service)
+    assert footprint_value({'total': 500000.0}, 'Organization') is None
+    assert ranking.rank({'total': 500000.0}, 'Organization')['reports'] is None
+
+
+def test_country_spellings_are_one_entity(tmp_path):
+    reports_dir = str(tmp_path)
+    for i, country in enumerate(['DE', 'Deutschland', ' germany ']):
+        write_report(reports_dir, f"report_{i}.json", f"2025-0{i + 1}-01 10:00:00",
+                     {'user_type': 'Organization', 'org_name': 'Acme', 'country': country, 'employees': 5}, 10 + i)
+    service = DataService(reports_dir, write_behind=False)
+
+    key = service.get_entity_key({'user_type': 'Organization', 'org_name': 'Acme', 'country': 'DEU'})
+    assert key == 'acme|germany'
+    assert service.get_entity_history(key)['reports'] == 3
+    assert service.index.facet_values('country') == {'Germany': 3}
+    assert len(service.search_reports({'country': 'de'})) == 3
+
+    # Keys and facets stored before countries were canonicalized are moved on the next start
+    service.add_month({'user_type': 'Organization', 'org_name': 'Acme', 'country': 'DE', 'employees': 5}, '2025-01')
+    with service.store.connection() as conn:
+        conn.execute("UPDATE entity_months SET entity_key = 'acme|de'")
+        conn.execute("UPDATE entity_reports SET entity_key = 'acme|de' WHERE filename = 'report_0.json'")
+        conn.execute("UPDATE reports SET facets = json_set(facets, '$.country', 'DE') WHERE filename = 'report_0.json'")
+        conn.execute("DELETE FROM meta WHERE key = 'entity_keys'")
+        conn.execute('PRAGMA user_version = 1')
+
+    restarted = DataService(reports_dir, write_behind=False)
+    assert restarted.get_entity_history(key)['reports'] == 3
+    assert restarted.get_timeseries(key).get_month('2025-01') is not None
+    assert restarted.get_timeseries(key).get_quarter(2025, 1)['months'] == 1
+    assert len(restarted.search_reports({'country': 'Germany'})) == 3
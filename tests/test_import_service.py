@@ -0,0 +1,28 @@
+"""
+Carbon Footprint Monitor - Import Service Tests
+Bulk import summaries against a temporary reports directory
+"""
+
+from app.services.data_service import DataService
+from app.services.import_service import ImportService
+
+
+def test_import_counts_duplicates_and_failures(tmp_path):
+    path = tmp_path / 'profiles.csv'
+    path.write_text('user_type,name,household_size,energy.electricity.monthly_kwh\n'
+                    'Individual,Ada,1,100\n'
+                    'Individual,Ada,1,100\n'
+                    'Individual,Bo,2,not a number\n'
+                    'Individual,Cy,2,50\n')
+
+    data_service = DataService(str(tmp_path / 'reports'), write_behind=False)
+    errors = []
+    summary = ImportService(data_service, workers=1).import_file(
+        str(path), on_error=lambda line_number, message: errors.append(line_number))
+
+    assert summary['rows'] == 4
+    assert summary['saved'] == 2
+    assert summary['duplicates'] == 1
+    assert summary['failed'] == 1
+    assert errors == [4]
+    assert data_service.store.count() == 2
@@ -0,0 +1,84 @@
+"""
+Carbon Footprint Monitor - Reduction Optimizer Tests
+Pruned portfolio search against enumerating every portfolio
+"""
+
+import itertools
+import random
+
+import pytest
+
+from app.models.carbon_calculator import CarbonCalculator
+from app.models.reduction_optimizer import ReductionOptimizer
+
+
+def small_profile(rng):
+    """Random profile with a few of the reduction targets"""
+    profile = {'user_type': 'Individual', 'household_size': 1}
+    if rng.random() < 0.7:
+        profile['transportation'] = {'car': {'weekly_km': rng.uniform(0, 300),
+                                             'fuel_type': rng.choice(['petrol', 'diesel', 'electric'])},
+                                     'air_travel': {'long_flights': rng.randint(0, 2)}}
+    if rng.random() < 0.7:
+        profile['energy'] = {'electricity': {'monthly_kwh': rng.uniform(0, 600),
+                                             'renewable_percentage': rng.choice([0, 50, 100])},
+                             'gas': {'monthly_usage': rng.uniform(0, 50)}}
+    if rng.random() < 0.5:
+        profile['waste'] = {'general_waste': {'weekly_kg': rng.uniform(0, 15)}, 'composting': rng.random() < 0.5}
+    if rng.random() < 0.7:
+        profile['food'] = {'diet_type': rng.choice(['omnivore', 'vegetarian', 'vegan']),
+                           'local_food_percentage': rng.choice([0, 50])}
+    if rng.random() < 0.5:
+        profile['products'] = {'monthly_spending': {'clothing': rng.uniform(0, 150)},
+                               'secondhand_percentage': rng.choice([0, 50])}
+    return profile
+
+
+def brute_force(optimizer, footprint_data, top_n, budget, user_data):
+    """Savings of the top portfolios, trying every valid combination of actions"""
+    actions, values = optimizer.applicable_actions(footprint_data, user_data)
+
+    # One choice per exclusive group, none or one of its actions
+    choices = {}
+    for action in actions:
+        choices.setdefault(action['group'] or action['name'], []).append(action)
+
+    ranked = []
+    for portfolio in itertools.product(*([None] + options for options in choices.values())):
+        chosen = [action for action in portfolio if action is not None]
+        effort = sum(action['effort'] for action in chosen)
+        if budget is not None and effort > budget:
+            continue
+
+        savings = 0.0
+        for target in {target for action in chosen for target in action['targets']}:
+            remaining = values.get(target, 0.0)
+            for action in chosen:
+                if target in action['targets'] and action['kind'] == 'fraction':
+                    remaining *= 1 - action['value']
+            for action in chosen:
+                if target in action['targets'] and action['kind'] == 'absolute':
+                    remaining = max(0.0, remaining - action['value'])
+            savings += values.get(target, 0.0) - remaining
+
+        if savings > 0:
+            ranked.append((savings, effort))
+
+    ranked.sort(key=lambda item: (-item[0], item[1]))
+    return ranked[:top_n]
+
+
+@pytest.mark.parametrize('budget', [None, 4, 8])
+def test_optimizer_matches_brute_force(budget):
+    calculator = CarbonCalculator()
+    optimizer = ReductionOptimizer()
+
+    for seed in range(40):
+        profile = small_profile(random.Random(seed))
+        footprint_data = calculator.calculate_footprint(profile)
+
+        portfolios = optimizer.optimize(footprint_data, top_n=5, budget=budget, user_data=profile)
+        expected = brute_force(optimizer, footprint_data, 5, budget, profile)
+
+        assert [portfolio['savings'] for portfolio in portfolios] == pytest.approx([savings for savings, _ in expected])
+        assert [portfolio['effort'] for portfolio in portfolios] == pytest.approx([effort for _, effort in expected])
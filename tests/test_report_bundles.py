@@ -0,0 +1,31 @@
+"""
+Carbon Footprint Monitor - Report Bundles Tests
+Bundle rewrites seen by other readers of the same bundles directory
+"""
+
+import os
+
+from app.services.report_bundles import ReportBundles
+
+
+def test_discard_is_seen_by_other_readers(tmp_path):
+    writer = ReportBundles(str(tmp_path))
+    reader = ReportBundles(str(tmp_path))
+    writer.add('2025-01', [(f"report_{i}.json", {'total': i}) for i in range(3)])
+
+    # The reader caches the index before the bundle is rewritten
+    assert reader.get('2025-01', 'report_2.json') == {'total': 2}
+
+    assert writer.discard('2025-01', ['report_0.json']) > 0
+    assert sorted(os.listdir(tmp_path)) == ['2025-01.1.bundle', '2025-01.index']
+
+    assert reader.get('2025-01', 'report_0.json') is None
+    assert reader.get('2025-01', 'report_2.json') == {'total': 2}
+    assert dict(reader.reports('2025-01')) == {'report_1.json': {'total': 1}, 'report_2.json': {'total': 2}}
+
+    # Appending goes to the rewritten bundle
+    writer.add('2025-01', [('report_3.json', {'total': 3})])
+    assert reader.get('2025-01', 'report_3.json') == {'total': 3}
+
+    writer.remove('2025-01')
+    assert os.listdir(tmp_path) == []
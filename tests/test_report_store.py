@@ -0,0 +1,52 @@
+"""
+Carbon Footprint Monitor - Report Store Tests
+Schema migrations of the report database
+"""
+
+import sqlite3
+
+from app.services import report_store
+from app.services.report_store import MIGRATIONS, ReportStore
+
+
+def schema(db_path):
+    """Get the schema version and the definitions of every table and index"""
+    conn = sqlite3.connect(db_path)
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        return version, sorted(conn.execute('SELECT type, name, sql FROM sqlite_master'))
+    finally:
+        conn.close()
+
+
+def test_store_before_versions_is_upgraded_once(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'reports.db')
+
+    # A store from before content hashes, bundles and facets, with its single-column indexes
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE reports (filename TEXT PRIMARY KEY, date TEXT NOT NULL, name TEXT,
+                              user_type TEXT, country TEXT, total REAL, payload TEXT NOT NULL);
+        CREATE INDEX idx_reports_date ON reports (date);
+        CREATE INDEX idx_reports_country ON reports (country);
+        INSERT INTO reports VALUES ('a.json', '2025-01-01 10:00:00', 'Ada', 'Individual', 'France', 1.0, '{}');
+    """)
+    conn.close()
+
+    store = ReportStore(db_path)
+    assert store.count() == 1
+    store.connection().close()
+
+    version, definitions = schema(db_path)
+    names = {name for kind, name, sql in definitions}
+    assert version == len(MIGRATIONS)
+    assert 'idx_reports_country_date' in names and 'idx_reports_content_hash' in names
+    assert 'idx_reports_date' not in names and 'idx_reports_country' not in names
+
+    # Later starts leave the schema alone
+    def migrate_again(conn):
+        raise AssertionError('migrated twice')
+    monkeypatch.setattr(report_store, 'MIGRATIONS', [migrate_again])
+
+    ReportStore(db_path).connection().close()
+    assert schema(db_path) == (version, definitions)